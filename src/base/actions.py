@@ -4,8 +4,8 @@ from datetime import timedelta
 from aiogram.types import CallbackQuery
 
 from base.mobs import generate_mob
-from base.player import check_user_stats, get_or_add_user_item
-from base.weather import get_weather
+from base.player import add_items, check_user_stats
+from base.weather import peek_weather
 from database.funcs import database
 from database.models import UserAction, UserModel
 from helpers.datetime_utils import utcnow
@@ -16,6 +16,7 @@ from helpers.utils import (
     get_time_difference_string,
     increment_achievement_progress,
 )
+from tasks.notification import notifier
 
 
 async def street(call: CallbackQuery, user: UserModel):
@@ -35,7 +36,8 @@ async def street(call: CallbackQuery, user: UserModel):
 
     if user.action is None:
         user.action = UserAction("street", current_time + timedelta(hours=1))
-        await database.users.async_update(**user.to_dict())
+        await database.users.async_update(user)
+        notifier.schedule(user)
     elif user.action.type != "street":
         await call.answer("Ты занят чем то другим", show_alert=True)
         return
@@ -57,7 +59,7 @@ async def street(call: CallbackQuery, user: UserModel):
                     return
                 user.met_mob = True
 
-                await database.users.async_update(**user.to_dict())
+                await database.users.async_update(user)
                 await mob.on_meet()
                 return
 
@@ -72,18 +74,19 @@ async def street(call: CallbackQuery, user: UserModel):
         )
         return
 
-    weather = get_weather()
+    # прогулка не ждет api погоды: пока прогноза нет, лут без погодных бонусов
+    weather = await peek_weather()
 
     snow = 2
     water = 2
-    if weather.current.temperature_2m <= -15:
+    if weather and weather.current.temperature_2m <= -15:
         snow = 10
-    elif weather.current.temperature_2m <= -5:
+    elif weather and weather.current.temperature_2m <= -5:
         snow = 5
 
-    if weather.current.type == "Snow":
+    if weather and weather.current.type == "Snow":
         snow *= 3
-    elif weather.current.type == "Rain":
+    elif weather and weather.current.type == "Rain":
         water *= 3
 
     loot_table = [
@@ -95,11 +98,12 @@ async def street(call: CallbackQuery, user: UserModel):
         ["конфета", (1, 7)],
     ]
 
-    if weather.current.temperature_2m < 0:
+    if weather and weather.current.temperature_2m < 0:
         loot_table.append(["снежок", (10 * snow, 20 * snow)])
 
     xp = random.uniform(3.0, 5.0)
     loot = False
+    found_items: dict[str, int] = {}
     mess = "Ты прогулялся\n\n"
     for _ in range(random.randint(1, len(loot_table))):
         item_ = random.choice(loot_table)
@@ -112,33 +116,32 @@ async def street(call: CallbackQuery, user: UserModel):
 
             mess += f"+ {quantity} {item_[0]} {get_item_emoji(item_[0])}\n"
             if item_[0] == "бабло":
-                user.coin += quantity
-                await database.users.async_update(**user.to_dict())
+                user.inc(coin=quantity)
             else:
-                user_item = get_or_add_user_item(user, item_[0])
-                user_item.quantity += quantity
-                await database.items.async_update(**user_item.to_dict())
+                found_items[item_[0]] = found_items.get(item_[0], 0) + quantity
+
+    await add_items(user, found_items)
 
     if dog:
         dog.hunger += random.randint(0, 5)
         # dog.fatigue += random.randint(0, 10)
-        dog.xp += random.uniform(1.5, 2.5)
-        await database.dogs.async_update(**dog.to_dict())
+        dog.inc(xp=random.uniform(1.5, 2.5))
+        await database.dogs.async_update(dog)
 
-    user.xp += xp
+    user.inc(xp=xp)
     user.action = None
 
     user.hunger += random.randint(2, 5)
     user.fatigue += random.randint(3, 8)
     user.mood -= random.randint(3, 6)
     user.met_mob = False
-    await database.users.async_update(**user.to_dict())
-    increment_achievement_progress(user, "бродяга")
+    await database.users.async_update(user)
+    await increment_achievement_progress(user, "бродяга")
 
     try:
         user_notification = await database.notifications.async_get(owner=user._id)
         user_notification.walk = False
-        await database.notifications.async_update(**user_notification.to_dict())
+        await database.notifications.async_update(user_notification)
     except NoResult:
         pass
 
@@ -162,7 +165,8 @@ async def work(call: CallbackQuery, user: UserModel):
 
     if user.action is None:
         user.action = UserAction("work", current_time + timedelta(hours=3))
-        await database.users.async_update(**user.to_dict())
+        await database.users.async_update(user)
+        notifier.schedule(user)
     elif user.action.type != "work":
         await call.answer("Ты занят чем то другим", show_alert=True)
         return
@@ -185,22 +189,22 @@ async def work(call: CallbackQuery, user: UserModel):
 
     mess = f"Закончил работу\n\n+ {coin} бабло {get_item_emoji('бабло')}"
 
-    user.coin += coin
+    user.inc(coin=coin)
 
-    user.xp += xp
+    user.inc(xp=xp)
     user.action = None
 
     user.fatigue += random.randint(5, 10)
     user.hunger += random.randint(3, 6)
     user.mood -= random.randint(3, 6)
 
-    await database.users.async_update(**user.to_dict())
-    increment_achievement_progress(user, "работяга")
+    await database.users.async_update(user)
+    await increment_achievement_progress(user, "работяга")
 
     try:
         user_notification = await database.notifications.async_get(owner=user._id)
         user_notification.work = False
-        await database.notifications.async_update(**user_notification.to_dict())
+        await database.notifications.async_update(user_notification)
     except NoResult:
         pass
     await call.message.edit_text(mess)
@@ -212,7 +216,8 @@ async def sleep(call: CallbackQuery, user: UserModel):
 
     if user.action is None:
         user.action = UserAction("sleep", current_time + timedelta(hours=random.randint(3, 8)))
-        await database.users.async_update(**user.to_dict())
+        await database.users.async_update(user)
+        notifier.schedule(user)
     elif user.action.type != "sleep":
         await call.answer("Ты занят чем то другим", show_alert=True)
         return
@@ -229,18 +234,18 @@ async def sleep(call: CallbackQuery, user: UserModel):
 
     fatigue = random.randint(50, 100)
     user.fatigue -= fatigue
-    user.xp += random.uniform(1.5, 2.0)
+    user.inc(xp=random.uniform(1.5, 2.0))
     user.action = None
 
     try:
         user_notification = await database.notifications.async_get(owner=user._id)
         user_notification.sleep = False
-        await database.notifications.async_update(**user_notification.to_dict())
+        await database.notifications.async_update(user_notification)
     except NoResult:
         pass
 
-    await database.users.async_update(**user.to_dict())
-    increment_achievement_progress(user, "сонный")
+    await database.users.async_update(user)
+    await increment_achievement_progress(user, "сонный")
 
     mess = "Охх, хорошенько поспал"
     await call.message.edit_text(mess)
@@ -260,7 +265,8 @@ async def game(call: CallbackQuery, user: UserModel):
             current_time + timedelta(hours=random.randint(0, 3), minutes=random.randint(15, 20)),
         )
 
-        await database.users.async_update(**user.to_dict())
+        await database.users.async_update(user)
+        notifier.schedule(user)
     elif user.action.type != "game":
         await call.answer("Ты занят чем то другим", show_alert=True)
         return
@@ -276,7 +282,7 @@ async def game(call: CallbackQuery, user: UserModel):
         return
 
     user.fatigue += random.randint(0, 10)
-    user.xp += random.uniform(3.5, 5.7)
+    user.inc(xp=random.uniform(3.5, 5.7))
     user.mood += random.randint(5, 10)
     if random.randint(1, 100) < user.luck:
         user.mood *= 2
@@ -285,12 +291,12 @@ async def game(call: CallbackQuery, user: UserModel):
     try:
         user_notification = await database.notifications.async_get(owner=user._id)
         user_notification.game = False
-        await database.notifications.async_update(**user_notification.to_dict())
+        await database.notifications.async_update(user_notification)
     except NoResult:
         pass
 
-    await database.users.async_update(**user.to_dict())
-    increment_achievement_progress(user, "игроман")
+    await database.users.async_update(user)
+    await increment_achievement_progress(user, "игроман")
 
     mess = "Как же хорошо было играть 😊"
     await call.message.edit_text(mess)
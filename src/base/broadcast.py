@@ -0,0 +1,205 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Final, Optional
+
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import Message
+from bson import ObjectId
+from pymongo import ASCENDING
+
+from config import bot, logger
+from database.funcs import async_redis_cache, database
+from database.models import Row
+from helpers.enums import SendPriority
+from helpers.ratelimit import TokenBucket
+from helpers.utils import MessageEditor, safe
+from middlewares.outbound import send_priority
+
+LOCK_KEY: Final = "broadcast"
+STATE_KEY: Final = "broadcast:state"
+# лок продлевается на каждом чекпоинте, после падения бота он сам истечет
+LOCK_TTL: Final = 120
+
+BATCH_SIZE: Final = 200
+WORKERS: Final = 25
+# глобальный лимит телеграма ~30 сообщений в секунду, в один чат бродкаст пишет один раз
+RATE: Final = 25
+PROGRESS_INTERVAL: Final = 5
+# сколько раз бродкаст сам повторяет отправку после `TelegramRetryAfter`
+# (поверх повторов `OutboundMiddleware`)
+RETRY_ATTEMPTS: Final = 3
+
+
+@dataclass
+class BroadcastState:
+    text: str
+    total: int
+    last_id: Optional[ObjectId] = None
+    success: int = 0
+    fatal: int = 0
+    elapsed: float = 0
+
+    @property
+    def processed(self) -> int:
+        return self.success + self.fatal
+
+    def to_redis(self) -> dict[str, str]:
+        return {
+            "text": self.text,
+            "total": str(self.total),
+            "last_id": str(self.last_id or ""),
+            "success": str(self.success),
+            "fatal": str(self.fatal),
+            "elapsed": str(self.elapsed),
+        }
+
+    @classmethod
+    def from_redis(cls, data: dict[bytes, bytes]) -> "BroadcastState":
+        state = {key.decode(): value.decode() for key, value in data.items()}
+        return cls(
+            text=state["text"],
+            total=int(state["total"]),
+            last_id=ObjectId(state["last_id"]) if state["last_id"] else None,
+            success=int(state["success"]),
+            fatal=int(state["fatal"]),
+            elapsed=float(state["elapsed"]),
+        )
+
+
+async def get_state() -> Optional[BroadcastState]:
+    data = await async_redis_cache.hgetall(STATE_KEY)  # type: ignore
+    return BroadcastState.from_redis(data) if data else None
+
+
+async def clear_state():
+    await async_redis_cache.delete(STATE_KEY)
+
+
+async def acquire_lock() -> bool:
+    return bool(await async_redis_cache.set(LOCK_KEY, 1, nx=True, ex=LOCK_TTL))
+
+
+async def release_lock():
+    await async_redis_cache.delete(LOCK_KEY)
+
+
+async def new_state(text: str) -> BroadcastState:
+    total = await database.users.async_collection.estimated_document_count()
+    return BroadcastState(text=text, total=total)
+
+
+class Broadcast:
+    """
+    Рассылка `state.text` всем пользователям по возрастанию `_id`.
+
+    Отправки идут параллельно (`WORKERS`), а чекпоинт в редисе сдвигается до
+    последнего пользователя, перед которым все отправки уже закончились. После
+    падения бота повторно получат сообщение только те, чья отправка еще шла.
+    """
+
+    def __init__(self, state: BroadcastState, editor: MessageEditor):
+        self.state = state
+        self.editor = editor
+        self.bucket = TokenBucket(RATE)
+        self.workers = asyncio.Semaphore(WORKERS)
+        # отправки в порядке `_id`, из начала очереди забираются законченные
+        self._pending: deque[tuple[ObjectId, asyncio.Task[bool]]] = deque()
+        self._start_time = time.monotonic() - state.elapsed
+        self._last_progress = time.monotonic()
+
+    async def _send(self, chat_id: int) -> bool:
+        # каждый `_send` идет отдельной задачей, так что очередь меняется только у нее
+        send_priority.set(SendPriority.BROADCAST)
+        try:
+            for attempt in range(RETRY_ATTEMPTS):
+                await self.bucket.acquire()
+                try:
+                    await bot.send_message(chat_id, self.state.text)
+                    return True
+                except TelegramRetryAfter as e:
+                    # повторы `OutboundMiddleware` не помогли: сбавляем темп и ждем сами
+                    self.bucket.penalize(e.retry_after)
+                    if attempt < RETRY_ATTEMPTS - 1:
+                        await asyncio.sleep(e.retry_after)
+                except TelegramForbiddenError:
+                    # бот заблокирован, это не ошибка рассылки
+                    return False
+                except TelegramAPIError as e:
+                    logger.error(str(e))
+                    return False
+            logger.error(f"Бродкаст: не удалось отправить {chat_id} из-за лимитов")
+            return False
+        finally:
+            self.workers.release()
+
+    def _recipients(self) -> AsyncIterator[Row]:
+        query = {"_id": {"$gt": self.state.last_id}} if self.state.last_id else {}
+        return database.users.async_iter_rows(
+            query, ("_id", "id"), sort=[("_id", ASCENDING)], batch_size=BATCH_SIZE
+        )
+
+    async def _checkpoint(self):
+        async with async_redis_cache.pipeline() as pipe:
+            pipe.hset(STATE_KEY, mapping=self.state.to_redis())
+            pipe.expire(LOCK_KEY, LOCK_TTL)
+            await pipe.execute()
+
+    async def _collect(self):
+        """Учитывает законченные отправки из начала очереди и сдвигает чекпоинт."""
+        advanced = False
+        while self._pending and self._pending[0][1].done():
+            _id, task = self._pending.popleft()
+            if task.result():
+                self.state.success += 1
+            else:
+                self.state.fatal += 1
+            self.state.last_id = _id
+            advanced = True
+
+        if not advanced:
+            return
+        self.state.elapsed = time.monotonic() - self._start_time
+        await self._checkpoint()
+        self.bucket.recover()
+
+        if time.monotonic() - self._last_progress >= PROGRESS_INTERVAL:
+            self._last_progress = time.monotonic()
+            await safe(self.editor.status(self.progress()))
+
+    def progress(self) -> str:
+        return (
+            f"Отправлено: {self.state.processed}/{self.state.total}"
+            f" (ошибок: {self.state.fatal}, {self.bucket.rate:.0f} сообщ./с)"
+        )
+
+    async def run(self):
+        await self._checkpoint()
+
+        async for user in self._recipients():
+            # слот освобождает сама отправка, так что в работе не больше `WORKERS`
+            await self.workers.acquire()
+            self._pending.append((user._id, asyncio.create_task(self._send(user.id))))
+            await self._collect()
+
+        while self._pending:
+            await asyncio.wait([self._pending[0][1]])
+            await self._collect()
+
+
+async def run_broadcast(message: Message, state: BroadcastState):
+    async with MessageEditor(message, title="Бродкаст") as msg:
+        if state.last_id:
+            await msg.write(f"Продолжение с {state.processed}/{state.total}")
+        else:
+            await msg.write(f"Кол-во пользователей: {state.total}")
+
+        broadcast = Broadcast(state, msg)
+        await broadcast.run()
+        await clear_state()
+
+        await msg.write("Бродкаст закончился")
+        await msg.write(f"Время: {state.elapsed:_.2f} с.")
+        await msg.write(f"Кол-во юзеров получивших сообщение: {state.success}")
+        await msg.write(f"Кол-во ошибок: {state.fatal}")
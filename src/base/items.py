@@ -1,3 +1,5 @@
+from typing import Final
+
 from helpers.datatypes import Item
 from helpers.enums import ItemRarity, ItemType
 
@@ -386,3 +388,27 @@ ITEMS = [
         rarity=ItemRarity.LEGENDARY,
     ),
 ]
+
+
+# ---------------------------------------------------------------------------- #
+#                                    реестр                                    #
+# ---------------------------------------------------------------------------- #
+
+
+def _build_registry(items: list[Item]) -> dict[str, Item]:
+    registry: dict[str, Item] = {}
+    for item in items:
+        item.name = item.name.lower()
+        for key in (item.name, *(item.altnames or []), item.translit()):
+            registry.setdefault(key, item)
+    return registry
+
+
+ITEMS_REGISTRY: Final = _build_registry(ITEMS)
+
+TASK_ITEMS: Final = tuple(item for item in ITEMS if item.is_task_item)
+EXCHANGE_ITEMS: Final = tuple(item for item in ITEMS if item.can_exchange)
+CRAFTABLE_ITEMS: Final = tuple(item for item in ITEMS if item.craft)
+ITEMS_BY_RARITY: Final = {
+    rarity: tuple(item for item in ITEMS if item.rarity == rarity) for rarity in ItemRarity
+}
@@ -0,0 +1,185 @@
+import asyncio
+import math
+from dataclasses import dataclass
+from typing import Final, Optional
+
+from bson import ObjectId
+from pymongo import DESCENDING, ReturnDocument
+
+from base.items import ITEMS
+from config import logger
+from database.funcs import async_redis_cache, database
+from database.models import MarketItemModel, UserModel
+from helpers.utils import get_item
+
+PAGE_SIZE: Final = 6
+
+
+async def get_market_pages_count() -> int:
+    # рынок не фильтруется, так что хватает счетчика из метаданных коллекции
+    count = await database.market_items.async_collection.estimated_document_count()
+    return max(1, math.ceil(count / PAGE_SIZE))
+
+
+async def get_market_page(index: int) -> list[MarketItemModel]:
+    cursor = (
+        database.market_items.async_collection.find({})
+        .sort("published_at", DESCENDING)
+        .skip(index * PAGE_SIZE)
+        .limit(PAGE_SIZE)
+    )
+    return [database.market_items.model.from_dict(item) async for item in cursor]
+
+
+async def claim_market_item(_id: ObjectId, **filter_) -> Optional[MarketItemModel]:
+    """
+    Атомарно снимает лот с рынка. Из параллельных покупок (или покупки и снятия)
+    лот получит только один, остальные получат `None`.
+    """
+    market_item = await database.market_items.async_collection.find_one_and_delete(
+        {"_id": _id, **filter_}
+    )
+    return database.market_items.model.from_dict(market_item) if market_item else None
+
+
+async def pay_seller(market_item: MarketItemModel) -> Optional[UserModel]:
+    """Начисляет продавцу цену лота. `None`, если продавца уже нет в базе."""
+    seller = await database.users.async_collection.find_one_and_update(
+        {"_id": market_item.owner},
+        {"$inc": {"coin": market_item.price}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if seller is None:
+        # покупка уже состоялась, бабло просто некому начислить
+        logger.warning(f"Продавец {market_item.owner} лота {market_item._id} не найден")
+        return None
+    return database.users.model.from_dict(seller)
+
+
+async def get_user_market_items_count(user: UserModel) -> int:
+    return await database.market_items.async_collection.count_documents({"owner": user._id})
+
+
+# цены за штуку по предметам: zset `market:prices:<name>`, где член — id лота
+# (и "shop" для цены магазина), а score — цена за штуку
+PRICES_KEY: Final = "market:prices:{name}"
+LAST_TRADE_KEY: Final = "market:last_trade:{name}"
+SHOP_MEMBER: Final = "shop"
+
+
+@dataclass
+class PriceStats:
+    # статистика только по лотам рынка, цена магазина отдельно
+    count: int = 0
+    min: Optional[float] = None
+    p25: Optional[float] = None
+    median: Optional[float] = None
+    p75: Optional[float] = None
+    shop: Optional[float] = None
+    last_trade: Optional[float] = None
+
+
+def _unit_price(market_item: MarketItemModel) -> float:
+    return market_item.price / max(market_item.quantity, 1)
+
+
+# статистика считается в редисе одним скриптом: кол-во лотов, ранг "shop" и цены
+# на нужных рангах читаются атомарно, и снятый между запросами лот ничего не сломает.
+# ARGV[1] - член, который не считается лотом, дальше квантили. Возвращает кол-во
+# лотов, цену этого члена и пары цен (нижний и верхний ранг) для каждого квантиля
+PRICE_STATS_SCRIPT: Final = async_redis_cache.register_script(
+    """
+    local key, excluded = KEYS[1], ARGV[1]
+    local excluded_rank = redis.call("ZRANK", key, excluded)
+    local count = redis.call("ZCARD", key)
+    if excluded_rank then
+        count = count - 1
+    end
+
+    local result = {count, redis.call("ZSCORE", key, excluded)}
+    if count == 0 then
+        return result
+    end
+    for i = 2, #ARGV do
+        local pos = tonumber(ARGV[i]) * (count - 1)
+        for _, index in ipairs({math.floor(pos), math.ceil(pos)}) do
+            if excluded_rank and index >= excluded_rank then
+                index = index + 1
+            end
+            local item = redis.call("ZRANGE", key, index, index, "WITHSCORES")
+            table.insert(result, item[2])
+        end
+    end
+    return result
+    """
+)
+
+
+async def _price_quantiles(
+    key: str, quantiles: tuple[float, ...], excluded: str = ""
+) -> tuple[int, Optional[float], list[float]]:
+    """Кол-во лотов, цена `excluded` и квантили цен без `excluded`."""
+    count, excluded_score, *scores = await PRICE_STATS_SCRIPT(
+        keys=[key], args=[excluded, *quantiles]
+    )
+    values = []
+    for q, low, high in zip(quantiles, scores[::2], scores[1::2]):
+        # линейная интерполяция между соседними рангами, для 0.5 совпадает с `statistics.median`
+        pos = q * (count - 1)
+        low, high = float(low), float(high)
+        values.append(low + (high - low) * (pos - math.floor(pos)))
+    return count, float(excluded_score) if excluded_score is not None else None, values
+
+
+async def get_price_stats(name: str) -> PriceStats:
+    (count, shop, quantiles), last_trade = await asyncio.gather(
+        _price_quantiles(PRICES_KEY.format(name=name), (0, 0.25, 0.5, 0.75), SHOP_MEMBER),
+        async_redis_cache.get(LAST_TRADE_KEY.format(name=name)),
+    )
+    stats = PriceStats(count=count, shop=shop, last_trade=float(last_trade) if last_trade else None)
+    if quantiles:
+        stats.min, stats.p25, stats.median, stats.p75 = quantiles
+    return stats
+
+
+async def get_middle_item_price(name: str) -> int:
+    """Медиана цены за штуку по лотам вместе с ценой магазина."""
+    item = get_item(name)
+    _, _, quantiles = await _price_quantiles(PRICES_KEY.format(name=item.name), (0.5,))
+    return int(quantiles[0]) if quantiles else 0
+
+
+async def add_listing_price(market_item: MarketItemModel):
+    key = PRICES_KEY.format(name=market_item.name)
+    await async_redis_cache.zadd(key, {str(market_item._id): _unit_price(market_item)})
+
+
+async def remove_listing_price(market_item: MarketItemModel):
+    await async_redis_cache.zrem(PRICES_KEY.format(name=market_item.name), str(market_item._id))
+
+
+async def record_trade(market_item: MarketItemModel):
+    async with async_redis_cache.pipeline(transaction=False) as pipe:
+        pipe.zrem(PRICES_KEY.format(name=market_item.name), str(market_item._id))
+        pipe.set(LAST_TRADE_KEY.format(name=market_item.name), _unit_price(market_item))
+        await pipe.execute()
+
+
+async def rebuild_price_stats():
+    """
+    Пересобирает цены из коллекции рынка, вызывается при запуске бота.
+    Последняя сделка не трогается, ее можно взять только из редиса.
+    """
+    prices: dict[str, dict[str, float]] = {
+        item.name: {SHOP_MEMBER: item.price} if item.price else {} for item in ITEMS
+    }
+    async for market_item in database.market_items.async_iter(track=False):
+        prices.setdefault(market_item.name, {})[str(market_item._id)] = _unit_price(market_item)
+
+    async with async_redis_cache.pipeline() as pipe:
+        for name, members in prices.items():
+            key = PRICES_KEY.format(name=name)
+            pipe.delete(key)
+            if members:
+                pipe.zadd(key, members)
+        await pipe.execute()
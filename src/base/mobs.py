@@ -4,7 +4,7 @@ from typing import Optional
 
 from aiogram.types import Message
 
-from base.items import ITEMS
+from base.items import ITEMS_BY_RARITY
 from database.models import UserModel
 from helpers.enums import ItemRarity
 from helpers.utils import get_item_emoji, quick_markup
@@ -59,7 +59,7 @@ class Dog(BaseMob):
 class Trader(BaseMob):
     def __init__(self):
         super().__init__("торговец", 5.2)
-        self.items = [item for item in ITEMS if item.rarity == ItemRarity.COMMON]
+        self.items = ITEMS_BY_RARITY[ItemRarity.COMMON]
         while True:
             self.item = random.choice(self.items)
             if self.item.price:
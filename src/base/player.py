@@ -1,13 +1,24 @@
+import asyncio
 import random
 from datetime import timedelta
-from typing import Any, Callable, List, NoReturn, TypedDict, Union
+from typing import Final, NoReturn, Optional, TypedDict, Union
 
 from aiogram.types import InlineKeyboardButton, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from bson import Int64
+from pymongo import DESCENDING, ReturnDocument, UpdateOne
 
-from base.items import ITEMS
+from base.items import EXCHANGE_ITEMS, ITEMS, ITEMS_BY_RARITY, TASK_ITEMS
+from base.recipes import RECIPES
 from config import bot, config
-from database.funcs import BaseDB, database
+from database.cache import top_cache
+from database.funcs import (
+    BaseDB,
+    async_client,
+    async_redis_cache,
+    database,
+    supports_transactions,
+)
 from database.funcs import T as ModelsType
 from database.models import (
     DailyGiftModel,
@@ -29,6 +40,8 @@ from helpers.utils import (
     get_item_count_for_rarity,
     get_item_emoji,
     get_user_tag,
+    increment_achievement_progress,
+    safe,
 )
 
 
@@ -46,14 +59,7 @@ async def level_up(user: UserModel, chat_id: Union[str, int, None] = None):
     if not chat_id:
         chat_id = user.id
 
-    box = get_or_add_user_item(user, "бокс")
-
-    if box.quantity < 0:
-        box.quantity = 0
-
-    box.quantity += 1
-
-    await database.items.async_update(**box.to_dict())
+    await add_items(user, {"бокс": 1})
     await bot.send_sticker(
         chat_id,
         "CAACAgIAAxkBAAEpjItl0i05sChI02Gz_uGnAtLyPBcJwgACXhIAAuyZKUl879mlR_dkOzQE",  # cSpell:ignore CAAC
@@ -150,20 +156,18 @@ async def check_user_stats(user: UserModel, chat_id: Union[str, int, None] = Non
         if dog.hunger > 100:
             dog.hunger = 100
 
-        await database.dogs.async_update(**dog.to_dict())
-    await database.users.async_update(**user.to_dict())
+        await database.dogs.async_update(dog)
+    await database.users.async_update(user)
 
 
-def generate_quest(user: UserModel):
+async def generate_quest(user: UserModel):
     try:
-        old_quest = database.quests.get(owner=user._id)
-        database.quests.delete(**old_quest.to_dict())
+        old_quest = await database.quests.async_get(owner=user._id)
+        await database.quests.async_delete(**old_quest.to_dict())
     except NoResult:
         pass
 
-    allowed_items = [item for item in ITEMS if item.is_task_item]
-
-    item: Item = random.choice(allowed_items)
+    item: Item = random.choice(TASK_ITEMS)
     quantity = random.randint(2, 10) * user.level
     xp = random.uniform(5.0, 15.0) * user.level
     task_coin = item.task_coin
@@ -177,7 +181,7 @@ def generate_quest(user: UserModel):
         reward=reward,
         owner=user._id,
     )
-    database.quests.add(**quest.to_dict())
+    await database.quests.async_add(**quest.to_dict())
 
     return quest
 
@@ -190,59 +194,51 @@ class CraftResource(TypedDict):
 
 class AvailableCraftItem(TypedDict):
     item_name: str
+    count: int
     resources: list[CraftResource]
 
 
-def get_available_crafts(user: UserModel) -> list[AvailableCraftItem]:
-    available_crafts: list[AvailableCraftItem] = []
+async def get_inventory_quantities(user: UserModel) -> dict[str, int]:
+    quantities: dict[str, int] = {}
+    for user_item in await database.items.async_get_inventory(user._id):
+        quantities[user_item.name] = quantities.get(user_item.name, 0) + user_item.quantity
+    return quantities
 
-    for item in ITEMS:
-        if not item.craft:
-            continue
 
-        craft = item.craft
-        can_craft = True
-        required_resources: List[CraftResource] = []
+async def get_available_crafts(user: UserModel) -> list[AvailableCraftItem]:
+    quantities = await get_inventory_quantities(user)
 
-        for craft_item_name, craft_item_count in craft.items():
-            user_item = get_or_add_user_item(user, craft_item_name)
-            if (user_item.quantity <= 0) or (user_item.quantity < craft_item_count):
-                can_craft = False
-                break
-            required_resources.append(
+    available_crafts: list[AvailableCraftItem] = [
+        {
+            "item_name": recipe.name,
+            "count": count,
+            "resources": [
                 {
-                    "item_name": craft_item_name,
-                    "item_count": craft_item_count,
-                    "user_item_quantity": user_item.quantity,
+                    "item_name": name,
+                    "item_count": item_count,
+                    "user_item_quantity": quantities[name],
                 }
-            )
-
-        if can_craft:
-            available_crafts.append({"item_name": item.name, "resources": required_resources})
-
-    available_crafts = sorted(
-        available_crafts,
-        key=lambda x: max(x["resources"], key=lambda y: y["user_item_quantity"])[
-            "user_item_quantity"
-        ],
+                for name, item_count in recipe.ingredients
+            ],
+        }
+        for recipe, count in RECIPES.available(quantities)
+    ]
+
+    available_crafts.sort(
+        key=lambda x: max(resource["user_item_quantity"] for resource in x["resources"]),
         reverse=True,
     )
     return available_crafts
 
 
-def generate_exchanger(user: UserModel):
+async def generate_exchanger(user: UserModel):
     try:
-        old_exchanger = database.exchangers.get(**{"owner": user._id})
-        database.exchangers.delete(**old_exchanger.to_dict())
+        old_exchanger = await database.exchangers.async_get(**{"owner": user._id})
+        await database.exchangers.async_delete(**old_exchanger.to_dict())
     except NoResult:
         pass
 
-    allowed_items: List[Item] = []
-    for item in ITEMS:
-        if item.can_exchange:
-            allowed_items.append(item)
-
-    item = random.choice(allowed_items)
+    item = random.choice(EXCHANGE_ITEMS)
 
     exchange_price = item.exchange_price
     price = random.randint(min(exchange_price), max(exchange_price))  # pyright: ignore
@@ -254,16 +250,15 @@ def generate_exchanger(user: UserModel):
         owner=user._id,
     )
 
-    exchanger_add = database.exchangers.add(**exchanger.to_dict())
+    exchanger_add = await database.exchangers.async_add(**exchanger.to_dict())
     exchanger._id = exchanger_add.inserted_id
-    database.exchangers.update(**exchanger.to_dict())
+    await database.exchangers.async_update(exchanger)
     return exchanger
 
 
-def get_available_items_for_use(user: UserModel) -> list[ItemModel]:
+async def get_available_items_for_use(user: UserModel) -> list[ItemModel]:
     available_items = []
-    items = database.items.get_all(**{"owner": user._id})
-    for user_item in items:
+    for user_item in await database.items.async_get_inventory(user._id):
         item = get_item(user_item.name)
         if item and item.is_consumable and user_item.quantity > 0:
             available_items.append(user_item)
@@ -271,10 +266,8 @@ def get_available_items_for_use(user: UserModel) -> list[ItemModel]:
     return sorted(available_items, key=lambda item: item.quantity, reverse=True)
 
 
-async def use_item(message: Message, name: str):
+async def use_item(message: Message, user: UserModel, name: str):
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
-
         item = get_item(name)
 
         if not item:
@@ -291,13 +284,17 @@ async def use_item(message: Message, name: str):
             )
             return
 
-        user_item = get_or_add_user_item(user, item.name)
-
-        if not user_item:
-            await message.reply(f"У тебя нет {item.name} {item.emoji}")
-            return
+        match item.name:
+            case "пилюля" | "фиксоманчик":
+                await message.reply(f"{item.emoji} в разработке")
+                return
+            case "велик" if not user.action or user.action.type != "street":
+                await message.reply("Ты не гуляешь")
+                return
 
-        if user_item.quantity <= 0:
+        # предмет списывается атомарно с условием `quantity >= 1`, так что два
+        # параллельных юза не потратят один и тот же предмет
+        if not await take_items(user, {item.name: 1}):
             await message.reply(f"У тебя нет {item.name} {item.emoji}")
             return
 
@@ -307,12 +304,10 @@ async def use_item(message: Message, name: str):
                 await message.reply(
                     f"Поел {item.emoji}\n- {item.effect} голода",
                 )
-                user_item.quantity -= 1
             case "буст":
                 xp = random.randint(100, 150)
-                user.xp += xp
+                user.inc(xp=xp)
                 await message.reply(f"{get_item_emoji(name)} Юзнул буст\n+ {xp} опыта")
-                user_item.quantity -= 1
             case "бокс":
                 mess = "Ты открыл бокс и получил\n---------\n"
                 num_items_to_get = random.randint(1, 3)
@@ -321,6 +316,7 @@ async def use_item(message: Message, name: str):
                     ITEMS,
                     k=num_items_to_get,
                 )
+                loot: dict[str, int] = {}
                 for item_ in items_to_get:
                     quantity = get_item_count_for_rarity(item_.rarity)
 
@@ -328,14 +324,11 @@ async def use_item(message: Message, name: str):
                         continue
                     mess += f"+ {quantity} {item_.name} {item_.emoji}\n"
                     if item_.name == "бабло":
-                        user.coin += quantity
+                        user.inc(coin=quantity)
                     else:
-                        _item = get_or_add_user_item(user, item_.name)
-
-                        _item.quantity += quantity
-                        await database.items.async_update(**_item.to_dict())
+                        loot[item_.name] = loot.get(item_.name, 0) + quantity
 
-                user_item.quantity -= 1
+                await add_items(user, loot)
 
                 await message.reply(mess)
             case "энергос" | "чай":
@@ -343,35 +336,24 @@ async def use_item(message: Message, name: str):
                 await message.reply(
                     f"{item.emoji} юзнул {item.name}\n- {item.effect} усталости",
                 )
-                user_item.quantity -= 1
-            case "пилюля":
-                await message.reply(f"{item.emoji} в разработке")
-                return
             case "хелп":
                 user.health += item.effect  # pyright: ignore
                 await message.reply(f"{item.effect} юзнул хелп")
-                user_item.quantity -= 1
-            case "фиксоманчик":
-                await message.reply(f"{item.emoji} в разработке")
-                return
             case "водка":
                 user.fatigue = 0
                 user.health -= item.effect  # pyright: ignore
                 await message.reply(f"{item.emoji} юзнул водку")
-                user_item.quantity -= 1
             case "велик":
-                if not user.action or user.action.type != "street":
-                    await message.reply("Ты не гуляешь")
-                    return
                 minutes = random.randint(10, 45)
-                user.action.end -= timedelta(minutes=minutes)
+                from tasks.notification import notifier
+
+                user.action.end -= timedelta(minutes=minutes)  # type: ignore
+                notifier.schedule(user)
                 await message.reply(
                     f"{item.emoji} юзнул велик и сократил время прогулки на {minutes} минут",
                 )
-                user_item.quantity -= 1
             case "клевер-удачи":
                 user.luck += item.effect  # type: ignore
-                user_item.quantity -= 1
                 await message.reply(f"{item.emoji} Увеличил удачу на 1")
             case "конфета":
                 user.hunger -= item.effect  # type: ignore
@@ -383,12 +365,11 @@ async def use_item(message: Message, name: str):
 
                 await message.reply(mess)
 
-        await database.users.async_update(**user.to_dict())
-        await database.items.async_update(**user_item.to_dict())
+        await database.users.async_update(user)
         await check_user_stats(user, message.chat.id)
 
 
-def get_or_add_user_item(user: UserModel, name: str) -> Union[ItemModel, NoReturn]:
+async def get_or_add_user_item(user: UserModel, name: str) -> Union[ItemModel, NoReturn]:
     item = get_item(name)
 
     if item.type != ItemType.COUNTABLE:
@@ -396,30 +377,128 @@ def get_or_add_user_item(user: UserModel, name: str) -> Union[ItemModel, NoRetur
     if item.name == "бабло":
         raise ItemIsCoin
 
+    # upsert вместо find + insert: под уникальным индексом `owner_name_countable`
+    # параллельная вставка упала бы с `DuplicateKeyError`
+    document = await database.items.async_collection.find_one_and_update(
+        {"owner": user._id, "name": item.name},
+        {"$setOnInsert": {"quantity": Int64(0), "usage": None, "is_equipped": False}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return database.items.model.from_dict(document)
+
+
+def _countable_items(items: Optional[dict[str, int]]) -> dict[str, int]:
+    result: dict[str, int] = {}
+    for name, quantity in (items or {}).items():
+        item = get_item(name)
+        if item.type != ItemType.COUNTABLE:
+            raise ValueError  # TODO: add message
+        if item.name == "бабло":
+            raise ItemIsCoin
+        if quantity > 0:
+            result[item.name] = result.get(item.name, 0) + quantity
+    return result
+
+
+def _take_item_query(user: UserModel, name: str, quantity: int) -> tuple[dict, dict]:
+    return (
+        {"owner": user._id, "name": name, "quantity": {"$gte": quantity}},
+        {"$inc": {"quantity": -quantity}},
+    )
+
+
+def _add_item_request(user: UserModel, name: str, quantity: int) -> UpdateOne:
+    return UpdateOne(
+        {"owner": user._id, "name": name},
+        {"$inc": {"quantity": quantity}, "$setOnInsert": {"usage": None, "is_equipped": False}},
+        upsert=True,
+    )
+
+
+async def change_items(
+    user: UserModel,
+    add: Optional[dict[str, int]] = None,
+    take: Optional[dict[str, int]] = None,
+) -> bool:
+    """
+    Списывает `take` и начисляет `add` (`{имя: кол-во}`) через `$inc`.
+
+    Списание идет с условием `quantity >= n`: если чего-то не хватает,
+    инвентарь не меняется и возвращается `False`.
+
+    Атомарно это только в транзакции (реплика-сет). Без транзакций предметы
+    списываются параллельными запросами, и если чего-то не хватило, списанное
+    возвращается отдельным `bulk_write`: пока он не выполнится, другие запросы
+    видят частично списанный инвентарь, а если он упадет, списанное потеряется.
+    """
+    add, take = _countable_items(add), _countable_items(take)
+    adds = [_add_item_request(user, name, quantity) for name, quantity in add.items()]
+    collection = database.items.async_collection
+
     try:
-        item = database.items.get(owner=user._id, name=item.name)
-    except NoResult:
-        item = ItemModel(owner=user._id, name=item.name)
-        id = database.items.add(**item.to_dict()).inserted_id
-        item._id = id
+        if not take:
+            if adds:
+                await collection.bulk_write(adds, ordered=False)
+            return True
+
+        if await supports_transactions():
+            takes = [UpdateOne(*_take_item_query(user, *item)) for item in take.items()]
+            async with async_client.start_session() as session:
+                async with await session.start_transaction():
+                    result = await collection.bulk_write(takes + adds, session=session)
+                    # начисления без upsert тоже попадают в matched_count
+                    if result.matched_count - (len(adds) - result.upserted_count) < len(takes):
+                        await session.abort_transaction()
+                        return False
+            return True
+
+        # без транзакций списываем параллельно и возвращаем списанное, если чего-то не хватило
+        results = await asyncio.gather(
+            *(collection.update_one(*_take_item_query(user, *item)) for item in take.items())
+        )
+        if not all(result.modified_count for result in results):
+            undo = [
+                UpdateOne({"owner": user._id, "name": name}, {"$inc": {"quantity": quantity}})
+                for (name, quantity), result in zip(take.items(), results)
+                if result.modified_count
+            ]
+            if undo:
+                await collection.bulk_write(undo, ordered=False)
+            return False
+
+        if adds:
+            await collection.bulk_write(adds, ordered=False)
+        return True
+    finally:
+        # после записи, чтобы параллельное чтение не закешировало старый инвентарь
+        await database.items.invalidate(user._id)
+
+
+async def add_items(user: UserModel, items: dict[str, int]):
+    await change_items(user, add=items)
 
-    return item
 
+async def take_items(user: UserModel, items: dict[str, int]) -> bool:
+    return await change_items(user, take=items)
 
-def add_user_usage_item(user: UserModel, name: str, usage: float = 0) -> Union[ItemModel, NoReturn]:
+
+async def add_user_usage_item(
+    user: UserModel, name: str, usage: float = 0
+) -> Union[ItemModel, NoReturn]:
     _item = get_item(name)
 
     if _item.type != ItemType.USABLE:
         raise ValueError  # TODO: add message
 
     item = ItemModel(owner=user._id, name=_item.name, usage=usage)
-    id = database.items.add(**item.to_dict()).inserted_id
+    id = (await database.items.async_add(**item.to_dict())).inserted_id
     item._id = id
 
     return item
 
 
-def get_or_add_user_usable_items(
+async def get_or_add_user_usable_items(
     user: UserModel, name: str, usage: float = 0
 ) -> Union[list[ItemModel], NoReturn]:
     item = get_item(name)
@@ -428,99 +507,117 @@ def get_or_add_user_usable_items(
         raise ValueError  # TODO: add message
 
     try:
-        items = database.items.get_all(owner=user._id, name=item.name)
+        items = await database.items.async_get_all(owner=user._id, name=item.name)
         if len(items) == 0:
             raise NoResult
     except NoResult:
-        items = [add_user_usage_item(user, name, usage)]
+        items = [await add_user_usage_item(user, name, usage)]
 
     return items
 
 
-def transfer_usable_item(from_user_item: ItemModel, to_user: UserModel):
+async def transfer_usable_item(from_user_item: ItemModel, to_user: UserModel) -> bool:
+    """
+    Передает предмет, только если он все еще у прежнего владельца, так что
+    параллельные передачи одного предмета не пройдут обе.
+    """
+    from_owner = from_user_item.owner
+    result = await database.items.async_collection.update_one(
+        {"_id": from_user_item._id, "owner": from_owner, "quantity": {"$gt": 0}},
+        {"$set": {"owner": to_user._id}},
+    )
+    await database.items.invalidate(from_owner, to_user._id)
+    if not result.modified_count:
+        return False
     from_user_item.owner = to_user._id
-    database.items.update(**from_user_item.to_dict())
+    from_user_item.mark_clean("owner")
+    return True
 
 
-def transfer_countable_item(from_user_item: ItemModel, quantity: int, to_user: UserModel):
-    to_user_item = get_or_add_user_item(to_user, from_user_item.name)
-
-    if from_user_item.quantity < quantity:
+async def transfer_countable_item(
+    from_user: UserModel, name: str, quantity: int, to_user: UserModel
+):
+    if not await take_items(from_user, {name: quantity}):
         raise ValueError  # TODO: add: message
+    await add_items(to_user, {name: quantity})
 
-    from_user_item.quantity -= quantity
-    to_user_item.quantity += quantity
 
-    database.items.update(**from_user_item.to_dict())
-    database.items.update(**to_user_item.to_dict())
+async def _get_top(collection: BaseDB[ModelsType], field: str, max_index: int) -> list:
+    # сортировка и лимит на стороне монги по индексу `field`, без загрузки всех моделей
+    objects = collection.async_iter_rows(
+        {field: {"$gt": 0}}, ("name", field), sort=[(field, DESCENDING)], limit=max_index
+    )
+    return [[obj.name, getattr(obj, field)] async for obj in objects]
 
 
-def get_top(
+async def get_top(
     name: str,
     collection: BaseDB[ModelsType],
-    filter_: Callable[[ModelsType], bool],
-    sort_key: Callable[[ModelsType], Any],
-    key: Callable[[ModelsType], str],
-    value: Callable[[ModelsType], int],
+    field: str,
     max_index: int = 20,
 ) -> str:
-    objects = collection.get_all()
-    objects.sort(key=sort_key, reverse=True)
-    mess = f"<b>Топ {max_index} - {name}</b>\n\n"
-    objects = filter(filter_, objects)
+    top = await top_cache.get(
+        f"{collection.async_collection.name}:{field}:{max_index}",
+        lambda: _get_top(collection, field, max_index),
+    )
 
-    for index, obj in enumerate(objects, start=1):
-        mess += f"{index}. {key(obj)[:20]} - {value(obj)}\n"
-        if index == max_index:
-            break
+    mess = f"<b>Топ {max_index} - {name}</b>\n\n"
+    for index, (obj_name, value) in enumerate(top, start=1):
+        mess += f"{index}. {obj_name[:20]} - {value}\n"
     return mess
 
 
-def coin_top(max_index: int = 20):
-    return get_top(
-        "бабло",
-        database.users,
-        lambda o: o.coin > 0,
-        lambda o: o.coin,
-        lambda o: o.name,
-        lambda o: o.coin,
-        max_index,
-    )
+async def coin_top(max_index: int = 20):
+    return await get_top("бабло", database.users, "coin", max_index)
 
 
-def level_top(max_index: int = 20):
-    return get_top(
-        "уровень",
-        database.users,
-        lambda o: o.level > 0,
-        lambda o: o.level,
-        lambda o: o.name,
-        lambda o: o.level,
-        max_index,
-    )
+async def level_top(max_index: int = 20):
+    return await get_top("уровень", database.users, "level", max_index)
 
 
-def dog_level_top(max_index: int = 20):
-    return get_top(
-        "уровень собак",
-        database.dogs,
-        lambda o: o.level > 0,
-        lambda o: o.level,
-        lambda o: o.name,
-        lambda o: o.level,
-        max_index,
-    )
+async def dog_level_top(max_index: int = 20):
+    return await get_top("уровень собак", database.dogs, "level", max_index)
+
+
+async def _event_top(max_index: int) -> str:
+    pipeline = [
+        {"$match": {"name": "конфета", "quantity": {"$gt": 0}}},
+        {"$sort": {"quantity": DESCENDING}},
+        {"$limit": max_index},
+        {
+            "$lookup": {
+                "from": database.users.async_collection.name,
+                "localField": "owner",
+                "foreignField": "_id",
+                "pipeline": [{"$project": {"_id": 0, "name": 1}}],
+                "as": "owner",
+            }
+        },
+    ]
+
+    mess = ""
+    index = 0
+    async for item in await database.items.async_collection.aggregate(pipeline):
+        if not item["owner"]:
+            continue
+        index += 1
+        mess += f"{index}. {item['owner'][0]['name']} - {item['quantity']}\n"
+    return mess
+
 
+async def event_top(max_index: int = 10) -> str:
+    return await top_cache.get(f"event:{max_index}", lambda: _event_top(max_index))
 
-def generate_daily_gift(user: UserModel):
+
+async def generate_daily_gift(user: UserModel):
     try:
-        daily_gift = database.daily_gifts.get(owner=user._id)
+        daily_gift = await database.daily_gifts.async_get(owner=user._id)
     except NoResult:
         daily_gift = DailyGiftModel(owner=user._id)
-        id = database.daily_gifts.add(**daily_gift.to_dict()).inserted_id
+        id = (await database.daily_gifts.async_add(**daily_gift.to_dict())).inserted_id
         daily_gift._id = id
 
-    items = list(filter(lambda i: i.rarity == ItemRarity.COMMON, ITEMS))
+    items = list(ITEMS_BY_RARITY[ItemRarity.COMMON])
 
     if config.event.open:
         items.append(get_item("конфета"))
@@ -531,7 +628,7 @@ def generate_daily_gift(user: UserModel):
 
     daily_gift.is_claimed = False
     daily_gift.next_claimable_at = utcnow() + timedelta(days=1)
-    database.daily_gifts.update(**daily_gift.to_dict())
+    await database.daily_gifts.async_update(daily_gift)
     return daily_gift
 
 
@@ -549,4 +646,78 @@ async def check_achievements(user: UserModel):
     if unknown_achievements:
         for ach in unknown_achievements:
             del user.achievement_progress[ach]
-        await database.users.async_update(**user.to_dict())
+        await database.users.async_update(user)
+
+
+# реферальная ссылка засчитывается только что зарегистрированному пользователю
+REFERRAL_WINDOW: Final = timedelta(hours=1)
+# параметр `/start` нового пользователя ждет принятия правил
+PENDING_REFERRAL_KEY: Final = "referral:pending:{id}"
+PENDING_REFERRAL_TTL: Final = timedelta(days=1)
+
+
+async def save_pending_referral(user: UserModel, param: str):
+    """
+    Запоминает параметр `/start`, с которым пользователь пришел в бота. Первый
+    `/start` нового пользователя съедает проверка правил, так что ссылка
+    засчитывается уже после их принятия (`pop_pending_referral`).
+    """
+    await async_redis_cache.set(
+        PENDING_REFERRAL_KEY.format(id=user.id), param, ex=PENDING_REFERRAL_TTL
+    )
+
+
+async def pop_pending_referral(user: UserModel) -> Optional[str]:
+    param = await async_redis_cache.getdel(PENDING_REFERRAL_KEY.format(id=user.id))
+    return param.decode() if param else None
+
+
+async def claim_referral(
+    user: UserModel, param: str, window: Optional[timedelta] = REFERRAL_WINDOW
+) -> Optional[UserModel]:
+    """
+    Привязывает `user` к пригласившему по параметру `/start`.
+
+    Возвращает пригласившего, если ссылка засчитана. Засчитывается она один раз
+    (условие `referred_by: None` проверяется атомарно) и только пользователю,
+    зарегистрированному не раньше `window` назад (`None` - без ограничения,
+    для параметра, сохраненного при регистрации).
+    """
+    if not param.isdigit() or int(param) == user.id:
+        return None
+    try:
+        # поиск по уникальному индексу `id`
+        ref_user = await database.users.async_get(id=int(param))
+    except NoResult:
+        return None
+
+    filter_: dict = {"_id": user._id, "referred_by": None}
+    if window is not None:
+        filter_["registered_at"] = {"$gte": utcnow() - window}
+    claimed = await database.users.async_collection.find_one_and_update(
+        filter_,
+        {"$set": {"referred_by": ref_user.id}},
+        projection={"_id": 1},
+    )
+    if claimed is None:
+        return None
+
+    user.referred_by = ref_user.id
+    user.mark_clean("referred_by")
+    return ref_user
+
+
+async def reward_referrer(user: UserModel, ref_user: UserModel):
+    coin = random.randint(5000, 15000)
+    await database.users.async_inc(ref_user, coin=coin)
+    await increment_achievement_progress(ref_user, "друзья навеки")
+
+    await safe(
+        bot.send_message(
+            ref_user.id,
+            (
+                f"{user.name} присоединился к игре благодаря твой реферальной ссылке\n"
+                f"Ты получил {coin} бабла {get_item_emoji('бабло')}"
+            ),
+        )
+    )
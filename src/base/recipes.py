@@ -0,0 +1,132 @@
+from collections import Counter
+from typing import Final, Iterable, NamedTuple, Optional
+
+from base.items import CRAFTABLE_ITEMS
+from helpers.datatypes import Item
+
+# ограничение вложенности крафта через промежуточные предметы
+MAX_CRAFT_DEPTH: Final = 8
+
+
+class Recipe(NamedTuple):
+    name: str
+    ingredients: tuple[tuple[str, int], ...]
+
+    def max_crafts(self, inventory: dict[str, int]) -> int:
+        """Сколько раз рецепт можно скрафтить из `inventory` без промежуточных крафтов."""
+        return min(inventory.get(name, 0) // count for name, count in self.ingredients)
+
+
+class CraftPlan(NamedTuple):
+    # что списать из инвентаря
+    take: dict[str, int]
+    # сколько раз скрафчен каждый предмет, включая промежуточные
+    crafts: dict[str, int]
+
+    @property
+    def total(self) -> int:
+        return sum(self.crafts.values())
+
+
+class RecipeBook:
+    """
+    Рецепты из `craft` полей предметов, собираются один раз при импорте.
+
+    Держит обратный индекс ингредиент -> рецепты, так что для инвентаря
+    проверяются только рецепты, для которых у пользователя вообще что-то есть.
+    """
+
+    def __init__(self, items: Iterable[Item]):
+        self.recipes: dict[str, Recipe] = {
+            item.name: Recipe(item.name, tuple(item.craft.items()))  # type: ignore
+            for item in items
+            if item.craft
+        }
+
+        used_in: dict[str, list[Recipe]] = {}
+        for recipe in self.recipes.values():
+            for name, _ in recipe.ingredients:
+                used_in.setdefault(name, []).append(recipe)
+        self.used_in: dict[str, tuple[Recipe, ...]] = {
+            name: tuple(recipes) for name, recipes in used_in.items()
+        }
+        # порядок рецептов из `ITEMS`, чтобы вывод и "скрафтить все" были стабильными
+        self._order = {name: index for index, name in enumerate(self.recipes)}
+
+    def get(self, name: str) -> Optional[Recipe]:
+        return self.recipes.get(name)
+
+    def candidates(self, inventory: dict[str, int]) -> list[Recipe]:
+        recipes = {
+            recipe
+            for name, quantity in inventory.items()
+            if quantity > 0
+            for recipe in self.used_in.get(name, ())
+        }
+        return sorted(recipes, key=lambda recipe: self._order[recipe.name])
+
+    def available(self, inventory: dict[str, int]) -> list[tuple[Recipe, int]]:
+        """Рецепты, которые можно скрафтить хотя бы раз, и сколько раз."""
+        result = []
+        for recipe in self.candidates(inventory):
+            count = recipe.max_crafts(inventory)
+            if count > 0:
+                result.append((recipe, count))
+        return result
+
+    def plan(self, name: str, count: int, inventory: dict[str, int]) -> Optional[CraftPlan]:
+        """
+        План крафта `count` предметов `name`. Чего не хватает, крафтится
+        из промежуточных предметов. `None`, если ресурсов не хватает.
+        """
+        recipe = self.recipes.get(name)
+        if recipe is None or count <= 0:
+            return None
+
+        left = Counter(inventory)
+        take: Counter[str] = Counter()
+        crafts: Counter[str] = Counter()
+
+        def craft(recipe: Recipe, count: int, depth: int) -> bool:
+            if depth > MAX_CRAFT_DEPTH:
+                return False
+            for ingredient, per_craft in recipe.ingredients:
+                need = per_craft * count
+                used = min(left[ingredient], need)
+                left[ingredient] -= used
+                take[ingredient] += used
+
+                missing = need - used
+                if missing:
+                    sub_recipe = self.recipes.get(ingredient)
+                    if sub_recipe is None or not craft(sub_recipe, missing, depth + 1):
+                        return False
+            crafts[recipe.name] += count
+            return True
+
+        if not craft(recipe, count, 0):
+            return None
+        return CraftPlan(dict(+take), dict(crafts))
+
+    def plan_all(self, inventory: dict[str, int]) -> CraftPlan:
+        """
+        "Скрафтить все": каждый доступный рецепт по порядку на максимум
+        из того, что осталось. Скрафченные предметы в этом же проходе не тратятся.
+        """
+        left = Counter(inventory)
+        take: Counter[str] = Counter()
+        crafts: dict[str, int] = {}
+
+        for recipe in self.candidates(inventory):
+            count = recipe.max_crafts(left)
+            if count <= 0:
+                continue
+            for ingredient, per_craft in recipe.ingredients:
+                left[ingredient] -= per_craft * count
+                take[ingredient] += per_craft * count
+            crafts[recipe.name] = count
+
+        return CraftPlan(dict(take), crafts)
+
+
+RECIPES: Final = RecipeBook(CRAFTABLE_ITEMS)
@@ -4,17 +4,17 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, Message
 
+from base.market import add_listing_price, get_middle_item_price
+from base.player import take_items
 from database.funcs import database, redis_cache
-from database.models import MarketItemModel
+from database.models import MarketItemModel, UserModel
 from helpers.consts import COIN_EMOJI
 from helpers.enums import ItemType
-from helpers.exceptions import NoResult
 from helpers.filters import IsDigitFilter
 from helpers.markups import InlineMarkup
 from helpers.utils import (
     get_item,
     get_item_emoji,
-    get_middle_item_price,
     get_user_tag,
 )
 
@@ -29,7 +29,7 @@ class AddNewItemState(StatesGroup):
 
 
 @router.callback_query(StateFilter(AddNewItemState.name), F.data.startswith("sell"))
-async def name_state(call: CallbackQuery, state: FSMContext):
+async def name_state(call: CallbackQuery, state: FSMContext, user: UserModel):
     data = call.data.split(" ")
 
     if data[-1] != str(call.from_user.id):
@@ -45,7 +45,6 @@ async def name_state(call: CallbackQuery, state: FSMContext):
 
     await state.update_data(name=item.name)
 
-    user = await database.users.async_get(id=call.from_user.id)
     user_item = await database.items.async_get(name=item.name, owner=user._id)
 
     markup = InlineMarkup.delate_state(user)
@@ -64,15 +63,13 @@ def select_item_state(message: Message, state: FSMContext): ...
 
 
 @router.message(StateFilter(AddNewItemState.quantity, AddNewItemState.price), ~IsDigitFilter())
-async def invalid_int_input(message: Message):
-    user = await database.users.async_get(id=message.from_user.id)
+async def invalid_int_input(message: Message, user: UserModel):
     markup = InlineMarkup.delate_state(user)
     await message.reply("Введите число", reply_markup=markup)
 
 
 @router.message(StateFilter(AddNewItemState.quantity), IsDigitFilter())
-async def quantity_state(message: Message, state: FSMContext):
-    user = await database.users.async_get(id=message.from_user.id)
+async def quantity_state(message: Message, state: FSMContext, user: UserModel):
     data = await state.get_data()
     user_item = await database.items.async_get(owner=user._id, name=data.get("name"))
     await state.update_data(user_item=user_item)
@@ -90,7 +87,7 @@ async def quantity_state(message: Message, state: FSMContext):
     item = get_item(user_item.name)
     markup = InlineMarkup.delate_state(user)
     await message.bot.edit_message_text(
-        f"<b>Продажа предмета {item.emoji}</b>\nВведи прайс (+-{get_middle_item_price(item.name)}/шт)",
+        f"<b>Продажа предмета {item.emoji}</b>\nВведи прайс (+-{await get_middle_item_price(item.name)}/шт)",
         message_id=call_message_id,  # type: ignore
         chat_id=message.chat.id,
         reply_markup=markup,
@@ -100,20 +97,8 @@ async def quantity_state(message: Message, state: FSMContext):
 
 
 @router.message(StateFilter(AddNewItemState.price), IsDigitFilter())
-async def price_state(message: Message, state: FSMContext):
-    user = await database.users.async_get(id=message.from_user.id)
-
+async def price_state(message: Message, state: FSMContext, user: UserModel):
     data = await state.get_data()
-    try:
-        user_item = await database.items.async_get(owner=user._id, name=data.get("name"))
-    except NoResult:
-        await message.reply("У тебя нет такого предмета")
-        return
-
-    if user_item.quantity < data.get("quantity"):  # type: ignore
-        await message.reply("У тебя нет столько")
-        return
-
     item = MarketItemModel(
         name=data.get("name").lower(),
         quantity=data.get("quantity"),  # type: ignore
@@ -121,10 +106,14 @@ async def price_state(message: Message, state: FSMContext):
         owner=user._id,
     )
 
+    # предмет списывается до выставления лота, с условием `quantity >= n`
+    if not await take_items(user, {item.name: item.quantity}):
+        await message.reply("У тебя нет столько")
+        return
+
     await state.clear()
-    database.market_items.add(**item.to_dict())
-    user_item.quantity -= item.quantity
-    await database.items.async_update(**user_item.to_dict())
+    await database.market_items.async_add(**item.to_dict())
+    await add_listing_price(item)
 
     call_message_id = redis_cache.get(f"{message.from_user.id}_item_add_message")
 
@@ -1,45 +1,128 @@
-from typing import Any
+import asyncio
+import traceback
+from typing import Final, Optional
 
 import httpx
+import msgpack
 
-from config import config
-from database.funcs import cache
+from config import config, logger
+from database.cache import weather_cache
+from database.funcs import async_redis_cache
 from helpers.datatypes import WeatherData
 
+# координаты регионов не меняются, поэтому хранятся в редисе без ttl
+COORDS_KEY: Final = "weather:coords"
+REFRESH_LOCK_KEY: Final = "weather:refresh"
+# прогноз обновляется заранее, пока в кеше (ttl 30 минут) лежит предыдущий
+REFRESH_INTERVAL: Final = 10 * 60
+RETRY_INTERVAL: Final = 60
+TIMEOUT: Final = httpx.Timeout(10)
 
-def _get_coords_from_region(name: str) -> tuple[float, float]:
-    if f"coords_{name}" in cache:
-        return cache[f"coords_{name}"]
 
-    url = "https://geocoding-api.open-meteo.com/v1/search"
+class WeatherService:
+    """
+    Погода из open-meteo через общий `httpx.AsyncClient`.
 
-    params = {
-        "name": name,
-        "count": 1,
-    }
-    response = httpx.get(url, params=params)
-    data: dict[str, list[dict[str, Any]]] = response.json()
+    Прогноз обновляется фоновой задачей (`run`) до того, как истечет кеш,
+    так что хендлеры получают его из `weather_cache` без похода в сеть.
+    """
 
-    result = data["results"][0]["latitude"], data["results"][0]["longitude"]
-    cache[f"coords_{name}"] = result
-    return result
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._coords: dict[str, tuple[float, float]] = {}
 
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=TIMEOUT, limits=httpx.Limits(max_connections=4)
+            )
+        return self._client
 
-def get_weather() -> WeatherData:
-    if "weather_data" in cache:
-        return cache["weather_data"]
+    @property
+    def _forecast_key(self) -> str:
+        return f"forecast:{config.weather.region}"
 
-    coords = _get_coords_from_region(config.weather.region)
-    url = "https://api.open-meteo.com/v1/forecast"
-    params = {
-        "latitude": coords[0],
-        "longitude": coords[1],
-        "current": ["temperature_2m", "weather_code"],
-        "hourly": ["temperature_2m", "weather_code"],
-    }
-    response = httpx.get(url, params=params)
-    weather_data = WeatherData(response.json())
+    async def get_coords(self, name: str) -> tuple[float, float]:
+        if name in self._coords:
+            return self._coords[name]
 
-    cache["weather_data"] = weather_data
+        raw = await async_redis_cache.hget(COORDS_KEY, name)  # type: ignore
+        if raw is not None:
+            latitude, longitude = msgpack.unpackb(raw)
+        else:
+            params = {
+                "name": name,
+                "count": 1,
+            }
+            response = await self.client.get(config.weather.geocoding_url, params=params)
+            response.raise_for_status()
+            result = response.json()["results"][0]
+            latitude, longitude = result["latitude"], result["longitude"]
+            await async_redis_cache.hset(COORDS_KEY, name, msgpack.packb([latitude, longitude]))  # type: ignore
 
-    return weather_data
+        self._coords[name] = (latitude, longitude)
+        return self._coords[name]
+
+    async def fetch(self) -> dict:
+        latitude, longitude = await self.get_coords(config.weather.region)
+        params = {
+            "latitude": latitude,
+            "longitude": longitude,
+            "current": ["temperature_2m", "weather_code"],
+            "hourly": ["temperature_2m", "weather_code"],
+        }
+        response = await self.client.get(config.weather.forecast_url, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def get(self) -> WeatherData:
+        # в кеше лежит сырой ответ api, `WeatherData` собирается уже в процессе
+        return WeatherData(await weather_cache.get(self._forecast_key, self.fetch))
+
+    async def peek(self) -> Optional[WeatherData]:
+        """Прогноз из кеша без запросов к api, `None` если его еще нет."""
+        data = await weather_cache.peek(self._forecast_key)
+        return WeatherData(data) if data is not None else None
+
+    async def refresh(self):
+        await weather_cache.set(self._forecast_key, await self.fetch())
+
+    async def run(self):
+        while True:
+            try:
+                # из нескольких процессов бота прогноз обновляет тот, кто первым взял лок
+                if not await async_redis_cache.set(
+                    REFRESH_LOCK_KEY, 1, nx=True, ex=REFRESH_INTERVAL
+                ):
+                    await asyncio.sleep(RETRY_INTERVAL)
+                    continue
+
+                try:
+                    await self.refresh()
+                except Exception:
+                    # лок отпускаем, чтобы другой процесс мог попробовать раньше
+                    await async_redis_cache.delete(REFRESH_LOCK_KEY)
+                    raise
+            except Exception:
+                # задача живет все время работы бота и не должна падать от сбоя api или редиса
+                logger.error(f"Не удалось обновить погоду:\n{traceback.format_exc()}")
+                await asyncio.sleep(RETRY_INTERVAL)
+                continue
+
+            await asyncio.sleep(REFRESH_INTERVAL)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+weather_service: Final = WeatherService()
+
+
+async def get_weather() -> WeatherData:
+    return await weather_service.get()
+
+
+async def peek_weather() -> Optional[WeatherData]:
+    return await weather_service.peek()
@@ -48,6 +48,16 @@ class TelegramConfig:
 @dataclass
 class WeatherConfig:
     region: str
+    geocoding_url: str = "https://geocoding-api.open-meteo.com/v1/search"
+    forecast_url: str = "https://api.open-meteo.com/v1/forecast"
+
+
+@dataclass
+class LoadingConfig:
+    # message - сообщение с подсказкой, chat_action - "печатает...", off - без индикатора
+    mode: str = "message"
+    # индикатор показывается, только если хендлер работает дольше (в секундах)
+    threshold: float = 0.5
 
 
 @dataclass
@@ -72,6 +82,7 @@ class Config:
     telegram: TelegramConfig
     weather: WeatherConfig
     event: EventConfig
+    loading: LoadingConfig
 
     @staticmethod
     def from_toml(file_path: str) -> "Config":
@@ -83,6 +94,7 @@ class Config:
         telegram = TelegramConfig(**config_data.get("telegram", {}))
         weather = WeatherConfig(**config_data.get("weather", {}))
         event = EventConfig(**config_data.get("event", {}))
+        loading = LoadingConfig(**config_data.get("loading", {}))
 
         return Config(
             general=general,
@@ -91,6 +103,7 @@ class Config:
             telegram=telegram,
             weather=weather,
             event=event,
+            loading=loading,
         )
 
 
@@ -0,0 +1,213 @@
+import asyncio
+import uuid
+from typing import Any, Awaitable, Callable, Final, NamedTuple, Optional, TypeVar
+
+import msgpack
+from bson import ObjectId
+from cachetools import TTLCache
+from redis.exceptions import RedisError
+
+from config import logger
+from database.funcs import async_redis_cache, database
+
+T = TypeVar("T")
+
+INVALIDATION_CHANNEL: Final = "cache:invalidate"
+# чтобы процесс не сбрасывал свой L1 на собственные сообщения
+PROCESS_ID: Final = uuid.uuid4().hex
+# отличает промах L1 от закешированного `None`
+_MISSING: Final = object()
+
+
+class CacheStats(NamedTuple):
+    l1_hits: int
+    l2_hits: int
+    # запросы, которые дождались чужой загрузки того же ключа
+    coalesced: int
+    misses: int
+
+    @property
+    def hit_rate(self) -> float:
+        hits = self.l1_hits + self.l2_hits + self.coalesced
+        total = hits + self.misses
+        return hits / total if total else 0
+
+
+class SharedCache:
+    """
+    Двухуровневый кеш: ограниченный `TTLCache` в процессе (L1) и редис (L2),
+    общий для всех процессов бота.
+
+    Значения в редисе хранятся в msgpack, так что кешировать можно только
+    простые типы (строки, числа, списки, словари). На промах значение грузит
+    один вызов `loader`, остальные параллельные вызовы ждут его результат.
+    """
+
+    def __init__(self, namespace: str, ttl: float, maxsize: int = 256, l1_ttl: float = 30):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.l1: TTLCache[str, Any] = TTLCache(maxsize, min(ttl, l1_ttl))
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._l1_hits = self._l2_hits = self._coalesced = self._misses = 0
+        CACHES[namespace] = self
+
+    def _redis_key(self, key: str) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(self._l1_hits, self._l2_hits, self._coalesced, self._misses)
+
+    async def get(self, key: str, loader: Callable[[], Awaitable[T]]) -> T:
+        # одним обращением: между `in` и `[]` запись может истечь по ttl
+        value = self.l1.get(key, _MISSING)
+        if value is not _MISSING:
+            self._l1_hits += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._coalesced += 1
+            return await asyncio.shield(inflight)
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await self._load(key, loader)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # исключение уже получат все, кто ждет этот ключ
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[T]]) -> T:
+        try:
+            raw = await async_redis_cache.get(self._redis_key(key))
+        except RedisError as e:
+            # без редиса работаем только с L1
+            logger.warning(f"Кеш {self.namespace}: {e}")
+            raw = None
+
+        if raw is not None:
+            self._l2_hits += 1
+            value = msgpack.unpackb(raw)
+        else:
+            self._misses += 1
+            value = await loader()
+            try:
+                await async_redis_cache.set(
+                    self._redis_key(key), msgpack.packb(value), ex=int(self.ttl)
+                )
+            except RedisError as e:
+                logger.warning(f"Кеш {self.namespace}: {e}")
+
+        self.l1[key] = value
+        return value
+
+    async def peek(self, key: str) -> Optional[Any]:
+        """Значение из L1 или редиса без загрузки, `None` если его нет."""
+        value = self.l1.get(key, _MISSING)
+        if value is not _MISSING:
+            self._l1_hits += 1
+            return value
+        try:
+            raw = await async_redis_cache.get(self._redis_key(key))
+        except RedisError as e:
+            logger.warning(f"Кеш {self.namespace}: {e}")
+            return None
+        if raw is None:
+            return None
+        self._l2_hits += 1
+        value = self.l1[key] = msgpack.unpackb(raw)
+        return value
+
+    async def set(self, key: str, value: Any):
+        """Записывает свежее значение, другие процессы перечитают его из редиса."""
+        self.l1[key] = value
+        try:
+            await async_redis_cache.set(
+                self._redis_key(key), msgpack.packb(value), ex=int(self.ttl)
+            )
+        except RedisError as e:
+            logger.warning(f"Кеш {self.namespace}: {e}")
+        await publish_invalidation(self.namespace, key)
+
+    async def invalidate(self, key: Optional[str] = None):
+        """Удаляет `key` (или весь namespace) из редиса и из L1 всех процессов."""
+        try:
+            if key is None:
+                self.l1.clear()
+                keys = [k async for k in async_redis_cache.scan_iter(self._redis_key("*"))]
+                if keys:
+                    await async_redis_cache.delete(*keys)
+            else:
+                self.l1.pop(key, None)
+                await async_redis_cache.delete(self._redis_key(key))
+        except RedisError as e:
+            # L1 уже сброшен, в редисе значение доживет до ttl
+            logger.warning(f"Кеш {self.namespace}: {e}")
+
+        await publish_invalidation(self.namespace, key)
+
+
+CACHES: Final[dict[str, SharedCache]] = {}
+
+# кеши процесса вне `SharedCache`, которые тоже сбрасываются по сообщениям из других процессов
+LOCAL_INVALIDATORS: Final[dict[str, Callable[[Optional[str]], None]]] = {
+    database.items.NAMESPACE: lambda key: database.items.drop_local(ObjectId(key) if key else None),
+}
+
+
+async def publish_invalidation(namespace: str, key: Optional[str]):
+    """Сообщает другим процессам, что `key` (или весь `namespace`) устарел."""
+    try:
+        await async_redis_cache.publish(
+            INVALIDATION_CHANNEL, msgpack.packb([PROCESS_ID, namespace, key])
+        )
+    except RedisError as e:
+        # запись уже прошла, другие процессы дочитают свежие данные по ttl
+        logger.warning(f"Инвалидация {namespace}: {e}")
+
+
+async def listen_invalidations():
+    """Сбрасывает L1 по сообщениям об инвалидации из других процессов."""
+    while True:
+        try:
+            async with async_redis_cache.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    sender, namespace, key = msgpack.unpackb(message["data"])
+                    if sender == PROCESS_ID:
+                        continue
+                    if namespace in LOCAL_INVALIDATORS:
+                        LOCAL_INVALIDATORS[namespace](key)
+                        continue
+                    cache = CACHES.get(namespace)
+                    if cache is None:
+                        continue
+                    if key is None:
+                        cache.l1.clear()
+                    else:
+                        cache.l1.pop(key, None)
+        except RedisError as e:
+            logger.error(f"Подписка на инвалидацию кеша: {e}")
+            # пока подписки нет, L1 мог пропустить сообщения
+            for cache in CACHES.values():
+                cache.l1.clear()
+            for invalidate in LOCAL_INVALIDATORS.values():
+                invalidate(None)
+            await asyncio.sleep(5)
+
+
+weather_cache: Final = SharedCache("weather", ttl=1800)
+version_cache: Final = SharedCache("version", ttl=1800)
+top_cache: Final = SharedCache("top", ttl=60, l1_ttl=15)
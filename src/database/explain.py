@@ -0,0 +1,79 @@
+from typing import Any, NamedTuple, Optional
+
+from bson import ObjectId
+from pymongo import DESCENDING
+
+from database.funcs import BaseDB, database
+
+
+class QueryShape(NamedTuple):
+    collection: BaseDB
+    filter: dict[str, Any]
+    sort: Optional[list[tuple[str, int]]] = None
+
+
+_id = ObjectId()
+
+# формы горячих запросов, значения не важны, важны только поля
+QUERY_SHAPES: list[QueryShape] = [
+    QueryShape(database.users, {"id": 0}),
+    QueryShape(database.users, {"coin": {"$gt": 0}}, [("coin", DESCENDING)]),
+    QueryShape(database.users, {"level": {"$gt": 0}}, [("level", DESCENDING)]),
+    QueryShape(database.items, {"owner": _id}),
+    QueryShape(database.items, {"owner": _id, "name": "конфета"}),
+    QueryShape(database.items, {"name": "конфета"}),
+    QueryShape(
+        database.items, {"name": "конфета", "quantity": {"$gt": 0}}, [("quantity", DESCENDING)]
+    ),
+    QueryShape(database.promos, {"name": "promo"}),
+    QueryShape(database.quests, {"owner": _id}),
+    QueryShape(database.exchangers, {"owner": _id}),
+    QueryShape(database.dogs, {"owner": _id}),
+    QueryShape(database.dogs, {"level": {"$gt": 0}}, [("level", DESCENDING)]),
+    QueryShape(database.notifications, {"owner": _id}),
+    QueryShape(database.market_items, {"owner": _id}),
+    QueryShape(database.market_items, {"name": "конфета"}),
+    QueryShape(database.market_items, {}, [("published_at", DESCENDING)]),
+    QueryShape(database.daily_gifts, {"owner": _id}),
+    QueryShape(database.achievements, {"owner": _id}),
+    QueryShape(database.achievements, {"owner": _id, "name": "новичок"}),
+    QueryShape(database.achievements, {"owner": {"$in": [_id]}}),
+]
+
+
+def _stages(plan: Any):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+
+def check_query_plans() -> int:
+    """
+    Создает индексы и прогоняет `explain()` по `QUERY_SHAPES`.
+
+    Возвращает код выхода: 1, если хоть один запрос делает COLLSCAN.
+    """
+    database.ensure_indexes()
+
+    failed = 0
+    for shape in QUERY_SHAPES:
+        cursor = shape.collection.collection.find(shape.filter)
+        if shape.sort:
+            cursor = cursor.sort(shape.sort)
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+
+        stages = set(_stages(plan))
+        status = "COLLSCAN" if "COLLSCAN" in stages else "ok"
+        if status != "ok":
+            failed += 1
+
+        sort = f" sort={shape.sort}" if shape.sort else ""
+        print(f"[{status}] {shape.collection.collection.name} {list(shape.filter)}{sort}")
+
+    print(f"\nЗапросов: {len(QUERY_SHAPES)}, с COLLSCAN: {failed}")
+    return 1 if failed else 0
@@ -1,13 +1,31 @@
-from typing import Final, Generic, Type, TypeVar
+import asyncio
+import sys
+from functools import wraps
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Final,
+    Generic,
+    Optional,
+    ParamSpec,
+    Sequence,
+    Type,
+    TypeVar,
+    Union,
+)
 
 import redis
+import redis.asyncio
 from bson import ObjectId
 from cachetools import TTLCache
-from pymongo import AsyncMongoClient, MongoClient
+from pymongo import ASCENDING, DESCENDING, AsyncMongoClient, IndexModel, MongoClient
 from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.cursor import AsyncCursor
 from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
 
-from config import config
+from config import config, logger
 from database.models import (
     AchievementModel,
     BaseModel,
@@ -19,7 +37,9 @@ from database.models import (
     NotificationModel,
     PromoModel,
     QuestModel,
+    Row,
     UserModel,
+    _int64,
 )
 from helpers.exceptions import NoResult
 
@@ -32,55 +52,180 @@ if config.database.name == "test":
         client.drop_database(config.database.name)
         del choice
 
+# размер батча курсора для потоковых `async_iter*`
+BATCH_SIZE: Final = 500
+
 db = client.get_database(config.database.name)
 async_db = async_client.get_database(config.database.name)
 
 
+_transactions_supported: Optional[bool] = None
+
+
+async def supports_transactions() -> bool:
+    global _transactions_supported
+    if _transactions_supported is None:
+        hello = await async_db.command("hello")
+        # транзакции есть только у репликасета и mongos
+        _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return _transactions_supported
+
+
 T = TypeVar("T", bound=BaseModel)
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+def sync_call(func: Callable[P, R]) -> Callable[P, R]:
+    """
+    Помечает синхронный метод `BaseDB`.
+
+    Синхронный клиент оставлен для тулзов, в режиме отладки вызов из работающего
+    event loop логируется с местом вызова, так как он блокирует все апдейты.
+    """
+
+    @wraps(func)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        if config.general.debug:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+            else:
+                frame = sys._getframe(1)
+                logger.warning(
+                    f"синхронный вызов `{func.__qualname__}` внутри event loop"
+                    f" ({frame.f_code.co_filename}:{frame.f_lineno})"
+                )
+        return func(*args, **kwargs)
+
+    return wrapper
 
 
 class BaseDB(Generic[T]):
-    def __init__(self, collection_name: str, model: Type[T]):
+    def __init__(
+        self,
+        collection_name: str,
+        model: Type[T],
+        indexes: Optional[list[IndexModel]] = None,
+    ):
         self.collection: Collection = db.get_collection(collection_name)
         self.async_collection: AsyncCollection = async_db.get_collection(collection_name)
         self.model = model
+        self.indexes = indexes or []
+
+    def _index_error(self, index: IndexModel, e: OperationFailure):
+        # обычно это дубликаты в старых данных под уникальным индексом
+        logger.error(
+            f"Не удалось создать индекс `{index.document['name']}`"
+            f" в коллекции `{self.collection.name}`: {e}"
+        )
+
+    @staticmethod
+    def _apply_inc(obj: T, modified_count: int, deltas: dict[str, int]) -> bool:
+        if not modified_count:
+            return False
+        # дельта уже в базе: сдвигаем и значение, и снимок, чтобы следующий `update`
+        # не отправил ее второй раз, но и не потерял несохраненные изменения поля
+        for key, delta in deltas.items():
+            setattr(obj, key, getattr(obj, key) + delta)
+            if obj._snapshot is not None and key in obj._snapshot:
+                # тип как у `to_dict`: целые в `Int64`, дробные (xp) остаются float
+                obj._snapshot[key] = _int64(obj._snapshot[key] + delta)
+            if obj._pending_inc and key in obj._pending_inc:
+                total, value = obj._pending_inc[key]
+                obj._pending_inc[key] = (total, value + delta)
+        return True
 
+    @sync_call
+    def ensure_indexes(self):
+        for index in self.indexes:
+            try:
+                self.collection.create_indexes([index])
+            except OperationFailure as e:
+                self._index_error(index, e)
+
+    @sync_call
     def add(self, **kwargs):
         return self.collection.insert_one(kwargs)
 
+    @sync_call
     def delete(self, **data):
         return self.collection.delete_one(data)
 
-    def update(self, _id: ObjectId, **data):
+    @sync_call
+    def update(self, obj: Union[T, ObjectId, None] = None, /, **data):
+        if isinstance(obj, BaseModel):
+            changes = obj.get_changes()
+            if not changes:
+                return None
+            result = self.collection.update_one({"_id": obj._id}, changes)  # type: ignore
+            obj.mark_clean()
+            return result
+        _id = obj if obj is not None else data.pop("_id")
         return self.collection.update_one({"_id": _id}, {"$set": data})
 
+    @sync_call
+    def inc(self, obj: T, filter_: Optional[dict] = None, /, **deltas: int) -> bool:
+        result = self.collection.update_one({"_id": obj._id, **(filter_ or {})}, {"$inc": deltas})
+        return self._apply_inc(obj, result.modified_count, deltas)
+
+    @sync_call
     def get(self, **data) -> T:
         obj = self.collection.find_one(data)
         if not obj:
             raise NoResult
         return self.model.from_dict(obj)
 
+    @sync_call
     def get_all(self, **data) -> list[T]:
-        obj = self.collection.find(data)
-        if not obj:
-            raise NoResult
-        return [self.model.from_dict(attrs) for attrs in obj]
+        return [self.model.from_dict(attrs) for attrs in self.collection.find(data)]
+
+    @sync_call
+    def bulk_write(self, requests: list, ordered: bool = False):
+        return self.collection.bulk_write(requests, ordered=ordered)
 
+    @sync_call
     def check_exists(self, **data) -> bool:
         try:
             return self.get(**data) is not None
         except NoResult:
             return False
 
+    async def async_ensure_indexes(self):
+        for index in self.indexes:
+            try:
+                await self.async_collection.create_indexes([index])
+            except OperationFailure as e:
+                self._index_error(index, e)
+
     async def async_add(self, **kwargs):
         return await self.async_collection.insert_one(kwargs)
 
     async def async_delete(self, **data):
         return await self.async_collection.delete_one(data)
 
-    async def async_update(self, _id: ObjectId, **data):
+    async def async_update(self, obj: Union[T, ObjectId, None] = None, /, **data):
+        if isinstance(obj, BaseModel):
+            changes = obj.get_changes()
+            if not changes:
+                return None
+            result = await self.async_collection.update_one({"_id": obj._id}, changes)  # type: ignore
+            obj.mark_clean()
+            return result
+        _id = obj if obj is not None else data.pop("_id")
         return await self.async_collection.update_one({"_id": _id}, {"$set": data})
 
+    async def async_inc(self, obj: T, filter_: Optional[dict] = None, /, **deltas: int) -> bool:
+        """
+        Атомарный `$inc` по `deltas`, если документ подходит под `filter_`
+        (например `{"coin": {"$gte": price}}`). Возвращает `False`, если условие не выполнилось.
+        """
+        result = await self.async_collection.update_one(
+            {"_id": obj._id, **(filter_ or {})}, {"$inc": deltas}
+        )
+        return self._apply_inc(obj, result.modified_count, deltas)
+
     async def async_get(self, **data) -> T:
         obj = await self.async_collection.find_one(data)
         if not obj:
@@ -89,31 +234,242 @@ class BaseDB(Generic[T]):
 
     async def async_get_all(self, **data) -> list[T]:
         obj = await self.async_collection.find(data).to_list()
-        if not obj:
-            raise NoResult
         return [self.model.from_dict(attrs) for attrs in obj]
 
+    async def async_bulk_write(self, requests: list, ordered: bool = False):
+        return await self.async_collection.bulk_write(requests, ordered=ordered)
+
     async def async_check_exists(self, **data) -> bool:
         try:
             return await self.async_get(**data) is not None
         except NoResult:
             return False
 
+    def _find(
+        self,
+        filter_: Optional[dict],
+        fields: Sequence[str],
+        sort: Optional[list[tuple[str, int]]],
+        limit: int,
+        batch_size: int,
+    ) -> AsyncCursor:
+        projection = None
+        if fields:
+            projection = {name: 1 for name in fields}
+            projection.setdefault("_id", 0)
+        cursor = self.async_collection.find(
+            filter_ or {}, projection, limit=limit, batch_size=batch_size
+        )
+        return cursor.sort(sort) if sort else cursor
+
+    async def async_iter(
+        self,
+        filter_: Optional[dict] = None,
+        /,
+        *,
+        sort: Optional[list[tuple[str, int]]] = None,
+        limit: int = 0,
+        batch_size: int = BATCH_SIZE,
+        track: bool = True,
+    ) -> AsyncIterator[T]:
+        """
+        Модели по одной из курсора, в памяти только текущий батч.
+        `track=False` для обходов без записи (см. `BaseModel.from_dict`).
+        """
+        async for attrs in self._find(filter_, (), sort, limit, batch_size):
+            yield self.model.from_dict(attrs, track)
+
+    async def async_iter_rows(
+        self,
+        filter_: Optional[dict] = None,
+        /,
+        fields: Sequence[str] = (),
+        *,
+        sort: Optional[list[tuple[str, int]]] = None,
+        limit: int = 0,
+        batch_size: int = BATCH_SIZE,
+    ) -> AsyncIterator[Row]:
+        """Как `async_iter`, но только поля `fields` в виде `Row` (см. `BaseModel.row_type`)."""
+        row_type = self.model.row_type(*fields)
+        async for attrs in self._find(filter_, row_type._fields, sort, limit, batch_size):
+            yield row_type.from_dict(attrs)
+
+    async def async_iter_raw(
+        self,
+        filter_: Optional[dict] = None,
+        /,
+        fields: Sequence[str] = (),
+        *,
+        sort: Optional[list[tuple[str, int]]] = None,
+        limit: int = 0,
+        batch_size: int = BATCH_SIZE,
+    ) -> AsyncIterator[dict[str, Any]]:
+        """Документы как есть, `fields` может содержать вложенные пути (`action.end`)."""
+        async for attrs in self._find(filter_, fields, sort, limit, batch_size):
+            yield attrs
+
+
+def _request_owner(request) -> Optional[ObjectId]:
+    """`owner` из фильтра (или вставляемого документа) операции `bulk_write`."""
+    document = getattr(request, "_filter", None) or getattr(request, "_doc", None) or {}
+    owner = document.get("owner")
+    return owner if isinstance(owner, ObjectId) else None
+
+
+class ItemsDB(BaseDB[ItemModel]):
+    """
+    Коллекция предметов со снимком инвентаря на пользователя.
+
+    Снимок грузится одним `find(owner=...)` и сбрасывается после любой записи
+    предметов владельца через этот класс (или явным `invalidate`), в том числе
+    в других процессах бота через pub/sub `database.cache`. Снимок, который
+    грузился одновременно с записью, в кеш не попадает.
+    """
+
+    # namespace сообщений об инвалидации в `database.cache`
+    NAMESPACE: Final = "inventory"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.inventories: TTLCache[ObjectId, list[ItemModel]] = TTLCache(maxsize=4096, ttl=300)
+        # номер последней инвалидации владельца (и всего кеша), чтобы не сохранить
+        # снимок, прочитанный до записи, которая закончилась во время загрузки
+        self._clock = 0
+        self._invalidated: TTLCache[ObjectId, int] = TTLCache(maxsize=4096, ttl=300)
+        self._cleared = 0
+
+    def drop_local(self, owner: Optional[ObjectId] = None):
+        """Сбрасывает снимок только в этом процессе."""
+        self._clock += 1
+        if owner is None:
+            self._cleared = self._clock
+            self.inventories.clear()
+        else:
+            self._invalidated[owner] = self._clock
+            self.inventories.pop(owner, None)
+
+    async def invalidate(self, *owners: Optional[ObjectId]):
+        """Сбрасывает снимки `owners` (без аргументов - все) во всех процессах."""
+        from database.cache import publish_invalidation
+
+        owners = owners or (None,)
+        for owner in owners:
+            self.drop_local(owner)
+        await asyncio.gather(
+            *(
+                publish_invalidation(self.NAMESPACE, str(owner) if owner else None)
+                for owner in owners
+            )
+        )
+
+    async def async_get_inventory(self, owner: ObjectId) -> list[ItemModel]:
+        """Предметы владельца из снимка. Модели общие и без отслеживания изменений, только для чтения."""
+        items = self.inventories.get(owner)
+        if items is None:
+            started = self._clock
+            documents = await self.async_collection.find({"owner": owner}).to_list()
+            items = [self.model.from_dict(document, track=False) for document in documents]
+            if max(self._cleared, self._invalidated.get(owner, 0)) <= started:
+                self.inventories[owner] = items
+        return list(items)
+
+    async def async_add(self, **kwargs):
+        try:
+            return await super().async_add(**kwargs)
+        finally:
+            await self.invalidate(kwargs["owner"])
+
+    async def async_delete(self, **data):
+        try:
+            return await super().async_delete(**data)
+        finally:
+            await self.invalidate(data.get("owner"))
+
+    async def async_update(self, obj: Union[ItemModel, ObjectId, None] = None, /, **data):
+        owners: list[Optional[ObjectId]] = [None]
+        if isinstance(obj, ItemModel):
+            owners = [obj.owner]
+            if obj._snapshot and obj._snapshot.get("owner") != obj.owner:
+                # при передаче предмета меняется владелец
+                owners.append(obj._snapshot["owner"])
+        try:
+            return await super().async_update(obj, **data)
+        finally:
+            await self.invalidate(*owners)
+
+    async def async_inc(self, obj: ItemModel, filter_: Optional[dict] = None, /, **deltas: int):
+        try:
+            return await super().async_inc(obj, filter_, **deltas)
+        finally:
+            await self.invalidate(obj.owner)
+
+    async def async_bulk_write(self, requests: list, ordered: bool = False):
+        owners = {_request_owner(request) for request in requests}
+        try:
+            return await super().async_bulk_write(requests, ordered)
+        finally:
+            # операции без `owner` в фильтре сбрасывают весь кеш
+            await self.invalidate(*(owners if None not in owners else ()))
+
 
 class DataBase:
     def __init__(self) -> None:
-        self.users = BaseDB("users", UserModel)
-        self.items = BaseDB("items", ItemModel)
-        self.promos = BaseDB("promos", PromoModel)
-        self.quests = BaseDB("quests", QuestModel)
-        self.exchangers = BaseDB("exchangers", ExchangerModel)
-        self.dogs = BaseDB("dogs", DogModel)
-        self.notifications = BaseDB("notifications", NotificationModel)
-        self.market_items = BaseDB("market_items", MarketItemModel)
-        self.daily_gifts = BaseDB("daily_gifts", DailyGiftModel)
-        self.achievements = BaseDB("achievements", AchievementModel)
+        owner = IndexModel("owner", unique=True)
+        owner_name = [("owner", ASCENDING), ("name", ASCENDING)]
+
+        self.users = BaseDB(
+            "users",
+            UserModel,
+            [
+                IndexModel("id", unique=True),
+                IndexModel([("coin", DESCENDING)]),
+                IndexModel([("level", DESCENDING)]),
+            ],
+        )
+        self.items = ItemsDB(
+            "items",
+            ItemModel,
+            [
+                IndexModel(owner_name),
+                # у счетных предметов один документ на владельца, на нем держатся
+                # upsert и условие `quantity >= n` в `change_items`
+                IndexModel(
+                    owner_name,
+                    name="owner_name_countable",
+                    unique=True,
+                    partialFilterExpression={"usage": {"$type": "null"}},
+                ),
+                IndexModel([("name", ASCENDING), ("quantity", DESCENDING)]),
+            ],
+        )
+        self.promos = BaseDB("promos", PromoModel, [IndexModel("name", unique=True)])
+        self.quests = BaseDB("quests", QuestModel, [owner])
+        self.exchangers = BaseDB("exchangers", ExchangerModel, [owner])
+        self.dogs = BaseDB("dogs", DogModel, [owner, IndexModel([("level", DESCENDING)])])
+        self.notifications = BaseDB("notifications", NotificationModel, [owner])
+        self.market_items = BaseDB(
+            "market_items",
+            MarketItemModel,
+            [IndexModel("owner"), IndexModel("name"), IndexModel([("published_at", DESCENDING)])],
+        )
+        self.daily_gifts = BaseDB("daily_gifts", DailyGiftModel, [owner])
+        self.achievements = BaseDB(
+            "achievements", AchievementModel, [IndexModel(owner_name, unique=True)]
+        )
+
+    @property
+    def collections(self) -> list[BaseDB]:
+        return [value for value in vars(self).values() if isinstance(value, BaseDB)]
+
+    def ensure_indexes(self):
+        for collection in self.collections:
+            collection.ensure_indexes()
+
+    async def async_ensure_indexes(self):
+        for collection in self.collections:
+            await collection.async_ensure_indexes()
 
 
 database: Final = DataBase()
 redis_cache: Final = redis.from_url(config.redis.url)
-cache: Final = TTLCache(maxsize=1, ttl=1800)
+async_redis_cache: Final = redis.asyncio.from_url(config.redis.url)
@@ -1,32 +1,306 @@
-from dataclasses import asdict, dataclass, field
+from dataclasses import MISSING, dataclass, field, fields, is_dataclass
 from datetime import datetime, timedelta
-from typing import Literal, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Literal,
+    Mapping,
+    Optional,
+    Union,
+    get_args,
+    get_origin,
+    get_type_hints,
+)
 
 from bson import Int64, ObjectId
-from dacite import from_dict as _from_dict
-from dacite.data import Data
 from dateutil.relativedelta import relativedelta  # cspell: disable-line
 
 from helpers.datetime_utils import utcnow
 from helpers.enums import ItemType, Locations
 
+# ---------------------------------------------------------------------------- #
+#                                    codecs                                    #
+# ---------------------------------------------------------------------------- #
+
+# значения этих типов не копируются и не приводятся к `Int64`
+_PLAIN_TYPES: tuple[type, ...] = (str, bool, datetime, ObjectId)
+
+
+def _int64(value: Any) -> Any:
+    if value.__class__ is int:
+        return Int64(value)
+    if value.__class__ in (bool, Int64) or not isinstance(value, int):
+        return value
+    return Int64(value)
+
+
+def _copy(value: Any) -> Any:
+    # как `asdict` копирует вложенные контейнеры, только без `copy.deepcopy` на листьях
+    if value.__class__ is dict:
+        return {key: _copy(item) for key, item in value.items()}
+    if value.__class__ is list:
+        return [_copy(item) for item in value]
+    if value.__class__ is tuple:
+        return tuple(_copy(item) for item in value)
+    if is_dataclass(value) and not isinstance(value, type):
+        return get_codec(type(value)).to_nested_dict(value)
+    return value
+
+
+class Row:
+    """
+    Легкое представление документа только для чтения: `__slots__` вместо
+    `__dict__`, вложенные значения (нарушения, действие) остаются как в монге.
+
+    Для массовых обходов коллекций, где модель и отслеживание изменений не нужны.
+    """
+
+    __slots__ = ()
+    _fields: tuple[str, ...] = ()
+
+    if TYPE_CHECKING:
+
+        def __getattr__(self, name: str) -> Any: ...
+
+        # генерируется для каждого типа в `_make_row_type`
+        @classmethod
+        def from_dict(cls, data: Mapping[str, Any]) -> "Row": ...
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} только для чтения")
+
+    def __repr__(self) -> str:
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self._fields)
+        return f"{type(self).__name__}({values})"
+
+    def to_dict(self) -> dict[str, Any]:
+        return {name: getattr(self, name) for name in self._fields}
+
+
+def _make_row_type(cls: type, names: tuple[str, ...]) -> type[Row]:
+    model_fields = {f.name: f for f in fields(cls)}
+    unknown = set(names) - set(model_fields)
+    if unknown:
+        raise ValueError(f"У {cls.__name__} нет полей {', '.join(sorted(unknown))}")
+
+    row_type: type[Row] = type(f"{cls.__name__}Row", (Row,), {"__slots__": names, "_fields": names})
+    namespace: dict[str, Any] = {"row_type": row_type, "new": object.__new__, "MISSING": MISSING}
+    lines = ["def from_dict(data):", "    obj = new(row_type)"]
+    for name in names:
+        f = model_fields[name]
+        # сеттер слота напрямую, в обход запрещающего `__setattr__`
+        namespace[f"set_{name}"] = getattr(row_type, name).__set__
+        if f.default is not MISSING:
+            namespace[f"default_{name}"] = f.default
+            value = f"data.get({name!r}, default_{name})"
+        elif f.default_factory is not MISSING:
+            namespace[f"factory_{name}"] = f.default_factory
+            lines.append(f"    value = data.get({name!r}, MISSING)")
+            value = f"factory_{name}() if value is MISSING else value"
+        else:
+            value = f"data[{name!r}]"
+        lines.append(f"    set_{name}(obj, {value})")
+    lines.append("    return obj")
+
+    exec(compile("\n".join(lines), f"<row {cls.__qualname__}>", "exec"), namespace)
+    row_type.from_dict = staticmethod(namespace["from_dict"])  # type: ignore
+    return row_type
+
+
+class Codec:
+    """
+    Конвертеры dataclass <-> документ монги, сгенерированные один раз на класс.
+
+    Повторяют `dacite.from_dict` и `asdict` с приведением целых чисел верхнего
+    уровня к `Int64`, но без рефлексии и проверки типов на каждом вызове.
+    """
+
+    def __init__(self, cls: type):
+        hints = get_type_hints(cls)
+        namespace: dict[str, Any] = {
+            "cls": cls,
+            "MISSING": MISSING,
+            "_int64": _int64,
+            "_copy": _copy,
+        }
+        to_dict, to_nested_dict, required, optional = [], [], [], []
+
+        for f in fields(cls):
+            encode, encode_nested, decode = self._converters(f.name, hints[f.name], namespace)
+            to_dict.append(f"{f.name!r}: {encode.format(f'obj.{f.name}')},")
+            to_nested_dict.append(f"{f.name!r}: {encode_nested.format(f'obj.{f.name}')},")
+
+            if f.default is MISSING and f.default_factory is MISSING:
+                required.append(f"{f.name}={decode.format(f'data[{f.name!r}]')},")
+            else:
+                optional.append(
+                    f"    value = data.get({f.name!r}, MISSING)\n"
+                    f"    if value is not MISSING:\n"
+                    f"        kwargs[{f.name!r}] = {decode.format('value')}\n"
+                )
+
+        source = (
+            f"def to_dict(obj):\n    return {{{' '.join(to_dict)}}}\n"
+            f"def to_nested_dict(obj):\n    return {{{' '.join(to_nested_dict)}}}\n"
+            "def from_dict(data):\n    kwargs = {}\n"
+            f"{''.join(optional)}"
+            f"    return cls({' '.join(required)} **kwargs)\n"
+        )
+        exec(compile(source, f"<codec {cls.__qualname__}>", "exec"), namespace)
+
+        self.cls = cls
+        self.source = source
+        self._row_types: dict[tuple[str, ...], type[Row]] = {}
+        self.to_dict: Callable[[Any], dict] = namespace["to_dict"]
+        self.to_nested_dict: Callable[[Any], dict] = namespace["to_nested_dict"]
+        self.from_dict: Callable[[Mapping], Any] = namespace["from_dict"]
+
+    def row_type(self, names: tuple[str, ...] = ()) -> type[Row]:
+        """Класс `Row` для полей `names` (или всех полей модели)."""
+        names = names or tuple(f.name for f in fields(self.cls))
+        row_type = self._row_types.get(names)
+        if row_type is None:
+            row_type = self._row_types[names] = _make_row_type(self.cls, names)
+        return row_type
+
+    @staticmethod
+    def _converters(name: str, type_: Any, namespace: dict[str, Any]) -> tuple[str, str, str]:
+        """
+        Шаблоны выражений (`{0}` - значение) для записи поля, записи поля
+        вложенного dataclass (`asdict` не приводит его к `Int64`) и чтения.
+        """
+        origin, args = get_origin(type_), get_args(type_)
+
+        if origin is Union and type(None) in args:
+            inner = [arg for arg in args if arg is not type(None)]
+            if len(inner) == 1 and is_dataclass(inner[0]):
+                namespace[f"_{name}_codec"] = get_codec(inner[0])
+                encode = f"(None if {{0}} is None else _{name}_codec.to_nested_dict({{0}}))"
+                return (
+                    encode,
+                    encode,
+                    f"(None if {{0}} is None else _{name}_codec.from_dict({{0}}))",
+                )
+            if len(inner) == 1:
+                type_, origin, args = inner[0], get_origin(inner[0]), get_args(inner[0])
+
+        if origin is list and args and is_dataclass(args[0]):
+            namespace[f"_{name}_codec"] = get_codec(args[0])
+            encode = f"[_{name}_codec.to_nested_dict(item) for item in {{0}}]"
+            return encode, encode, f"[_{name}_codec.from_dict(item) for item in {{0}}]"
+
+        if origin is Literal or (isinstance(type_, type) and issubclass(type_, _PLAIN_TYPES)):
+            return "{0}", "{0}", "{0}"
+        if type_ in (dict, list) or origin in (dict, list):
+            return "_copy({0})", "_copy({0})", "{0}"
+        # int, float (может хранить int) и остальное приводятся по типу значения
+        return "_int64({0})", "{0}", "{0}"
+
+
+_CODECS: dict[type, Codec] = {}
+
+
+def get_codec(cls: type) -> Codec:
+    codec = _CODECS.get(cls)
+    if codec is None:
+        codec = _CODECS[cls] = Codec(cls)
+    return codec
+
+
+# ---------------------------------------------------------------------------- #
+#                                    models                                    #
+# ---------------------------------------------------------------------------- #
+
 
 @dataclass
 class BaseModel:
+    # состояние документа на момент последнего чтения/записи, по нему считаются изменения
+    _snapshot = None
+    # поля, измененные через `inc`: {поле: (дельта, ожидаемое значение)}
+    _pending_inc = None
+
     def to_dict(self) -> dict:
-        result = {}
-        for key, value in asdict(self).items():
-            if isinstance(value, bool):
-                result[key] = value
-            elif isinstance(value, int):
-                result[key] = Int64(value)
-            else:
-                result[key] = value
-        return result
+        return get_codec(type(self)).to_dict(self)
+
+    @classmethod
+    def from_dict(cls, dict_data: Mapping[str, Any], track: bool = True):
+        """
+        Модель из документа. С `track=False` снимок не строится: это вдвое меньше
+        памяти и без полного `to_dict` на чтении, но такая модель при записи
+        отправит все поля через `$set`, поэтому только для чтения.
+        """
+        obj = get_codec(cls).from_dict(dict_data)
+        if not track:
+            return obj
+        obj.mark_clean()
+        # полей, которых нет в документе, нет и в снимке: они запишутся через `$set`
+        for key in obj._snapshot.keys() - dict_data.keys():
+            del obj._snapshot[key]
+        return obj
 
     @classmethod
-    def from_dict(cls, dict_data: Data):
-        return _from_dict(cls, dict_data)
+    def row_type(cls, *fields: str) -> type[Row]:
+        """Легкий класс только для чтения с полями `fields` (по умолчанию всеми)."""
+        return get_codec(cls).row_type(fields)
+
+    def mark_clean(self, *fields: str) -> None:
+        """Считает текущие значения полей (или всех полей) уже сохраненными в базе."""
+        if not fields or self._snapshot is None:
+            self._snapshot = self.to_dict()
+            self._pending_inc = None
+            return
+        current = self.to_dict()
+        for key in fields:
+            self._snapshot[key] = current[key]
+            if self._pending_inc:
+                self._pending_inc.pop(key, None)
+
+    def inc(self, **deltas: Union[int, float]) -> None:
+        """
+        Прибавляет `deltas` к полям-счетчикам (`user.inc(coin=10)`). Такие поля
+        записываются через `$inc`, так что параллельные начисления не теряются.
+        Если после `inc` полю присвоили значение, оно запишется через `$set`.
+        """
+        if self._pending_inc is None:
+            self._pending_inc = {}
+        for key, delta in deltas.items():
+            value = getattr(self, key) + delta
+            setattr(self, key, value)
+            total = self._pending_inc.get(key, (0, None))[0] + delta
+            self._pending_inc[key] = (total, value)
+
+    def get_changes(self) -> dict[str, dict[str, Any]]:
+        """
+        Возвращает update-документ только с измененными полями: поля,
+        измененные через `inc`, уходят через `$inc`, остальное через `$set`.
+        """
+        current = self.to_dict()
+        current.pop("_id", None)
+
+        if self._snapshot is None:
+            return {"$set": current} if current else {}
+
+        pending = self._pending_inc or {}
+        to_set: dict[str, Any] = {}
+        to_inc: dict[str, Any] = {}
+        for key, value in current.items():
+            if key in self._snapshot:
+                old = self._snapshot[key]
+                if old == value and type(old) is type(value):
+                    continue
+                if key in pending and pending[key][1] == value:
+                    delta = pending[key][0]
+                    to_inc[key] = Int64(delta) if isinstance(delta, int) else delta
+                    continue
+            to_set[key] = value
+
+        changes = {}
+        if to_set:
+            changes["$set"] = to_set
+        if to_inc:
+            changes["$inc"] = to_inc
+        return changes
 
 
 @dataclass
@@ -160,6 +434,8 @@ class UserModel(BaseModel):
     last_active_time: datetime = field(default_factory=utcnow)
     achievement_progress: dict = field(default_factory=dict)
     accepted_rules: bool = False
+    # id пригласившего пользователя, ставится один раз
+    referred_by: Optional[int] = None
 
 
 @dataclass
@@ -1,22 +1,25 @@
 import random
 import string
-import time
-from functools import partial
 
 from aiogram import Router
-from aiogram.exceptions import TelegramAPIError
 from aiogram.filters import Command, CommandObject
 from aiogram.types import ChatPermissions, Message
 
-from config import logger
-from database.funcs import database, redis_cache
-from database.models import PromoModel, Violation
+from base.broadcast import (
+    acquire_lock,
+    clear_state,
+    get_state,
+    new_state,
+    release_lock,
+    run_broadcast,
+)
+from database.cache import CACHES
+from database.funcs import database
+from database.models import PromoModel, UserModel, Violation
 from helpers.datetime_utils import utcnow
 from helpers.exceptions import NoResult
 from helpers.utils import (
     Loading,
-    MessageEditor,
-    antiflood,
     get_item,
     get_user_tag,
     parse_time_duration,
@@ -28,8 +31,7 @@ router = Router()
 
 
 @router.message(Command("warn"))
-async def warn_cmd(message: Message, command: CommandObject):
-    user = await database.users.async_get(id=message.from_user.id)
+async def warn_cmd(message: Message, command: CommandObject, user: UserModel):
     if not user.is_admin:
         return
 
@@ -42,7 +44,7 @@ async def warn_cmd(message: Message, command: CommandObject):
 
     reply_user.violations.append(Violation(reason, "warn"))
 
-    await database.users.async_update(**reply_user.to_dict())
+    await database.users.async_update(reply_user)
 
     mess = f"{get_user_tag(reply_user)} получил варн.\n\n<b>Причина</b>\n<i>{reason}</i>"
     markup = quick_markup({"Правила": {"url": "https://hamletsargsyan.github.io/livebot/rules"}})
@@ -51,8 +53,7 @@ async def warn_cmd(message: Message, command: CommandObject):
 
 
 @router.message(Command("mute"))
-async def mute_cmd(message: Message, command: CommandObject):
-    user = await database.users.async_get(id=message.from_user.id)
+async def mute_cmd(message: Message, command: CommandObject, user: UserModel):
     if not user.is_admin:
         return
 
@@ -77,7 +78,7 @@ async def mute_cmd(message: Message, command: CommandObject):
 
     reply_user.violations.append(Violation(reason, "mute", until_date=mute_end_time))
 
-    await database.users.async_update(**reply_user.to_dict())
+    await database.users.async_update(reply_user)
 
     await message.bot.restrict_chat_member(
         message.chat.id,
@@ -97,8 +98,7 @@ async def mute_cmd(message: Message, command: CommandObject):
 
 
 @router.message(Command("ban"))
-async def ban_cmd(message: Message, command: CommandObject):
-    user = await database.users.async_get(id=message.from_user.id)
+async def ban_cmd(message: Message, command: CommandObject, user: UserModel):
     if not user.is_admin:
         return
 
@@ -125,7 +125,7 @@ async def ban_cmd(message: Message, command: CommandObject):
 
     reply_user.violations.append(Violation(reason, "ban", until_date=ban_end_time))
 
-    await database.users.async_update(**reply_user.to_dict())
+    await database.users.async_update(reply_user)
 
     await message.bot.restrict_chat_member(
         message.chat.id,
@@ -153,12 +153,11 @@ async def ban_cmd(message: Message, command: CommandObject):
 
 
 @router.message(Command("pban"))
-async def pban_cmd(message: Message, command: CommandObject):
+async def pban_cmd(message: Message, command: CommandObject, user: UserModel):
     """
     Usage:
         /pban time{d,h,m} [reason]
     """
-    user = await database.users.async_get(id=message.from_user.id)
     if not user.is_admin:
         return
 
@@ -175,7 +174,7 @@ async def pban_cmd(message: Message, command: CommandObject):
 
     reply_user.violations.append(Violation(reason, "permanent-ban"))
 
-    await database.users.async_update(**reply_user.to_dict())
+    await database.users.async_update(reply_user)
 
     await message.bot.ban_chat_member(message.chat.id, reply_user.id)
 
@@ -188,8 +187,7 @@ async def pban_cmd(message: Message, command: CommandObject):
 
 
 @router.message(Command("unban"))
-async def unban_cmd(message: Message):
-    user = await database.users.async_get(id=message.from_user.id)
+async def unban_cmd(message: Message, user: UserModel):
     if not user.is_admin:
         return
 
@@ -201,17 +199,15 @@ async def unban_cmd(message: Message):
         for violation in reply_user.violations
         if violation.type not in ["ban", "permanent-ban"]
     ]
-    await database.users.async_update(**reply_user.to_dict())
+    await database.users.async_update(reply_user)
     await message.bot.unban_chat_member(message.chat.id, reply_user.id, only_if_banned=True)
 
     await message.answer(f"{get_user_tag(reply_user)} разбанен")
 
 
 @router.message(Command("add_promo"))
-async def add_promo(message: Message):
+async def add_promo(message: Message, user: UserModel):
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
-
         if not user.is_admin:
             return
 
@@ -261,41 +257,86 @@ async def add_promo(message: Message):
 
 
 @router.message(Command("broadcast"))
-async def broadcast_cmd(message: Message):
-    user = await database.users.async_get(id=message.from_user.id)
+async def broadcast_cmd(message: Message, user: UserModel):
+    if not user.is_admin:
+        return
+
+    if not await acquire_lock():
+        await message.reply("На данный момент уже идет бродкаст")
+        return
+
+    try:
+        if state := await get_state():
+            await message.reply(
+                f"Есть незаконченный бродкаст ({state.processed}/{state.total})\n\n"
+                "<code>/broadcast_resume</code> — продолжить\n"
+                "<code>/broadcast_cancel</code> — удалить"
+            )
+            return
+
+        state = await new_state(message.html_text.removeprefix("/broadcast"))
+        await run_broadcast(message, state)
+    finally:
+        await release_lock()
+
 
+@router.message(Command("broadcast_resume"))
+async def broadcast_resume_cmd(message: Message, user: UserModel):
     if not user.is_admin:
         return
 
-    if redis_cache.get("broadcast"):
-        await antiflood(message.reply("На данный момент уже идет бродкаст"))
+    if not await acquire_lock():
+        await message.reply("На данный момент уже идет бродкаст")
         return
 
-    mess = message.html_text.removeprefix("/broadcast")
+    try:
+        state = await get_state()
+        if not state:
+            await message.reply("Нет незаконченного бродкаста")
+            return
+        await run_broadcast(message, state)
+    finally:
+        await release_lock()
 
-    async with MessageEditor(message, title="Бродкаст") as msg:
-        redis_cache.set("broadcast", 1)
-        msg.exit_funcs.add(partial(redis_cache.delete, "broadcast"))
 
-        start_time = time.monotonic()
-        users = await database.users.async_get_all()
+@router.message(Command("broadcast_cancel"))
+async def broadcast_cancel_cmd(message: Message, user: UserModel):
+    if not user.is_admin:
+        return
 
-        total_count = len(users)
-        success_count = 0
-        fatal_count = 0
+    # идущий бродкаст держит лок, его состояние удалять нельзя
+    if not await acquire_lock():
+        await message.reply("На данный момент уже идет бродкаст")
+        return
 
-        await msg.write(f"Кол-во пользователей: {total_count}")
+    try:
+        await clear_state()
+        await message.reply("Незаконченный бродкаст удален")
+    finally:
+        await release_lock()
 
-        for user in users:
-            try:
-                await antiflood(message.bot.send_message(user.id, mess))
-                success_count += 1
-            except TelegramAPIError as e:
-                fatal_count += 1
-                logger.error(str(e))
 
-        total_time = time.monotonic() - start_time
-        await msg.write("Бродкаст закончился")
-        await msg.write(f"Время: {total_time:_.2f} с.")
-        await msg.write(f"Кол-во юзеров получивших сообщение: {success_count}")
-        await msg.write(f"Кол-во ошибок: {fatal_count}")
+@router.message(Command("cache"))
+async def cache_cmd(message: Message, user: UserModel, command: CommandObject):
+    if not user.is_admin:
+        return
+
+    args = (command.args or "").split()
+    if args and args[0] == "clear":
+        namespaces = args[1:] or list(CACHES)
+        for namespace in namespaces:
+            if namespace in CACHES:
+                await CACHES[namespace].invalidate()
+        await message.reply(f"Кеш очищен: {', '.join(namespaces)}")
+        return
+
+    mess = "<b>Кеш</b>\n\n"
+    for namespace, cache in CACHES.items():
+        stats = cache.stats
+        mess += (
+            f"<code>{namespace}</code>: {stats.hit_rate:.0%} попаданий"
+            f" (L1: {stats.l1_hits}, L2: {stats.l2_hits}, ожидания: {stats.coalesced},"
+            f" промахи: {stats.misses})\n"
+        )
+    mess += "\n<code>/cache clear [namespace]</code> — очистить"
+    await message.reply(mess)
@@ -1,5 +1,7 @@
+import asyncio
 import random
 from datetime import UTC, timedelta
+from typing import Final
 
 from aiogram import F, Router
 from aiogram.exceptions import TelegramAPIError
@@ -14,23 +16,39 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from bson import ObjectId
 
 from base.actions import game, sleep, street, work
-from base.items import ITEMS
+from base.items import ITEMS, ITEMS_BY_RARITY
+from base.market import (
+    claim_market_item,
+    get_market_pages_count,
+    get_middle_item_price,
+    get_user_market_items_count,
+    pay_seller,
+    record_trade,
+    remove_listing_price,
+)
 from base.player import (
-    add_user_usage_item,
+    add_items,
+    change_items,
     check_user_stats,
+    claim_referral,
     coin_top,
     dog_level_top,
     generate_quest,
     get_available_items_for_use,
+    get_inventory_quantities,
     get_or_add_user_item,
     level_top,
+    pop_pending_referral,
+    reward_referrer,
+    take_items,
+    transfer_usable_item,
     use_item,
 )
 from database.funcs import database
-from database.models import DogModel
+from database.models import DogModel, ItemModel, UserModel
 from helpers.datetime_utils import utcnow
 from helpers.enums import ItemRarity, ItemType
-from helpers.exceptions import ItemIsCoin, NoResult
+from helpers.exceptions import NoResult
 from helpers.markups import InlineMarkup
 from helpers.utils import (
     achievement_progress,
@@ -40,21 +58,25 @@ from helpers.utils import (
     get_item,
     get_item_count_for_rarity,
     get_item_emoji,
-    get_middle_item_price,
     get_time_difference_string,
     get_user_tag,
     increment_achievement_progress,
+    increment_achievements_progress,
     quick_markup,
     safe,
 )
 
 router = Router()
 
+CHEST_ITEMS: Final = {
+    rarity: tuple(item for item in items if item.name != "бабло")
+    for rarity, items in ITEMS_BY_RARITY.items()
+}
+
 
 @router.callback_query(F.data.startswith("dog"))
-async def dog_callback(call: CallbackQuery):
+async def dog_callback(call: CallbackQuery, user: UserModel):
     data = call.data.split(" ")
-    user = await database.users.async_get(id=call.from_user.id)
 
     try:
         dog = await database.dogs.async_get(owner=user._id)
@@ -84,7 +106,7 @@ async def dog_callback(call: CallbackQuery):
             await call.answer("Пока ты думал псина сбежала", show_alert=True)
             return
 
-        item = get_or_add_user_item(user, "кость")
+        item = await get_or_add_user_item(user, "кость")
 
         if item.quantity <= int(data[2]):
             await call.answer(
@@ -109,26 +131,23 @@ async def dog_callback(call: CallbackQuery):
         if dog.hunger == 0:
             await call.answer(f"{dog.name} не голоден", show_alert=True)
             return
-        item = get_or_add_user_item(user, "мясо")
-
         quantity = dog.level * 2
 
-        if item.quantity < quantity:
+        if not await take_items(user, {"мясо": quantity}):
+            have = (await get_inventory_quantities(user)).get("мясо", 0)
             await call.answer(
-                f"Тебе не хватает мяса, нужно {quantity} а у тебя {item.quantity}",
+                f"Тебе не хватает мяса, нужно {quantity} а у тебя {have}",
                 show_alert=True,
             )
             return
-        item.quantity -= quantity
         count = random.randint(1, 10)
         dog.hunger -= count
-        dog.xp += random.uniform(0.1, 0.3)
+        dog.inc(xp=random.uniform(0.1, 0.3))
         await call.answer(
             f"{dog.name} поел мяса и восстановил {count} единиц голода",
             show_alert=True,
         )
-        await database.dogs.async_update(**dog.to_dict())
-        await database.items.async_update(**item.to_dict())
+        await database.dogs.async_update(dog)
 
         await check_user_stats(user, call.message.chat.id)
 
@@ -175,22 +194,20 @@ async def dog_callback(call: CallbackQuery):
         await call.answer(f"{dog.name} проснулся", show_alert=True)
         dog.sleep_time = utcnow()
 
-    await database.users.async_update(**user.to_dict())
+    await database.users.async_update(user)
     if dog:
-        await database.dogs.async_update(**dog.to_dict())
+        await database.dogs.async_update(dog)
     await check_user_stats(user)
 
 
 @router.callback_query(F.data.startswith("skip_quest"))
-async def skip_quest_callback(call: CallbackQuery):
+async def skip_quest_callback(call: CallbackQuery, user: UserModel):
     if call.data.split(" ")[-1] != str(call.from_user.id):
         return
 
     if not isinstance(call.message, Message):
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
-
     if not user.new_quest_coin_quantity:
         user.new_quest_coin_quantity = 2
 
@@ -204,10 +221,10 @@ async def skip_quest_callback(call: CallbackQuery):
         )
         return
 
-    generate_quest(user)
-    user.coin -= user.new_quest_coin_quantity
+    await generate_quest(user)
+    user.inc(coin=-user.new_quest_coin_quantity)
     user.new_quest_coin_quantity += random.randint(10, 20)
-    await database.users.async_update(**user.to_dict())
+    await database.users.async_update(user)
 
     await call.answer(
         "Ты получил новый квест, напиши /quest чтобы посмотреть",
@@ -216,31 +233,25 @@ async def skip_quest_callback(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("finish_quest"))
-async def finish_quest_callback(call: CallbackQuery):
+async def finish_quest_callback(call: CallbackQuery, user: UserModel):
     if call.data.split(" ")[-1] != str(call.from_user.id):
         return
 
     if not isinstance(call.message, Message):
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
-
     try:
         quest = await database.quests.async_get(**{"owner": user._id})
     except NoResult:
-        quest = generate_quest(user)
-
-    item = get_or_add_user_item(user, quest.name)
+        quest = await generate_quest(user)
 
-    if item.quantity < quest.quantity:
+    if not await take_items(user, {quest.name: quest.quantity}):
         await call.answer("Кудааа, тебе не хватает", show_alert=True)  # cspell:ignore Кудааа
         return
 
-    item.quantity -= quest.quantity
-    user.xp += quest.xp
-    user.coin += quest.reward
-    await database.users.async_update(**user.to_dict())
-    await database.items.async_update(**item.to_dict())
+    user.inc(xp=quest.xp)
+    user.inc(coin=quest.reward)
+    await database.users.async_update(user)
 
     mess = (
         "Ураа, ты завершил квест\n"
@@ -252,8 +263,8 @@ async def finish_quest_callback(call: CallbackQuery):
     total_time = utcnow() - quest.start_time
     mess += get_time_difference_string(total_time)
 
-    generate_quest(user)
-    increment_achievement_progress(user, "квестоман")
+    await generate_quest(user)
+    await increment_achievement_progress(user, "квестоман")
     await call.message.delete()
 
     user_message = call.message.reply_to_message
@@ -269,22 +280,20 @@ async def finish_quest_callback(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("use"))
-async def use_callback(call: CallbackQuery):
+async def use_callback(call: CallbackQuery, user: UserModel):
     if call.data.split(" ")[-1] != str(call.from_user.id):
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
-
     item = get_item(call.data.split(" ")[1])
 
     if not call.message.reply_to_message:
         return
 
-    await use_item(call.message.reply_to_message, item.name)
+    await use_item(call.message.reply_to_message, user, item.name)
 
-    markup = InlineMarkup.use(user)
+    markup = await InlineMarkup.use(user)
 
-    items = get_available_items_for_use(user)
+    items = await get_available_items_for_use(user)
 
     if not items:
         mess = "Нет доступных предметов для юза"
@@ -294,12 +303,11 @@ async def use_callback(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("item_info_main"))
-async def item_info_main_callback(call: CallbackQuery):
+async def item_info_main_callback(call: CallbackQuery, user: UserModel):
     if call.data.split(" ")[-1] != str(call.from_user.id):
         return
 
     try:
-        user = await database.users.async_get(id=call.from_user.id)
         action = call.data.split(" ")[1]
         pos = int(call.data.split(" ")[2])
         max_pos = len(list(batched(ITEMS, 6))) - 1
@@ -353,14 +361,13 @@ async def item_info_callback(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("trader"))
-async def trader_callback(call: CallbackQuery):
+async def trader_callback(call: CallbackQuery, user: UserModel):
     data = call.data.split(" ")
     if data[-1] != str(call.from_user.id):
         return
 
     if not isinstance(call.message, Message):
         return
-    user = await database.users.async_get(id=call.from_user.id)
 
     if data[1] == "leave":
         await call.message.delete()
@@ -373,15 +380,13 @@ async def trader_callback(call: CallbackQuery):
         item = get_item(data[2])
         quantity = int(data[3])
         price = int(data[4])
-        user_item = get_or_add_user_item(user, item.name)
 
-        if user.coin < price:
+        if not await database.users.async_inc(user, {"coin": {"$gte": price}}, coin=-price):
             await call.answer(f"Тебе нехватает {price - user.coin} бабла", show_alert=True)
 
             return
 
-        user.coin -= price
-        user_item.quantity += quantity
+        await add_items(user, {item.name: quantity})
         await call.message.delete()
         await call.message.answer(f"Купил {quantity} {item.name} {item.emoji} за {price}")
 
@@ -400,16 +405,16 @@ async def top_callback(call: CallbackQuery):
         }
     )
 
-    tops = {"coin": coin_top(), "level": level_top(), "dog_level": dog_level_top()}
+    tops = {"coin": coin_top, "level": level_top, "dog_level": dog_level_top}
 
     try:
-        await call.message.edit_text(tops[data[1]], reply_markup=markup)
+        await call.message.edit_text(await tops[data[1]](), reply_markup=markup)
     except TelegramAPIError:
         pass
 
 
 @router.callback_query(F.data.startswith("chest"))
-async def chest_callback(call: CallbackQuery):
+async def chest_callback(call: CallbackQuery, user: UserModel):
     data = call.data.split(" ")
 
     if data[-1] != str(call.from_user.id):
@@ -417,16 +422,10 @@ async def chest_callback(call: CallbackQuery):
 
     if not isinstance(call.message, Message):
         return
-    user = await database.users.async_get(id=call.from_user.id)
 
     if data[1] == "open":
-        key = get_or_add_user_item(user, "ключ")
-        if key.quantity < 1:
-            await call.answer("У тебя нет ключа", show_alert=True)
-            return
-        key.quantity -= 1
         mess = "Открыл сундук\n\n"
-        items = []
+        items: dict[str, int] = {}
         for _ in range(random.randint(2, 5)):
             rarity = random.choice(
                 [
@@ -435,17 +434,16 @@ async def chest_callback(call: CallbackQuery):
                 ]
             )
             quantity = get_item_count_for_rarity(rarity)
-            item = random.choice(
-                [item for item in ITEMS if item.rarity == rarity and item.name != "бабло"]
-            )
+            item = random.choice(CHEST_ITEMS[rarity])
             if item.name in items or quantity < 1:
                 continue
-            items.append(item.name)
+            items[item.name] = quantity
             mess += f"+ {quantity} {item.name} {item.emoji}\n"
-            user_item = get_or_add_user_item(user, item.name)
-            user_item.quantity += quantity
-            await database.items.async_update(**user_item.to_dict())
-        increment_achievement_progress(user, "кладоискатель")
+
+        if not await change_items(user, add=items, take={"ключ": 1}):
+            await call.answer("У тебя нет ключа", show_alert=True)
+            return
+        await increment_achievement_progress(user, "кладоискатель")
         await call.message.delete()
         if call.message.reply_to_message:
             await call.message.reply(mess)
@@ -459,14 +457,12 @@ async def chest_callback(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("actions"))
-async def actions_callback(call: CallbackQuery):
+async def actions_callback(call: CallbackQuery, user: UserModel):
     data = call.data.split(" ")
 
     if data[-1] != str(call.from_user.id):
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
-
     if data[1] == "choice":
         markup = InlineMarkup.actions_choice(user)
 
@@ -488,14 +484,12 @@ async def actions_callback(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("open"))
-async def open_callback(call: CallbackQuery):
+async def open_callback(call: CallbackQuery, user: UserModel):
     data = call.data.split(" ")
 
     if data[-1] != str(call.from_user.id):
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
-
     if data[1] == "home":
         mess = "🏠 Дом милый дом"
         markup = InlineMarkup.home_main(user)
@@ -507,29 +501,27 @@ async def open_callback(call: CallbackQuery):
         await call.message.edit_text(mess, reply_markup=markup)
     elif data[1] == "bag":
         mess = "Инвентарь"
-        markup = InlineMarkup.bag(user)
+        markup = await InlineMarkup.bag(user)
 
         await call.message.edit_text(mess, reply_markup=markup)
 
 
 @router.callback_query(F.data.split(" ")[0] == "market")
-async def market_callback(call: CallbackQuery, state: FSMContext):
+async def market_callback(call: CallbackQuery, state: FSMContext, user: UserModel):
     data = call.data.split(" ")
 
     if data[-1] != str(call.from_user.id):
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
-
     if data[1] == "add":
-        user_market_items_len = len(database.market_items.get_all(owner=user._id))
+        user_market_items_len = await get_user_market_items_count(user)
         if user_market_items_len >= user.max_items_count_in_market:
             await call.answer("Ты привесил лимит", show_alert=True)
             return
         from base.user_input.add_new_market_item import AddNewItemState
 
         user_items = sorted(
-            await database.items.async_get_all(owner=user._id),
+            await database.items.async_get_inventory(user._id),
             key=lambda i: i.quantity,
             reverse=True,
         )
@@ -561,69 +553,76 @@ async def market_callback(call: CallbackQuery, state: FSMContext):
         )
 
     elif data[1] == "buy":
-        try:
-            market_item = database.market_items.get(_id=ObjectId(data[2]))
-        except NoResult:
-            await call.answer(
-                "Этот предмет либо уже купили либо владелец убрал с продажи", show_alert=True
-            )
-            return
-
-        item_owner = await database.users.async_get(_id=market_item.owner)
+        # лот снимается с рынка одним запросом и только если его можно купить
+        market_item = await claim_market_item(
+            ObjectId(data[2]), owner={"$ne": user._id}, price={"$lte": user.coin}
+        )
+        if not market_item:
+            try:
+                market_item = await database.market_items.async_get(_id=ObjectId(data[2]))
+            except NoResult:
+                await call.answer(
+                    "Этот предмет либо уже купили либо владелец убрал с продажи", show_alert=True
+                )
+                return
 
-        if item_owner.id == user.id:
-            await call.answer("Сам у себя будешь покупать?", show_alert=True)
+            if market_item.owner == user._id:
+                await call.answer("Сам у себя будешь покупать?", show_alert=True)
+            else:
+                await call.answer("Тебе не хватает бабла", show_alert=True)
             return
 
-        if market_item.price > user.coin:
+        if not await database.users.async_inc(
+            user, {"coin": {"$gte": market_item.price}}, coin=-market_item.price
+        ):
+            # бабло успели потратить в другом апдейте, возвращаем лот на рынок
+            await database.market_items.async_add(**market_item.to_dict())
             await call.answer("Тебе не хватает бабла", show_alert=True)
             return
 
-        item = get_item(market_item.name)
-
-        item_owner.coin += market_item.price
-        user.coin -= market_item.price
-        if item.type == ItemType.COUNTABLE:
-            user_item = get_or_add_user_item(user, market_item.name)
-            user_item.quantity += market_item.quantity
+        if get_item(market_item.name).type == ItemType.COUNTABLE:
+            give_item = add_items(user, {market_item.name: market_item.quantity})
         else:
-            user_item = add_user_usage_item(
-                user,
-                market_item.name,
-                market_item.usage,  # type: ignore
+            user_item = ItemModel(
+                name=market_item.name,
+                quantity=market_item.quantity,
+                usage=market_item.usage,
+                owner=user._id,
             )
-            user_item.quantity = market_item.quantity
-
-        await database.items.async_update(**user_item.to_dict())
-        await database.users.async_update(**user.to_dict())
-        await database.users.async_update(**item_owner.to_dict())
-        database.market_items.delete(**market_item.to_dict())
-
-        increment_achievement_progress(user, "богач", market_item.price)
-        increment_achievement_progress(item_owner, "продавец")
+            give_item = database.items.async_add(**user_item.to_dict())
+
+        # остальное не зависит друг от друга и идет одним раундом запросов
+        item_owner, *_ = await asyncio.gather(
+            pay_seller(market_item),
+            give_item,
+            record_trade(market_item),
+            increment_achievements_progress(
+                [(user, "богач", market_item.price), (market_item.owner, "продавец", 1)]
+            ),
+        )
 
         usage = f" ({int(market_item.usage)}%)" if market_item.usage else ""
         emoji = get_item_emoji(market_item.name)
         mess = f"{get_user_tag(user)} купил {market_item.quantity} {emoji}{usage}"
         await safe(call.message.answer(mess))
 
-        await safe(
-            call.bot.send_message(
-                item_owner.id,
-                f"{get_user_tag(user)} купил у тебя {market_item.quantity} {emoji}{usage}",
+        if item_owner:
+            await safe(
+                call.bot.send_message(
+                    item_owner.id,
+                    f"{get_user_tag(user)} купил у тебя {market_item.quantity} {emoji}{usage}",
+                )
             )
-        )
 
         mess = "<b>Рынок</b>\n\n"
-        market_items = database.market_items.get_all()
-        markup = InlineMarkup.market_pager(user)
-        mess += f"1 / {len(list(batched(market_items, 6)))}"
+        markup = await InlineMarkup.market_pager(user)
+        mess += f"1 / {await get_market_pages_count()}"
         await call.message.edit_text(
             mess,
             reply_markup=markup,
         )
     elif data[1] == "view-my-items":
-        markup = InlineMarkup.market_view_my_items(user)
+        markup = await InlineMarkup.market_view_my_items(user)
 
         mess = "<b>Твои товары</b>"
         await call.message.edit_text(
@@ -631,16 +630,27 @@ async def market_callback(call: CallbackQuery, state: FSMContext):
             reply_markup=markup,
         )
     elif data[1] == "delete":
-        market_item = database.market_items.get(_id=ObjectId(data[2]))
-        user_item = get_or_add_user_item(user, market_item.name)
-        user_item.quantity += market_item.quantity
-        await database.items.async_update(**user_item.to_dict())
-        database.market_items.delete(**market_item.to_dict())
+        market_item = await claim_market_item(ObjectId(data[2]), owner=user._id)
+        if not market_item:
+            await call.answer("Этот предмет уже купили", show_alert=True)
+            return
+
+        if get_item(market_item.name).type == ItemType.COUNTABLE:
+            await add_items(user, {market_item.name: market_item.quantity})
+        else:
+            user_item = ItemModel(
+                name=market_item.name,
+                quantity=market_item.quantity,
+                usage=market_item.usage,
+                owner=user._id,
+            )
+            await database.items.async_add(**user_item.to_dict())
+        await remove_listing_price(market_item)
         await call.answer(
             "предмет удален успешно",
             show_alert=True,
         )
-        markup = InlineMarkup.market_view_my_items(user)
+        markup = await InlineMarkup.market_view_my_items(user)
 
         await call.message.edit_reply_markup(
             reply_markup=markup,
@@ -650,8 +660,7 @@ async def market_callback(call: CallbackQuery, state: FSMContext):
         try:
             action = call.data.split(" ")[1]
             pos = int(call.data.split(" ")[2])
-            market_items = database.market_items.get_all()
-            max_pos = len(list(batched(market_items, 6))) - 1
+            max_pos = await get_market_pages_count() - 1
 
             if action == "next":
                 pos += 1
@@ -666,7 +675,7 @@ async def market_callback(call: CallbackQuery, state: FSMContext):
                 raise IndexError
 
             mess = f"<b>Рынок</b>\n\n{pos + 1} / {max_pos + 1}"
-            markup = InlineMarkup.market_pager(user=user, index=pos)
+            markup = await InlineMarkup.market_pager(user=user, index=pos)
 
             await call.message.edit_text(mess, reply_markup=markup)
         except IndexError:
@@ -674,23 +683,22 @@ async def market_callback(call: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("market_item_open"))
-async def market_item_open_callback(call: CallbackQuery):
+async def market_item_open_callback(call: CallbackQuery, user: UserModel):
     data = call.data.split(" ")
 
     if data[-1] != str(call.from_user.id):
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
     item_id = ObjectId(data[1])
 
-    market_item = database.market_items.get(_id=item_id)
+    market_item = await database.market_items.async_get(_id=item_id)
 
     item_owner = await database.users.async_get(_id=market_item.owner)
     emoji = get_item_emoji(market_item.name)
     mess = (
         f"<b>{emoji} {market_item.name} | {market_item.quantity} шт.</b>\n"
         f"Продавец: {get_user_tag(item_owner)}\n"
-        f"Средней прайс: {get_middle_item_price(market_item.name)}/шт"
+        f"Средней прайс: {await get_middle_item_price(market_item.name)}/шт"
     )
 
     markup = InlineMarkup.market_item_open(user, market_item)
@@ -714,33 +722,29 @@ async def delate_state_callback(call: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("levelup"))
-async def levelup_callback(call: CallbackQuery):
+async def levelup_callback(call: CallbackQuery, user: UserModel):
     data = call.data.split(" ")
 
     if data[-1] != str(call.from_user.id):
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
-
     if data[1] == "luck":
         user.luck += 1
     elif data[1] == "market":
         user.max_items_count_in_market += 1
 
-    await database.users.async_update(**user.to_dict())
+    await database.users.async_update(user)
     await call.answer("Поздравляю 🎉🎉", show_alert=True)
     await call.message.edit_reply_markup(reply_markup=None)
 
 
 @router.callback_query(F.data.startswith("daily_gift"))
-async def daily_gift_callback(call: CallbackQuery):
+async def daily_gift_callback(call: CallbackQuery, user: UserModel):
     data = call.data.split(" ")
 
     if data[-1] != str(call.from_user.id):
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
-
     if data[1] == "claim":
         if not await check_user_subscription(user):
             await call.answer(
@@ -750,7 +754,7 @@ async def daily_gift_callback(call: CallbackQuery):
             return
         now = utcnow()
 
-        daily_gift = database.daily_gifts.get(owner=user._id)
+        daily_gift = await database.daily_gifts.async_get(owner=user._id)
         if daily_gift.is_claimed:
             time_difference = get_time_difference_string(daily_gift.next_claimable_at - now)
             await call.answer(
@@ -772,19 +776,19 @@ async def daily_gift_callback(call: CallbackQuery):
         daily_gift.last_claimed_at = now
         daily_gift.next_claimable_at = now + timedelta(days=1)
         daily_gift.is_claimed = True
-        database.daily_gifts.update(**daily_gift.to_dict())
+        await database.daily_gifts.async_update(daily_gift)
 
         mess = f"<b>{get_user_tag(user)} получил ежедневный подарок</b>\n\n"
+        gift_items: dict[str, int] = {}
         for item_name in daily_gift.items:
             item = get_item(item_name)
             quantity = get_item_count_for_rarity(item.rarity)
-            try:
-                user_item = get_or_add_user_item(user, item.name)
-                user_item.quantity += quantity
-                await database.items.async_update(**user_item.to_dict())
-            except ItemIsCoin:
-                user.coin += quantity
+            if item.name == "бабло":
+                user.inc(coin=quantity)
+            else:
+                gift_items[item.name] = gift_items.get(item.name, 0) + quantity
             mess += f"+{quantity} {item.name} {item.emoji}\n"
+        await add_items(user, gift_items)
 
         markup = InlineMarkup.daily_gift(user, daily_gift)
         await call.message.answer(mess)
@@ -792,45 +796,39 @@ async def daily_gift_callback(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("transfer"))
-async def transfer_callback(call: CallbackQuery):
+async def transfer_callback(call: CallbackQuery, user: UserModel):
     data = call.data.split(" ")
 
     if data[-1] != str(call.from_user.id):
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
     reply_user = await database.users.async_get(id=int(data[-2]))
 
     item = await database.items.async_get(_id=ObjectId(data[1]))
 
-    if item.quantity <= 0:
+    if item.owner != user._id or not await transfer_usable_item(item, reply_user):
         await call.answer("У тебя нет такого предмета")
         return
 
-    item.owner = reply_user._id
-
-    await database.items.async_update(**item.to_dict())
     mess = (
         f"{user.name} подарил {reply_user.name}\n"
         "----------------\n"
         f"{get_item_emoji(item.name)} {item.name} ({int(item.usage)}%)"  # type: ignore
     )
 
-    await database.users.async_update(**user.to_dict())
-    await database.users.async_update(**reply_user.to_dict())
+    await database.users.async_update(user)
+    await database.users.async_update(reply_user)
 
     await call.message.answer(mess)
 
 
 @router.callback_query(F.data.startswith("achievements"))
-async def achievements_callback(call: CallbackQuery):
+async def achievements_callback(call: CallbackQuery, user: UserModel):
     data = call.data.split(" ")
 
     if data[-1] != str(call.from_user.id):
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
-
     if data[1] == "view":
         ach = get_achievement(data[2])
         mess = f"<b>{ach.emoji} {ach.name}</b>\n\n"
@@ -849,21 +847,26 @@ async def achievements_callback(call: CallbackQuery):
 
     elif data[1] == "filter":
         filter = data[2]
-        markup = InlineMarkup.achievements_view(user, filter)  # type: ignore
+        markup = await InlineMarkup.achievements_view(user, filter)  # type: ignore
 
         await call.message.edit_reply_markup(reply_markup=markup)
 
 
 @router.callback_query(F.data.startswith("accept_rules"))
-async def accept_rules_callback(call: CallbackQuery):
+async def accept_rules_callback(call: CallbackQuery, user: UserModel):
     data = call.data.split(" ")
 
     if data[-1] != str(call.from_user.id):
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
     user.accepted_rules = True
-    await database.users.async_update(**user.to_dict())
+    await database.users.async_update(user)
+
+    # `/start` со ссылкой до принятия правил не дошел до хендлера
+    if (param := await pop_pending_referral(user)) and (
+        ref_user := await claim_referral(user, param, window=None)
+    ):
+        await reward_referrer(user, ref_user)
 
     await call.answer(
         "Теперь можешь спокойно пользовался ботом",
@@ -874,7 +877,7 @@ async def accept_rules_callback(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("event_shop"))
-async def event_shop_callback(call: CallbackQuery):
+async def event_shop_callback(call: CallbackQuery, user: UserModel):
     data = call.data.split(" ")
 
     if data[-1] != str(call.from_user.id):
@@ -883,32 +886,22 @@ async def event_shop_callback(call: CallbackQuery):
     if data[1] != "buy":
         return
 
-    user = await database.users.async_get(id=call.from_user.id)
-
-    candy = get_or_add_user_item(user, "конфета")
-
     item = get_item(data[2])
     quantity = int(data[3])
 
-    if candy.quantity < quantity:
+    if not await change_items(user, add={item.name: 1}, take={"конфета": quantity}):
         await call.answer("Недостаточно конфет", show_alert=True)
         return
 
-    user_item = get_or_add_user_item(user, item.name)
-    user_item.quantity += 1
-    candy.quantity -= quantity
-
-    await database.items.async_update(**user_item.to_dict())
-    await database.items.async_update(**candy.to_dict())
-
+    candy = (await get_inventory_quantities(user)).get("конфета", 0)
     mess = "<b>Ивентовый магазин</b>\n\n"
-    mess += f"У тебя {candy.quantity} {get_item_emoji(candy.name)}"
+    mess += f"У тебя {candy} {get_item_emoji('конфета')}"
 
     markup = InlineMarkup.event_shop(user)
 
     await call.message.edit_text(mess, reply_markup=markup)
 
     await call.answer(
-        f"Ты купил 1 {item.emoji} за {quantity} {get_item_emoji(candy.name)}",
+        f"Ты купил 1 {item.emoji} за {quantity} {get_item_emoji('конфета')}",
         show_alert=True,
     )
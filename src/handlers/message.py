@@ -19,20 +19,30 @@ from aiogram.utils.keyboard import ReplyKeyboardBuilder
 
 import base.user_input  # noqa  # pylint: disable=unused-import
 from base.items import ITEMS
+from base.market import get_market_pages_count, get_price_stats
 from base.player import (
+    add_items,
+    change_items,
     check_user_stats,
+    claim_referral,
     coin_top,
+    event_top,
     generate_daily_gift,
     generate_exchanger,
     generate_quest,
     get_available_crafts,
     get_available_items_for_use,
+    get_inventory_quantities,
     get_or_add_user_item,
+    reward_referrer,
+    take_items,
     transfer_countable_item,
 )
+from base.recipes import RECIPES
 from base.weather import get_weather
 from config import VERSION, config
 from database.funcs import database
+from database.models import UserModel
 from helpers.consts import COIN_EMOJI
 from helpers.datetime_utils import utcnow
 from helpers.enums import ItemType
@@ -46,12 +56,9 @@ from helpers.utils import (
     check_version,
     get_item,
     get_item_emoji,
-    get_middle_item_price,
     get_time_difference_string,
     get_user_tag,
-    increment_achievement_progress,
     quick_markup,
-    safe,
     send_channel_subscribe_message,
 )
 
@@ -83,46 +90,12 @@ START_MARKUP = start_markup_builder.as_markup()  # pylint: disable=assignment-fr
 
 
 @router.message(CommandStart())
-async def start(message: Message, command: CommandObject):
+async def start(message: Message, command: CommandObject, user: UserModel):
     async with Loading(message):
-        user_id = message.from_user.id
-
-        user = await database.users.async_get(id=message.from_user.id)
-
         mess = f"Здорова {user.name}, добро пожаловать в игру\n\nПомощь: /help"
 
-        if param := command.args:
-            users_id = [str(user.id) for user in await database.users.async_get_all()]
-
-            if param in users_id:
-                if str(user_id) == param:
-                    await message.reply(mess)
-                    return
-                if user is not None:
-                    await message.reply(mess)
-                    return
-                ref_user = user = await database.users.async_get(id=int(param))
-                if not ref_user:
-                    await message.reply(mess, reply_markup=START_MARKUP)
-                    return
-                user = await database.users.async_get(id=message.from_user.id)
-
-                coin = random.randint(5000, 15000)
-                ref_user.coin += coin
-                await database.users.async_update(**ref_user.to_dict())
-                increment_achievement_progress(ref_user, "друзья навеки")
-
-                await safe(
-                    message.bot.send_message(
-                        ref_user.id,
-                        (
-                            f"{user.name} присоединился к игре благодаря твой реферальной ссылке\n"
-                            f"Ты получил {coin} бабла {get_item_emoji('бабло')}"
-                        ),
-                    )
-                )
-
-                return
+        if (param := command.args) and (ref_user := await claim_referral(user, param)):
+            await reward_referrer(user, ref_user)
 
         if message.chat.type != "private":
             markup = None
@@ -145,12 +118,10 @@ async def help(message: Message):
 
 
 @router.message(Command("profile"))
-async def profile_cmd(message: Message):
+async def profile_cmd(message: Message, user: UserModel):
     async with Loading(message):
         if message.reply_to_message:
-            user = user = await database.users.async_get(id=message.reply_to_message.id)
-        else:
-            user = await database.users.async_get(id=message.from_user.id)
+            user = await database.users.async_get(id=message.reply_to_message.id)
 
         await check_user_stats(user, message.chat.id)
 
@@ -169,12 +140,10 @@ async def profile_cmd(message: Message):
 
 
 @router.message(Command("bag"))
-async def bag_cmd(message: Message):
+async def bag_cmd(message: Message, user: UserModel):
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
-
         mess = "<b>Рюкзак</b>\n\n"
-        inventory = await database.items.async_get_all(owner=user._id)
+        inventory = await database.items.async_get_inventory(user._id)
         if not inventory:
             mess += "<i>Пусто...</i>"
         else:
@@ -194,17 +163,16 @@ async def bag_cmd(message: Message):
 
 
 @router.message(Command("items"))
-async def items_cmd(message: Message):
+async def items_cmd(message: Message, user: UserModel):
     async with Loading(message):
         mess = f"<b>Предметы</b>\n\n1 / {len(list(batched(ITEMS, 6)))}"
-        user = await database.users.async_get(id=message.from_user.id)
         markup = markup = InlineMarkup.items_pager(user=user)
 
         await message.reply(mess, reply_markup=markup)
 
 
 @router.message(Command("shop"))
-async def shop_cmd(message: Message):
+async def shop_cmd(message: Message, user: UserModel):
     async with Loading(message):
         args = message.text.split(" ")
 
@@ -226,8 +194,6 @@ async def shop_cmd(message: Message):
             await message.reply(err_mess)
             return
 
-        user = await database.users.async_get(id=message.from_user.id)
-
         item_name = args[1]
         try:
             count = int(args[2])
@@ -249,12 +215,9 @@ async def shop_cmd(message: Message):
             await message.reply("У тебя нет столько бабла, иди работать")
             return
 
-        user.coin -= price
-        user_item = get_or_add_user_item(user, get_item(item.name).name)
-
-        user_item.quantity += count
-        await database.users.async_update(**user.to_dict())
-        await database.items.async_update(**user_item.to_dict())
+        user.inc(coin=-price)
+        await add_items(user, {item.name: count})
+        await database.users.async_update(user)
 
         emoji = get_item_emoji(item.name)
         await message.reply(
@@ -263,7 +226,7 @@ async def shop_cmd(message: Message):
 
 
 @router.message(Command("casino"))
-async def casino(message: Message, command: CommandObject):
+async def casino(message: Message, command: CommandObject, user: UserModel):
     async with Loading(message):
         count = command.args
 
@@ -282,16 +245,6 @@ async def casino(message: Message, command: CommandObject):
         except ValueError:
             count = 1
 
-        user = await database.users.async_get(id=message.from_user.id)
-
-        ticket = get_or_add_user_item(user, "билет")
-
-        if (not ticket) or (ticket.quantity <= 0):
-            await message.reply(
-                f"Чтобы сыграть в казино у тебя должен быть билет {get_item_emoji('билет')}",
-            )
-            return
-
         chance = random.randint(0, 10)
 
         if count > user.coin:
@@ -307,29 +260,31 @@ async def casino(message: Message, command: CommandObject):
             await message.reply("Кудаа, у тебя нет бабла, иди работать")
             return
 
+        if not await take_items(user, {"билет": 1}):
+            await message.reply(
+                f"Чтобы сыграть в казино у тебя должен быть билет {get_item_emoji('билет')}",
+            )
+            return
+
         await message.answer_dice("🎲")
-        ticket.quantity -= 1
         if chance <= 5:
             await message.answer(f"Блин, сорян\n——————\n-{count}")
-            user.coin -= count
+            user.inc(coin=-count)
             user.casino_loose += count
 
         else:
             await message.answer(f"Нифига се\n——————\n+{count * 2}")
-            user.coin += count * 2
+            user.inc(coin=count * 2)
             user.casino_win += count * 2
 
-        await database.users.async_update(**user.to_dict())
-        await database.items.async_update(**ticket.to_dict())
+        await database.users.async_update(user)
         await check_user_stats(user, message.chat.id)
 
 
 @router.message(Command("workbench"))
 @router.message(Command("craft"))
-async def workbench_cmd(message: Message):
+async def workbench_cmd(message: Message, user: UserModel):
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
-
         mess = (
             "<b>🧰Верстак🧰</b>\n\n"
             "Чтобы скрафтить что-то то напиши <code>/craft [имя предмета] [кол-во]</code>\n\n"
@@ -338,29 +293,49 @@ async def workbench_cmd(message: Message):
         args = message.text.split(" ")
 
         if not args or len(args) < 2:
-            available_crafts = get_available_crafts(user)
+            available_crafts = await get_available_crafts(user)
             if available_crafts:
                 mess += "<b>Доступные крафты</b>\n"
                 for craft_data in available_crafts:
                     item_name = craft_data["item_name"]
-                    resources = craft_data["resources"]
-
-                    possible_crafts = min(
-                        user_item["user_item_quantity"] // user_item["item_count"]
-                        for user_item in resources
-                    )
-
-                    craft_str = f"{get_item_emoji(item_name)} {item_name} - {possible_crafts}\n"
-                    mess += f"{craft_str}"
+                    mess += f"{get_item_emoji(item_name)} {item_name} - {craft_data['count']}\n"
+                mess += "\nСкрафтить все сразу: <code>/craft все</code>"
             await message.reply(mess)
             return
 
         name = args[1].lower()
+        quantities = await get_inventory_quantities(user)
+
+        if name in ("все", "всё"):
+            plan = RECIPES.plan_all(quantities)
+            if not plan.crafts:
+                await message.reply("Нечего крафтить")
+                return
+            if not await change_items(user, add=plan.crafts, take=plan.take):
+                await message.reply("Недостаточно предметов")
+                return
+
+            xp = sum(random.uniform(5.0, 10.0) for _ in range(plan.total))
+            user.inc(xp=xp)
+            await database.users.async_update(user)
+
+            crafted = "\n".join(
+                f"{get_item_emoji(item_name)} {item_name} - {item_count}"
+                for item_name, item_count in plan.crafts.items()
+            )
+            await message.reply(f"Скрафтил:\n{crafted}\n+ {int(xp)} хп")
+            await check_user_stats(user, message.chat.id)
+            return
+
         try:
             count = int(args[2])
         except (ValueError, IndexError):
             count = 1
 
+        if count <= 0:
+            await message.reply("Кол-во должно быть больше нуля")
+            return
+
         if not get_item(name):
             await message.reply("Такого предмета не существует")
             return
@@ -371,45 +346,33 @@ async def workbench_cmd(message: Message):
             await message.reply(f"У {item_data.emoji} нет крафта")
             return
 
-        craft = item_data.craft
-
-        for craft_item in craft.items():
-            user_item = get_or_add_user_item(user, craft_item[0])
-            if (
-                (not user_item)
-                or (user_item.quantity <= 0)
-                or (user_item.quantity < craft_item[1] * count)
-            ):
-                await message.reply("Недостаточно предметов")
-                return
-
-            user_item.quantity -= craft_item[1] * count
-            await database.items.async_update(**user_item.to_dict())
-
-        item = get_or_add_user_item(user, name)
+        # недостающие промежуточные предметы крафтятся по пути и сразу тратятся
+        plan = RECIPES.plan(item_data.name, count, quantities)
+        if plan is None or not await change_items(
+            user, add={item_data.name: count}, take=plan.take
+        ):
+            await message.reply("Недостаточно предметов")
+            return
 
-        item.quantity += count
-        xp = random.uniform(5.0, 10.0) * count
+        xp = random.uniform(5.0, 10.0) * plan.total
         if random.randint(1, 100) < user.luck:
             xp += random.uniform(2.3, 6.7)
 
-        user.xp += xp
+        user.inc(xp=xp)
 
-        await database.items.async_update(**item.to_dict())
-        await database.users.async_update(**user.to_dict())
+        await database.users.async_update(user)
         await message.reply(f"Скрафтил {count} {name} {get_item_emoji(name)}\n+ {int(xp)} хп")
 
         await check_user_stats(user, message.chat.id)
 
 
 @router.message(Command("transfer"))
-async def transfer_cmd(message: Message):
+async def transfer_cmd(message: Message, user: UserModel):
     async with Loading(message):
         if not message.reply_to_message:
             await message.reply("Кому кидать собрался??")
             return
 
-        user = await database.users.async_get(id=message.from_user.id)
         reply_user = await database.users.async_get(id=message.reply_to_message.id)
 
         args = message.text.split(" ")
@@ -441,22 +404,21 @@ async def transfer_cmd(message: Message):
             if user.coin <= quantity:
                 await message.reply("У тебя Недостаточно бабла, иди работать")
                 return
-            user.coin -= quantity
-            reply_user.coin += quantity
+            user.inc(coin=-quantity)
+            reply_user.inc(coin=quantity)
         else:
             if item.type == ItemType.USABLE:
                 mess = "Выбери какой"
-                markup = InlineMarkup.transfer_usable_items(user, reply_user, item_name)
+                markup = await InlineMarkup.transfer_usable_items(user, reply_user, item_name)
 
                 await message.reply(mess, reply_markup=markup)
                 return
 
-            user_item = get_or_add_user_item(user, item_name)
-
-            if (user_item.quantity < quantity) or (user_item.quantity <= 0):
+            try:
+                await transfer_countable_item(user, item.name, quantity, reply_user)
+            except ValueError:
                 await message.reply(f"У тебя нет <i>{item_name}</i>")
                 return
-            transfer_countable_item(user_item, quantity, reply_user)
 
         mess = (
             f"{user.name} подарил {reply_user.name}\n"
@@ -464,16 +426,15 @@ async def transfer_cmd(message: Message):
             f"{item.emoji} {item_name} {quantity}"
         )
 
-        await database.users.async_update(**user.to_dict())
-        await database.users.async_update(**reply_user.to_dict())
+        await database.users.async_update(user)
+        await database.users.async_update(reply_user)
 
         await message.answer(mess)
 
 
 @router.message(Command("event"))
-async def event_cmd(message: Message):
+async def event_cmd(message: Message, user: UserModel):
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
         markup = quick_markup(
             {"Гайд": {"url": "https://hamletsargsyan.github.io/livebot/guide/#ивент"}}
         )
@@ -500,16 +461,9 @@ async def event_cmd(message: Message):
             "<b>Топ 10 по 🍬</b>\n\n"
         )
 
-        items = await database.items.async_get_all(name="конфета")
-        sorted_items = sorted(items, key=lambda item: item.quantity, reverse=True)
-        for index, item in enumerate(sorted_items, start=1):
-            if item.quantity > 0:
-                owner = await database.users.async_get(**{"_id": item.owner})
-                mess += f"{index}. {owner.name} - {item.quantity}\n"
-            if index == 10:
-                break
+        mess += await event_top()
 
-        item = get_or_add_user_item(user, "конфета")
+        item = await get_or_add_user_item(user, "конфета")
         mess += f"\n\nТы собрал: {item.quantity}"
         await message.reply(mess, reply_markup=markup)
 
@@ -517,7 +471,7 @@ async def event_cmd(message: Message):
 @router.message(Command("top"))
 async def top_cmd(message: Message):
     async with Loading(message):
-        mess = coin_top()
+        mess = await coin_top()
 
         markup = quick_markup(
             {
@@ -531,15 +485,13 @@ async def top_cmd(message: Message):
 
 
 @router.message(Command("use"))
-async def use_cmd(message: Message):
+async def use_cmd(message: Message, user: UserModel):
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
-
         args = message.text.split(" ")
 
         if len(args) < 2:
-            items = get_available_items_for_use(user)
-            markup = InlineMarkup.use(user, items)
+            items = await get_available_items_for_use(user)
+            markup = await InlineMarkup.use(user, items)
 
             if items:
                 mess = "<b>Доступные предметы для юза</b>\n\n"
@@ -550,10 +502,8 @@ async def use_cmd(message: Message):
 
 
 @router.message(Command("ref"))
-async def ref_cmd(message: Message):
+async def ref_cmd(message: Message, user: UserModel):
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
-
         mess = (
             "Хочешь заработать?\n"
             "Ты по адресу, пригласи друзей и получи от 5к до 15к бабла\n"
@@ -563,10 +513,8 @@ async def ref_cmd(message: Message):
 
 
 @router.message(Command("promo"))
-async def promo(message: Message) -> None:
+async def promo(message: Message, user: UserModel) -> None:
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
-
         await message.delete()
         if not await check_user_subscription(user):
             await send_channel_subscribe_message(message)
@@ -595,19 +543,19 @@ async def promo(message: Message) -> None:
                     code.is_used = True
 
                 mess = f"Ухтыы, {user.name} активировал промо и получил\n\n"
+                promo_items: dict[str, int] = {}
                 for item in code.items:
                     if item == "бабло":
-                        user.coin += code.items[item]
-                        await database.users.async_update(**user.to_dict())
+                        user.inc(coin=code.items[item])
                     else:
-                        user_item = get_or_add_user_item(user, item)
-                        user_item.quantity += code.items[item]
-                        await database.items.async_update(**user_item.to_dict())
+                        promo_items[item] = code.items[item]
                     mess += f"+ {code.items[item]} {item} {get_item_emoji(item)}\n"
+                await add_items(user, promo_items)
+                await database.users.async_update(user)
                 promo_users.append(user.id)
                 code.users = promo_users
 
-                await database.promos.async_update(**code.to_dict())
+                await database.promos.async_update(code)
                 await message.answer_sticker(
                     "CAACAgIAAxkBAAEpjI9l0i13xK0052Ruta0D5a5lWozGBgACHQMAAladvQrFMjBk7XkPEzQE",
                 )
@@ -617,10 +565,8 @@ async def promo(message: Message) -> None:
 
 
 @router.message(Command("stats"))
-async def stats_cmd(message: Message):
+async def stats_cmd(message: Message, user: UserModel):
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
-
         mess = (
             "<b>Статистика</b>\n\n\n"
             f"<b>[ Казино ]</b>\n"
@@ -637,15 +583,14 @@ async def stats_cmd(message: Message):
 
 
 @router.message(Command("quest"))
-async def quest_cmd(message: Message):
+async def quest_cmd(message: Message, user: UserModel):
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
         try:
             quest = await database.quests.async_get(owner=user._id)
         except NoResult:
-            quest = generate_quest(user)
+            quest = await generate_quest(user)
 
-        item = get_or_add_user_item(user, quest.name)
+        item = await get_or_add_user_item(user, quest.name)
 
         finish_button_text = (
             f"{item.quantity} / {quest.quantity}" if item.quantity < quest.quantity else "Завершить"
@@ -670,7 +615,7 @@ async def quest_cmd(message: Message):
 @router.message(Command("weather"))
 async def weather_cmd(message: Message):
     async with Loading(message):
-        weather = get_weather()
+        weather = await get_weather()
 
         mess = (
             f"<b>{weather.current.emoji} Прогноз погоды</b>\n\n"
@@ -682,7 +627,7 @@ async def weather_cmd(message: Message):
 
 
 @router.message(Command("exchanger"))
-async def exchanger_cmd(message: Message):
+async def exchanger_cmd(message: Message, user: UserModel):
     # if True:
     #     await message.reply(
     #         (
@@ -692,7 +637,6 @@ async def exchanger_cmd(message: Message):
     #     )
     #     return
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
         markup = quick_markup(
             {"Гайд": {"url": "https://hamletsargsyan.github.io/livebot/guide/#обменник"}}
         )
@@ -704,11 +648,11 @@ async def exchanger_cmd(message: Message):
         try:
             exchanger = await database.exchangers.async_get(owner=user._id)
         except NoResult:
-            exchanger = generate_exchanger(user)
+            exchanger = await generate_exchanger(user)
 
         if exchanger.expires < utcnow():
-            exchanger = generate_exchanger(user)
-            await database.exchangers.async_update(**exchanger.to_dict())
+            exchanger = await generate_exchanger(user)
+            await database.exchangers.async_update(exchanger)
 
         time_difference = get_time_difference_string(exchanger.expires - utcnow())
         mess = (
@@ -729,25 +673,16 @@ async def exchanger_cmd(message: Message):
         except (ValueError, IndexError):
             quantity = 1
 
-        user_item = get_or_add_user_item(user, exchanger.item)
-
-        if not user_item:
-            await message.reply(
-                f"У тебя нет {get_item_emoji(exchanger.item)}",
-                reply_markup=markup,
-            )
-            return
+        if quantity <= 0:
+            quantity = 1
 
-        if user_item.quantity < quantity:
+        if not await take_items(user, {exchanger.item: quantity}):
             await message.reply("Тебе не хватает", reply_markup=markup)
             return
 
         coin = quantity * exchanger.price
-        user.coin += coin
-        user_item.quantity -= quantity
-
-        await database.users.async_update(**user.to_dict())
-        await database.items.async_update(**user_item.to_dict())
+        user.inc(coin=coin)
+        await database.users.async_update(user)
 
         emoji = get_item_emoji(exchanger.item)
         await message.reply(
@@ -757,10 +692,8 @@ async def exchanger_cmd(message: Message):
 
 
 @router.message(Command("dog"))
-async def dog_cmd(message: Message):
+async def dog_cmd(message: Message, user: UserModel):
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
-
         try:
             dog = await database.dogs.async_get(owner=user._id)
         except NoResult:
@@ -800,10 +733,8 @@ async def dog_cmd(message: Message):
 
 
 @router.message(Command("rename_dog"))
-async def rename_dog_command(message: Message):
+async def rename_dog_command(message: Message, user: UserModel):
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
-
         try:
             dog = await database.dogs.async_get(owner=user._id)
         except NoResult:
@@ -820,7 +751,7 @@ async def rename_dog_command(message: Message):
             return
 
         dog.name = name
-        await database.dogs.async_update(**dog.to_dict())
+        await database.dogs.async_update(dog)
 
         await message.reply("Переименовал собачку")
 
@@ -839,11 +770,22 @@ async def price_cmd(message: Message):
         except ItemNotFoundError:
             await message.reply("такого предмета не существует")
             return
-        price = get_middle_item_price(item.name)
-        if not item:
-            mess = "Такого предмета не существует"
-        elif price:
-            mess = f"Прайс {item.name} {item.emoji} ⸻ {price} {get_item_emoji('бабло')}"
+        stats = await get_price_stats(item.name)
+        if stats.median:
+            mess = (
+                f"Прайс {item.name} {item.emoji} ⸻ {int(stats.median)} {COIN_EMOJI}\n\n"
+                f"Мин: {int(stats.min)} | 25%: {int(stats.p25)} | 75%: {int(stats.p75)}\n"  # type: ignore
+                f"Лотов на рынке: {stats.count}"
+            )
+            if stats.last_trade:
+                mess += f"\nПоследняя сделка: {int(stats.last_trade)} {COIN_EMOJI}/шт"
+            if stats.shop:
+                mess += f"\nВ магазине: {int(stats.shop)} {COIN_EMOJI}"
+        elif stats.shop:
+            mess = (
+                f"Прайс {item.name} {item.emoji} ⸻ {int(stats.shop)} {COIN_EMOJI}\n\n"
+                "Лотов на рынке нет, это цена магазина"
+            )
         else:
             mess = f"У {item.emoji} пока нет прайса"
 
@@ -851,9 +793,8 @@ async def price_cmd(message: Message):
 
 
 @router.message(Command("home"))
-async def home_cmd(message: Message):
+async def home_cmd(message: Message, user: UserModel):
     async with Loading(message):
-        user = await database.users.async_get(id=message.from_user.id)
         mess = "🏠 Дом милый дом"
 
         markup = InlineMarkup.home_main(user)
@@ -870,35 +811,30 @@ async def guide_cmd(message: Message):
 
 
 @router.message(Command("market"))
-async def market_cmd(message: Message):
-    user = await database.users.async_get(id=message.from_user.id)
-
+async def market_cmd(message: Message, user: UserModel):
     mess = "<b>Рынок</b>\n\n"
 
-    market_items = database.market_items.get_all()
-    markup = InlineMarkup.market_pager(user)
-    mess += f"1 / {len(list(batched(market_items, 6)))}"
+    markup = await InlineMarkup.market_pager(user)
+    mess += f"1 / {await get_market_pages_count()}"
 
     await message.reply(mess, reply_markup=markup)
 
 
 @router.message(Command("daily_gift"))
-async def daily_gift_cmd(message: Message):
-    user = await database.users.async_get(id=message.from_user.id)
-
+async def daily_gift_cmd(message: Message, user: UserModel):
     if not await check_user_subscription(user):
         await send_channel_subscribe_message(message)
         return
 
     try:
-        daily_gift = database.daily_gifts.get(owner=user._id)
+        daily_gift = await database.daily_gifts.async_get(owner=user._id)
     except NoResult:
-        daily_gift = generate_daily_gift(user)
+        daily_gift = await generate_daily_gift(user)
 
     mess = "<b>Ежедневный подарок</b>"
 
     if daily_gift.next_claimable_at <= utcnow():
-        daily_gift = generate_daily_gift(user)
+        daily_gift = await generate_daily_gift(user)
 
     markup = InlineMarkup.daily_gift(user, daily_gift)
     await message.reply(mess, reply_markup=markup)
@@ -906,7 +842,7 @@ async def daily_gift_cmd(message: Message):
 
 @router.message(Command("version"))
 async def version_cmd(message: Message):
-    mess = f"<b>Версия бота</b>: <code>{VERSION}</code> | <i>{check_version()}</i>\n"
+    mess = f"<b>Версия бота</b>: <code>{VERSION}</code> | <i>{await check_version()}</i>\n"
     markup = quick_markup(
         {"Релиз": {"url": f"https://github.com/HamletSargsyan/livebot/releases/tag/v{VERSION}"}}
     )
@@ -921,9 +857,7 @@ async def time_cmd(message: Message):
 
 
 @router.message(Command("achievements"))
-async def achievements_cmd(message: Message):
-    user = await database.users.async_get(id=message.from_user.id)
-
+async def achievements_cmd(message: Message, user: UserModel):
     markup = InlineMarkup.achievements(user)
 
     mess = "Достижения"
@@ -940,9 +874,7 @@ async def rules_cmd(message: Message):
 
 
 @router.message(Command("violations"))
-async def violations_cmd(message: Message):
-    user = await database.users.async_get(id=message.from_user.id)
-
+async def violations_cmd(message: Message, user: UserModel):
     if len(user.violations) == 0:
         await message.reply("У тебя нет нарушений")
         return
@@ -962,9 +894,8 @@ async def violations_cmd(message: Message):
 
 
 @router.message(Command("event_shop"))
-async def event_shop_cmd(message: Message):
-    user = await database.users.async_get(id=message.from_user.id)
-    user_event_item = get_or_add_user_item(user, "конфета")
+async def event_shop_cmd(message: Message, user: UserModel):
+    user_event_item = await get_or_add_user_item(user, "конфета")
 
     item = get_item(user_event_item.name)
 
@@ -1012,48 +943,47 @@ async def left_chat_member(event: ChatMemberUpdated):
 
 
 @router.message()
-async def text_message_handler(message: Message):
-    user = await database.users.async_get(id=message.from_user.id)
+async def text_message_handler(message: Message, user: UserModel):
     text = message.text.lower().strip()
 
     match text:
         case "профиль":
-            await profile_cmd(message)
+            await profile_cmd(message, user)
         case "инвентарь" | "портфель" | "инв":
-            await bag_cmd(message)
+            await bag_cmd(message, user)
         case _ if text.startswith(("магазин", "шоп")):
-            await shop_cmd(message)
+            await shop_cmd(message, user)
         case _ if text.startswith(("крафт", "верстак")):
-            await workbench_cmd(message)
+            await workbench_cmd(message, user)
         case "топ" | "рейтинг":
             await top_cmd(message)
         case "ивент":
-            await event_cmd(message)
+            await event_cmd(message, user)
         case _ if text.startswith("юз"):
-            await use_cmd(message)
+            await use_cmd(message, user)
         case "предметы":
-            await items_cmd(message)
+            await items_cmd(message, user)
         case "бабло":
             await message.reply(f"{COIN_EMOJI} Бабло: {user.coin}")
         case "статы":
-            await stats_cmd(message)
+            await stats_cmd(message, user)
         case "квест":
-            await quest_cmd(message)
+            await quest_cmd(message, user)
         case "погода":
             await weather_cmd(message)
         case "обменник":
-            await exchanger_cmd(message)
+            await exchanger_cmd(message, user)
         case _ if text.startswith("передать"):
-            await transfer_cmd(message)
+            await transfer_cmd(message, user)
         case "собака":
-            await dog_cmd(message)
+            await dog_cmd(message, user)
         case _ if text.startswith("прайс"):
             await price_cmd(message)
         case "гайд":
             await guide_cmd(message)
         case "дом":
-            await home_cmd(message)
+            await home_cmd(message, user)
         case "рынок":
-            await market_cmd(message)
+            await market_cmd(message, user)
         case "достижения" | "ачивки":
-            await achievements_cmd(message)
+            await achievements_cmd(message, user)
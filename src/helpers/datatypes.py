@@ -205,6 +205,7 @@ class Item:
         self.strength_reduction = strength_reduction
         self.can_equip = can_equip
         self.type = type
+        self._translit: Optional[str] = None
 
     def __repr__(self) -> str:
         return f"(Item {self.name})"
@@ -213,7 +214,9 @@ class Item:
         return self.__repr__()
 
     def translit(self) -> str:
-        return transliterate.translit(self.name, reversed=True)
+        if self._translit is None:
+            self._translit = transliterate.translit(self.name, reversed=True)
+        return self._translit
 
 
 # ------------------------------- achievement ------------------------------- #
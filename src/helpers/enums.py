@@ -1,4 +1,4 @@
-from enum import Enum, auto
+from enum import Enum, IntEnum, StrEnum, auto
 
 
 class Locations(Enum):
@@ -26,3 +26,15 @@ class WeatherType(Enum):
     CLEAR = "Ясно"
     FOG = "Туман"
     CLOUDS = "Облачно"
+
+
+class SendPriority(IntEnum):
+    INTERACTIVE = 0
+    NOTIFICATION = 1
+    BROADCAST = 2
+
+
+class LoadingMode(StrEnum):
+    MESSAGE = "message"
+    CHAT_ACTION = "chat_action"
+    OFF = "off"
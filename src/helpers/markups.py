@@ -6,6 +6,7 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from base.achievements import ACHIEVEMENTS
 from base.items import ITEMS
+from base.market import get_market_page
 from base.player import get_available_items_for_use
 from database.funcs import database
 from database.models import DailyGiftModel, ItemModel, MarketItemModel, UserModel
@@ -14,11 +15,11 @@ from helpers.datetime_utils import utcnow
 from helpers.utils import (
     achievement_status,
     batched,
+    get_completed_achievements,
     get_item,
     get_item_emoji,
     get_pager_controllers,
     get_time_difference_string,
-    is_completed_achievement,
     quick_markup,
 )
 
@@ -82,24 +83,16 @@ class InlineMarkup:
         return builder.as_markup()
 
     @classmethod
-    def market_pager(cls, user: UserModel, index: int = 0) -> InlineKeyboardMarkup:
-        market_items = sorted(
-            database.market_items.get_all(), key=lambda i: i.published_at, reverse=True
-        )
-        items = list(batched(market_items, 6))
+    async def market_pager(cls, user: UserModel, index: int = 0) -> InlineKeyboardMarkup:
         buttons = []
-
-        try:
-            for item in items[index]:
-                emoji = get_item_emoji(item.name)
-                buttons.append(
-                    InlineKeyboardButton(
-                        text=f"{item.quantity} {emoji} — {item.price} {get_item_emoji('бабло')}",
-                        callback_data=f"market_item_open {item._id} {user.id}",
-                    )
+        for item in await get_market_page(index):
+            emoji = get_item_emoji(item.name)
+            buttons.append(
+                InlineKeyboardButton(
+                    text=f"{item.quantity} {emoji} — {item.price} {get_item_emoji('бабло')}",
+                    callback_data=f"market_item_open {item._id} {user.id}",
                 )
-        except IndexError:
-            pass
+            )
 
         # buttons.reverse()
         builder = InlineKeyboardBuilder()
@@ -138,8 +131,8 @@ class InlineMarkup:
         )
 
     @classmethod
-    def market_view_my_items(cls, user: UserModel) -> InlineKeyboardMarkup:
-        market_items = database.market_items.get_all(owner=user._id)
+    async def market_view_my_items(cls, user: UserModel) -> InlineKeyboardMarkup:
+        market_items = await database.market_items.async_get_all(owner=user._id)
         buttons = []
         try:
             for item in market_items:
@@ -176,10 +169,10 @@ class InlineMarkup:
         return builder.as_markup()
 
     @classmethod
-    def bag(cls, user: UserModel) -> InlineKeyboardMarkup:
+    async def bag(cls, user: UserModel) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
 
-        items = database.items.get_all(owner=user._id)
+        items = await database.items.async_get_inventory(user._id)
         buttons = []
         for item in items:
             if item.quantity <= 0:
@@ -205,7 +198,7 @@ class InlineMarkup:
         return quick_markup({f"{get_text()}": {"callback_data": f"daily_gift claim {user.id}"}})
 
     @classmethod
-    def transfer_usable_items(
+    async def transfer_usable_items(
         cls, user: UserModel, to_user: UserModel, item_name: str
     ) -> InlineKeyboardMarkup:
         from base.player import get_or_add_user_usable_items
@@ -213,7 +206,7 @@ class InlineMarkup:
         builder = InlineKeyboardBuilder()
         buttons = []
 
-        items = get_or_add_user_usable_items(user, item_name)
+        items = await get_or_add_user_usable_items(user, item_name)
         items = list(filter(lambda i: i.usage > 0 and i.quantity > 0, items))  # type: ignore
         items.sort(key=lambda i: i.usage)  # type: ignore
 
@@ -230,7 +223,7 @@ class InlineMarkup:
         return builder.as_markup()
 
     @classmethod
-    def achievements_view(
+    async def achievements_view(
         cls,
         user: UserModel,
         status: Literal["all", "in_progress", "completed", "not_started"] = "all",
@@ -239,19 +232,20 @@ class InlineMarkup:
         buttons = []
 
         achievements = deepcopy(ACHIEVEMENTS)
+        completed = await get_completed_achievements(user)
         if status == "in_progress":
-            achievements = [a for a in achievements if achievement_status(user, a) == 0]
+            achievements = [a for a in achievements if achievement_status(user, a, completed) == 0]
         elif status == "not_started":
-            achievements = [a for a in achievements if achievement_status(user, a) == 1]
+            achievements = [a for a in achievements if achievement_status(user, a, completed) == 1]
         elif status == "completed":
-            achievements = [a for a in achievements if achievement_status(user, a) == 2]
+            achievements = [a for a in achievements if achievement_status(user, a, completed) == 2]
 
         else:
-            achievements.sort(key=lambda a: achievement_status(user, a))
+            achievements.sort(key=lambda a: achievement_status(user, a, completed))
 
         for achievement in achievements:
             progress = user.achievement_progress.get(achievement.key, 0)
-            is_completed = is_completed_achievement(user, achievement.name)
+            is_completed = achievement.name in completed
             emoji = ""
 
             if status == "all":
@@ -315,12 +309,14 @@ class InlineMarkup:
         return builder.as_markup()
 
     @classmethod
-    def use(cls, user: UserModel, items: Optional[list[ItemModel]] = None) -> InlineKeyboardMarkup:
+    async def use(
+        cls, user: UserModel, items: Optional[list[ItemModel]] = None
+    ) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         buttons = []
 
         if not items:
-            items = get_available_items_for_use(user)
+            items = await get_available_items_for_use(user)
 
         for user_item in items:
             item = get_item(user_item.name)
@@ -0,0 +1,55 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: `rate` токенов в секунду, не больше `capacity` подряд.
+
+    `pause` ставит всех ожидающих на паузу (например на `retry_after` от телеграма),
+    `penalize` вдобавок снижает частоту, `recover` понемногу возвращает ее к исходной.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, min_rate: float = 1):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.capacity = capacity or rate
+
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Не выдает токены `seconds` секунд и сжигает накопленные."""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._refill(now)
+        self._tokens = 0
+
+    def penalize(self, retry_after: float):
+        self.pause(retry_after)
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    def recover(self, step: float = 1):
+        self.rate = min(self.max_rate, self.rate + step)
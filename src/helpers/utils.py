@@ -1,19 +1,22 @@
 import asyncio
+import copy
 import itertools
 import json
 import random
-import statistics
 import sys
 from contextlib import suppress
 from dataclasses import astuple, is_dataclass
 from datetime import datetime, timedelta
 from functools import wraps
+from pathlib import Path
 from typing import (
     Any,
     Awaitable,
     Callable,
+    Final,
     Generator,
     Iterable,
+    NamedTuple,
     NoReturn,
     Optional,
     ParamSpec,
@@ -23,19 +26,23 @@ from typing import (
 )
 
 import httpx
-from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.exceptions import TelegramAPIError
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from bson import ObjectId
+from cachetools import Cache, LRUCache, TTLCache
+from pydantic import BaseModel
+from pymongo import UpdateOne
 from semver import Version
 
 from base.achievements import ACHIEVEMENTS
-from base.items import ITEMS
+from base.items import ITEMS_REGISTRY
 from config import VERSION, bot, config, logger
-from database.funcs import cache
+from database.cache import version_cache
 from database.models import AchievementModel, UserModel
 from helpers.consts import PAGER_CONTROLLERS
 from helpers.datatypes import Achievement, Item
-from helpers.enums import ItemRarity
+from helpers.enums import ItemRarity, LoadingMode
 from helpers.exceptions import AchievementNotFoundError, ItemNotFoundError, NoResult
 
 T = TypeVar("T")
@@ -75,28 +82,94 @@ def deprecated(
 
 def make_hashable(value: Any):
     if isinstance(value, dict):
-        return tuple((k, make_hashable(v)) for k, v in sorted(value.items()))
-    if isinstance(value, (list, set, tuple)):
+        # порядок ключей не сортируется: от него зависит результат, например порядок кнопок
+        return (dict, tuple((k, make_hashable(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return frozenset(make_hashable(v) for v in value)
+    if isinstance(value, (list, tuple)):
         return tuple(make_hashable(v) for v in value)
     if is_dataclass(value):
         return make_hashable(astuple(value))  # type: ignore
     return value
 
 
-def cached(func: Callable[P, T]):
-    @wraps(func)
-    def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
-        key = frozenset((make_hashable(args), make_hashable(kwargs)))
-        if key in cache:
-            result: T = cache[key]
-        else:
-            result = func(*args, **kwargs)
-        return result
+def _copy_result(value: T) -> T:
+    if isinstance(value, BaseModel):
+        # у pydantic-моделей (разметка aiogram) это быстрее общего `deepcopy`
+        return value.model_copy(deep=True)
+    return copy.deepcopy(value)
 
-    return wrapper
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+def cached(
+    func: Optional[Callable[P, T]] = None,
+    *,
+    maxsize: int = 128,
+    ttl: Optional[float] = None,
+    copy_result: bool = False,
+):
+    """
+    Мемоизация с отдельным LRU (или TTL, если задан `ttl`) кешем на каждую функцию.
+
+    `maxsize=0` отключает кеширование. `copy_result=True` нужен для изменяемых
+    результатов (списки, `InlineKeyboardMarkup`): вызывающий получает копию и
+    не может испортить закешированное значение.
+    """
+
+    def decorator(func: Callable[P, T]) -> Callable[P, T]:
+        func_cache: Optional[Cache] = None
+        if maxsize > 0:
+            func_cache = TTLCache(maxsize, ttl) if ttl else LRUCache(maxsize)
+        hits = misses = 0
+
+        @wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+            nonlocal hits, misses
+
+            if func_cache is None:
+                misses += 1
+                return func(*args, **kwargs)
+
+            try:
+                key = (make_hashable(args), make_hashable(kwargs))
+                result: T = func_cache[key]
+            except TypeError:  # нехешируемые аргументы
+                misses += 1
+                return func(*args, **kwargs)
+            except KeyError:
+                misses += 1
+                result = func(*args, **kwargs)
+                func_cache[key] = result
+            else:
+                hits += 1
+
+            return _copy_result(result) if copy_result else result
+
+        def cache_info() -> CacheInfo:
+            currsize = len(func_cache) if func_cache is not None else 0
+            return CacheInfo(hits, misses, maxsize, currsize)
+
+        def cache_clear() -> None:
+            nonlocal hits, misses
+            hits = misses = 0
+            if func_cache is not None:
+                func_cache.clear()
+
+        wrapper.cache_info = cache_info  # type: ignore
+        wrapper.cache_clear = cache_clear  # type: ignore
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
 
 
-@cached
 def split_string(text: str, chars_per_string: int) -> list[str]:
     return [text[i : i + chars_per_string] for i in range(0, len(text), chars_per_string)]
 
@@ -132,22 +205,15 @@ def get_time_difference_string(d: timedelta) -> str:
     return data
 
 
-@cached
 def get_user_tag(user: UserModel):
     return f"<a href='tg://user?id={user.id}'>{user.name}</a>"
 
 
-@cached
 def get_item(name: str) -> Union[Item, NoReturn]:
-    for item in ITEMS:
-        item.name = item.name.lower()
-        if item.name == name:
-            return item
-        if item.altnames and name in item.altnames:
-            return item
-        if name == item.translit():
-            return item
-    raise ItemNotFoundError(f"Item {name} not found")
+    try:
+        return ITEMS_REGISTRY[name]
+    except KeyError:
+        raise ItemNotFoundError(f"Item {name} not found") from None
 
 
 @cached
@@ -158,7 +224,6 @@ def get_item_emoji(item_name: str) -> str:
         return ""
 
 
-@cached
 def get_item_count_for_rarity(rarity: ItemRarity) -> int:
     if rarity == ItemRarity.COMMON:
         quantity = random.randint(5, 20)
@@ -173,35 +238,82 @@ def get_item_count_for_rarity(rarity: ItemRarity) -> int:
     return quantity
 
 
+class Hint(NamedTuple):
+    message: str
+    url: Optional[str] = None
+
+
+def _load_hints() -> tuple[Hint, ...]:
+    with open(Path(__file__).parent.parent / "base" / "hints.json", encoding="utf-8") as f:
+        return tuple(Hint(**hint) for hint in json.load(f))
+
+
+HINTS: Final = _load_hints()
+
+# "печатает..." в телеграме гаснет через 5 секунд, его нужно повторять
+CHAT_ACTION_INTERVAL: Final = 4.5
+
+
 class Loading:
+    """
+    Индикатор загрузки на время хендлера (`config.loading`).
+
+    Показывается только если хендлер работает дольше `threshold`, так что
+    быстрые команды не тратят лишние запросы к телеграму.
+    """
+
     def __init__(self, message: Message):
         self.message = message
-        self.loading_message: Message
+        self.loading_message: Optional[Message] = None
+        self.mode = LoadingMode(config.loading.mode)
+        self._task: Optional[asyncio.Task] = None
+        self._sending = False
 
-    async def __aenter__(self):
-        with open("src/base/hints.json") as f:
-            hints: list[dict[str, str]] = json.load(f)
+    async def _send_hint(self):
+        hint = random.choice(HINTS)
+        markup = quick_markup({"Тык": {"url": hint.url}}) if hint.url else None
+        mess = f"<b>Загрузка...</b>\n\n<i>{hint.message}</i>"
 
-        hint = random.choice(hints)
+        try:
+            self.loading_message = await self.message.reply(mess, reply_markup=markup)
+        except TelegramAPIError:
+            self.loading_message = await self.message.answer(mess, reply_markup=markup)
 
-        if "url" in hint:
-            markup = quick_markup({"Тык": {"url": hint["url"]}})
-        else:
-            markup = None
+    async def _show(self):
+        if config.loading.threshold > 0:
+            await asyncio.sleep(config.loading.threshold)
 
-        mess = f"<b>Загрузка...</b>\n\n<i>{hint['message']}</i>"
+        if self.mode == LoadingMode.MESSAGE:
+            # с этого момента отмена может оставить сообщение, которое некому удалить
+            self._sending = True
+            await self._send_hint()
+            return
 
-        try:
-            msg = await self.loading_message.reply(mess, reply_markup=markup)
-        except Exception:
-            msg = await self.message.answer(mess, reply_markup=markup)
-        self.loading_message = msg
+        while True:
+            await self.message.bot.send_chat_action(self.message.chat.id, "typing")
+            await asyncio.sleep(CHAT_ACTION_INTERVAL)
+
+    async def __aenter__(self):
+        if self.mode == LoadingMode.OFF:
+            return
+        self._task = asyncio.create_task(self._show())
 
     async def __aexit__(self, exc_type, exc_value, traceback):
-        await self.loading_message.delete()
+        if self._task is None:
+            return
+
+        if self._sending:
+            with suppress(TelegramAPIError):
+                await self._task
+        else:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError, TelegramAPIError):
+                await self._task
+
+        if self.loading_message:
+            await safe(self.loading_message.delete())
 
 
-@cached
 def get_pager_controllers(name: str, pos: int, user_id: Union[int, str]):
     return [
         InlineKeyboardButton(
@@ -212,24 +324,6 @@ def get_pager_controllers(name: str, pos: int, user_id: Union[int, str]):
     ]
 
 
-def get_middle_item_price(name: str) -> int:
-    from database.funcs import database
-
-    item = get_item(name)
-    market_items = database.market_items.get_all(name=item.name)
-
-    price = 0
-    items = [market_item.price / market_item.quantity for market_item in market_items]
-    try:
-        if item.price:
-            price += statistics.median([item.price, *items])
-        else:
-            price += statistics.median(items)
-    except statistics.StatisticsError:
-        pass
-    return int(price)
-
-
 @cached
 def calc_xp_for_level(level: int) -> int:
     return 5 * level + 50 * level + 100
@@ -249,23 +343,21 @@ async def send_channel_subscribe_message(message: Message):
     await message.reply(mess, reply_markup=markup)
 
 
-def check_version() -> str:  # type: ignore
+async def _fetch_latest_version() -> str:
     url = "https://api.github.com/repos/HamletSargsyan/livebot/releases/latest"
+    async with httpx.AsyncClient() as client:
+        response = await client.get(url)
 
-    if "bot_latest_version" in cache:
-        version: Version = Version.parse(cache.get("bot_latest_version"))  # type: ignore
-    else:
-        response = httpx.get(url)
+    if response.status_code != 200:
+        logger.error(response.text)
+        response.raise_for_status()
 
-        if response.status_code != 200:
-            logger.error(response.text)
-            response.raise_for_status()
+    latest_release = response.json()
+    return str(Version.parse(latest_release["tag_name"].replace("v", "")))
 
-        latest_release = response.json()
-        version = Version.parse(latest_release["tag_name"].replace("v", ""))
-        cache["bot_latest_version"] = str(version)
 
-    latest_version = version
+async def check_version() -> str:  # type: ignore
+    latest_version = Version.parse(await version_cache.get("latest", _fetch_latest_version))
 
     match VERSION.compare(latest_version):
         case -1:
@@ -296,36 +388,37 @@ def achievement_progress(user: UserModel, name: str) -> str:
     return progress
 
 
-def is_completed_achievement(user: UserModel, name: str) -> bool:
+async def is_completed_achievement(user: UserModel, name: str) -> bool:
     from database.funcs import database
 
     try:
-        database.achievements.get(owner=user._id, name=name)
+        await database.achievements.async_get(owner=user._id, name=name)
         return True
     except NoResult:
         return False
 
 
 async def award_user_achievement(user: UserModel, achievement: Achievement):
-    if is_completed_achievement(user, achievement.name):
+    if await is_completed_achievement(user, achievement.name):
         return
-    from base.player import get_or_add_user_item
+    from base.player import add_items
     from database.funcs import database
 
     ach = AchievementModel(name=achievement.name, owner=user._id)
     await database.achievements.async_add(**ach.to_dict())
 
     reward = ""
+    items: dict[str, int] = {}
 
     for item, quantity in achievement.reward.items():
-        reward = f"+ {quantity} {item} {get_item_emoji(item)}\n"
+        reward += f"+ {quantity} {item} {get_item_emoji(item)}\n"
         if item == "бабло":
-            user.coin += quantity
-            await database.users.async_update(**user.to_dict())
+            user.inc(coin=quantity)
         else:
-            user_item = get_or_add_user_item(user, item)
-            user_item.quantity += quantity
-            await database.items.async_update(**user_item.to_dict())
+            items[item] = quantity
+
+    await add_items(user, items)
+    await database.users.async_update(user)
 
     await bot.send_message(
         user.id,
@@ -333,8 +426,8 @@ async def award_user_achievement(user: UserModel, achievement: Achievement):
     )
 
 
-def increment_achievement_progress(user: UserModel, key: str, quantity: int = 1):
-    if not is_completed_achievement(user, key.replace("-", " ")):
+async def increment_achievement_progress(user: UserModel, key: str, quantity: int = 1):
+    if not await is_completed_achievement(user, key.replace("-", " ")):
         from database.funcs import database
 
         if key in user.achievement_progress:
@@ -342,10 +435,50 @@ def increment_achievement_progress(user: UserModel, key: str, quantity: int = 1)
         else:
             user.achievement_progress[key] = quantity
 
-        database.users.update(
+        await database.users.async_update(
             user._id,
             **{f"achievement_progress.{key}": user.achievement_progress[key]},
         )
+        user.mark_clean("achievement_progress")
+
+
+async def increment_achievements_progress(
+    progress: list[tuple[Union[UserModel, ObjectId], str, int]],
+):
+    """
+    `increment_achievement_progress` для нескольких пользователей сразу: один запрос
+    за выполненными достижениями и один `bulk_write` с `$inc`. Вместо модели можно
+    передать `_id` пользователя, которого нет в памяти.
+    """
+    from database.funcs import database
+
+    completed = {
+        (achievement["owner"], achievement["name"])
+        async for achievement in database.achievements.async_collection.find(
+            {
+                "$or": [
+                    {"owner": getattr(user, "_id", user), "name": key.replace("-", " ")}
+                    for user, key, _ in progress
+                ]
+            },
+            {"owner": 1, "name": 1},
+        )
+    }
+
+    requests = []
+    for user, key, quantity in progress:
+        owner = getattr(user, "_id", user)
+        if (owner, key.replace("-", " ")) in completed:
+            continue
+        requests.append(
+            UpdateOne({"_id": owner}, {"$inc": {f"achievement_progress.{key}": quantity}})
+        )
+        if isinstance(user, UserModel):
+            user.achievement_progress[key] = user.achievement_progress.get(key, 0) + quantity
+            user.mark_clean("achievement_progress")
+
+    if requests:
+        await database.users.async_bulk_write(requests)
 
 
 @cached
@@ -371,9 +504,16 @@ def create_progress_bar(percentage: float) -> str:
     return progress_bar
 
 
-def achievement_status(user: UserModel, achievement: Achievement) -> int:
+async def get_completed_achievements(user: UserModel) -> set[str]:
+    from database.funcs import database
+
+    achievements = await database.achievements.async_get_all(owner=user._id)
+    return {achievement.name for achievement in achievements}
+
+
+def achievement_status(user: UserModel, achievement: Achievement, completed: set[str]) -> int:
     progress = user.achievement_progress.get(achievement.key, 0)
-    is_completed = is_completed_achievement(user, achievement.name)
+    is_completed = achievement.name in completed
     if progress > 0 and not is_completed:
         return 0  # В процессе
     if is_completed:
@@ -419,7 +559,7 @@ class MessageEditor:
         self.exit_funcs: set[Callable[[], None | Any]] = set()
 
     async def __aenter__(self) -> Self:
-        self.message = await antiflood(self.user_message.reply(self._mess))
+        self.message = await self.user_message.reply(self._mess)
 
         return self
 
@@ -429,15 +569,19 @@ class MessageEditor:
 
     async def write(self, new_text: str):
         self._mess = text = f"{self._mess}\n<b>*</b>  {new_text}"
-        self.message = await antiflood(self.message.edit_text(text))
+        self.message = await self.message.edit_text(text)
+
+    async def status(self, text: str):
+        # строка под логом, перезаписывается при каждом вызове
+        self.message = await self.message.edit_text(f"{self._mess}\n\n<i>{text}</i>")
 
 
 async def safe(func: Awaitable[T]) -> Optional[T]:
     with suppress(TelegramAPIError):
-        return await antiflood(func)
+        return await func
 
 
-@cached
+@cached(maxsize=1024, copy_result=True)
 def quick_markup(values: dict[str, dict[str, Any]], row_width: int = 2) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     buttons = [InlineKeyboardButton(text=text, **kwargs) for text, kwargs in values.items()]
@@ -446,13 +590,12 @@ def quick_markup(values: dict[str, dict[str, Any]], row_width: int = 2) -> Inlin
     return builder.as_markup()
 
 
+@deprecated(
+    deprecated_in=Version(11, 1, 0),
+    remove_in=Version(12, 0, 0),
+    message="лимиты и повторы теперь делает `OutboundMiddleware`, просто используйте `await`",
+)
 async def antiflood(func: Awaitable[T]) -> T:
-    number_retries = 5
-    for _ in range(number_retries):
-        try:
-            return await func
-        except TelegramRetryAfter as e:
-            await asyncio.sleep(e.retry_after)
     return await func
 
 
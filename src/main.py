@@ -1,16 +1,20 @@
 import argparse
 import asyncio
+import sys
 
 from aiogram import Dispatcher
 from aiogram.fsm.storage.redis import RedisStorage
 from aiogram.types import BotCommand
 from tinylogging import Level
 
+from base.market import rebuild_price_stats
 from config import aiogram_logger, bot, config, logger
+from database.cache import listen_invalidations
 from database.funcs import database
 from handlers import router as handlers_router
 from helpers.exceptions import NoResult
 from middlewares import middlewares
+from middlewares.outbound import OutboundMiddleware
 from tasks import run_tasks
 
 dp = Dispatcher(
@@ -51,8 +55,10 @@ async def configure_bot_commands():
 
 
 def init_middlewares():
+    bot.session.middleware(OutboundMiddleware())
     for middleware in middlewares:
         dp.message.middleware(middleware())
+        dp.callback_query.middleware(middleware())
 
 
 async def main(args: argparse.Namespace):
@@ -66,8 +72,11 @@ async def main(args: argparse.Namespace):
     else:
         aiogram_logger.setLevel(30)  # warning
 
+    await database.async_ensure_indexes()
+    await rebuild_price_stats()
     await configure_bot_commands()
     init_middlewares()
+    asyncio.create_task(listen_invalidations())
 
     for uid in config.telegram.owners:
         try:
@@ -75,7 +84,7 @@ async def main(args: argparse.Namespace):
         except NoResult:
             continue
         user.is_admin = True
-        await database.users.async_update(**user.to_dict())
+        await database.users.async_update(user)
 
     if not args.without_tasks:
         run_tasks()
@@ -87,7 +96,17 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Запуск телеграм-бота.")
     parser.add_argument("--debug", action="store_true", help="Запуск в режиме отладки")
     parser.add_argument("--without-tasks", action="store_true", help="Запуск без задач")
+    parser.add_argument(
+        "--check-indexes",
+        action="store_true",
+        help="Создать индексы, проверить планы запросов на COLLSCAN и выйти",
+    )
 
     args = parser.parse_args()
 
+    if args.check_indexes:
+        from database.explain import check_query_plans
+
+        sys.exit(check_query_plans())
+
     asyncio.run(main(args))
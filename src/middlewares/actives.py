@@ -1,10 +1,10 @@
-from typing import Any, Awaitable, Callable
+from typing import Any, Awaitable, Callable, Optional
 
 from aiogram import BaseMiddleware
-from aiogram.types import CallbackQuery, Message, TelegramObject
+from aiogram.types import TelegramObject
 
-from config import TELEGRAM_ID
 from database.funcs import database
+from database.models import UserModel
 from helpers.datetime_utils import utcnow
 from helpers.utils import increment_achievement_progress
 
@@ -17,19 +17,18 @@ class ActiveMiddleware(BaseMiddleware):
         data: dict[str, Any],
     ):
         result = await handler(event, data)
-        if isinstance(event, (Message, CallbackQuery)):
-            if event.from_user.id == TELEGRAM_ID or event.from_user.is_bot:
-                return
 
-            user_id = event.from_user.id
-            user = await database.users.async_get(id=user_id)
+        user: Optional[UserModel] = data.get("user")
+        if user is None:
+            return result
 
-            last_active_time = user.last_active_time
+        last_active_time = user.last_active_time
 
-            user.last_active_time = utcnow()
-            await database.users.async_update(**user.to_dict())
+        user.last_active_time = utcnow()
+        # единственная запись пользователя в конце апдейта
+        await database.users.async_update(user)
 
-            if (utcnow() - last_active_time).days >= 1:
-                increment_achievement_progress(user, "новичок")
-                increment_achievement_progress(user, "олд")
-            return result
+        if (utcnow() - last_active_time).days >= 1:
+            await increment_achievement_progress(user, "новичок")
+            await increment_achievement_progress(user, "олд")
+        return result
@@ -0,0 +1,243 @@
+import asyncio
+import heapq
+import itertools
+from contextvars import ContextVar
+from typing import Any, Final, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage,
+    EditMessageCaption,
+    EditMessageMedia,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    ForwardMessage,
+    SendAnimation,
+    SendAudio,
+    SendDice,
+    SendDocument,
+    SendLocation,
+    SendMediaGroup,
+    SendMessage,
+    SendPhoto,
+    SendPoll,
+    SendSticker,
+    SendVideo,
+    SendVideoNote,
+    SendVoice,
+)
+from aiogram.methods.base import TelegramMethod, TelegramType
+from cachetools import TTLCache
+
+from helpers.enums import SendPriority
+from helpers.ratelimit import TokenBucket
+
+# очередь, в которую встают исходящие запросы текущей задачи
+send_priority: ContextVar[SendPriority] = ContextVar(
+    "send_priority", default=SendPriority.INTERACTIVE
+)
+
+# лимиты телеграма: ~30 сообщений в секунду всего, 1 в секунду в личку, 20 в минуту в группу
+GLOBAL_RATE: Final = 30
+PRIVATE_CHAT_RATE: Final = 1
+GROUP_CHAT_RATE: Final = 20 / 60
+CHAT_BURST: Final = 3
+
+MAX_RETRIES: Final = 5
+
+COALESCED_METHODS: Final = (EditMessageText, EditMessageReplyMarkup, EditMessageCaption)
+# лимиты телеграма касаются отправки и правки сообщений, чтение (`get_chat_member`),
+# `send_chat_action`, удаление и модерация идут в обход очередей
+RATE_LIMITED_METHODS: Final = (
+    *COALESCED_METHODS,
+    EditMessageMedia,
+    SendMessage,
+    SendPhoto,
+    SendAnimation,
+    SendAudio,
+    SendDocument,
+    SendSticker,
+    SendVideo,
+    SendVideoNote,
+    SendVoice,
+    SendMediaGroup,
+    SendLocation,
+    SendPoll,
+    SendDice,
+    CopyMessage,
+    ForwardMessage,
+)
+
+
+class PriorityBucket:
+    """
+    `TokenBucket`, который раздает токены в порядке приоритета, а внутри
+    одного приоритета в порядке очереди.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.bucket = TokenBucket(rate, capacity)
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+
+    async def acquire(self, priority: SendPriority):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        await future
+
+    async def _run(self):
+        while self._waiters:
+            await self.bucket.acquire()
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+
+class _PendingEdit:
+    def __init__(self, method: TelegramMethod):
+        self.method = method
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+        # группа правок того же сообщения, собранная, пока эта уже отправлялась
+        self.newer: Optional[_PendingEdit] = None
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    """
+    Общий планировщик исходящих запросов бота.
+
+    Отправка и правка сообщений (`RATE_LIMITED_METHODS`) проходят через глобальный
+    и поканальный лимит, фоновые задачи встают в очередь после интерактивных ответов
+    (`send_priority`),
+    повторные правки одного сообщения, ждущие отправки, схлопываются в последнюю,
+    а на `TelegramRetryAfter` запрос отправляется заново после паузы.
+    """
+
+    def __init__(self):
+        self.global_bucket = PriorityBucket(GLOBAL_RATE)
+        self.chat_buckets: TTLCache[Any, TokenBucket] = TTLCache(maxsize=10_000, ttl=60)
+        self._pending_edits: dict[tuple, _PendingEdit] = {}
+        self._sending_edits: dict[tuple, _PendingEdit] = {}
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = GROUP_CHAT_RATE if is_group else PRIVATE_CHAT_RATE
+            bucket = TokenBucket(rate, CHAT_BURST, min_rate=rate / 4)
+        # переустанавливаем, чтобы продлить ttl активного чата
+        self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _send(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+        chat_id: Any,
+        pending: Optional[_PendingEdit] = None,
+    ):
+        priority = send_priority.get()
+        chat_bucket = self._chat_bucket(chat_id)
+
+        for attempt in range(MAX_RETRIES):
+            if pending and pending.newer:
+                # повтор затер бы более свежую правку, отдаем ее результат
+                return await asyncio.shield(pending.newer.result)
+
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire(priority)
+
+            if pending and attempt == 0:
+                # после ожидания отправляем самую свежую правку и закрываем группу,
+                # правки, пришедшие позже, собираются уже в новую
+                method = pending.method
+                key = self._edit_key(method)
+                if self._pending_edits.get(key) is pending:
+                    del self._pending_edits[key]
+                self._sending_edits[key] = pending
+
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                chat_bucket.penalize(e.retry_after)
+                # флуд-контроль может быть и на весь бот, поэтому ждут все чаты
+                self.global_bucket.bucket.pause(e.retry_after)
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                continue
+            except TelegramNetworkError:
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                await asyncio.sleep(2**attempt)
+                continue
+
+            chat_bucket.recover(chat_bucket.min_rate)
+            return result
+
+    @staticmethod
+    def _edit_key(method: TelegramMethod) -> tuple:
+        return (type(method), method.chat_id, method.message_id)  # type: ignore
+
+    def _close_pending(self, pending: _PendingEdit):
+        key = self._edit_key(pending.method)
+        for edits in (self._pending_edits, self._sending_edits):
+            if edits.get(key) is pending:
+                del edits[key]
+
+    async def _coalesce(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        key = self._edit_key(method)
+        pending = self._pending_edits.get(key)
+        if pending:
+            pending.method = method
+            return await asyncio.shield(pending.result)
+
+        pending = self._pending_edits[key] = _PendingEdit(method)
+        sending = self._sending_edits.get(key)
+        if sending:
+            sending.newer = pending
+        try:
+            result = await self._send(make_request, bot, method, method.chat_id, pending)  # type: ignore
+        except asyncio.CancelledError:
+            self._close_pending(pending)
+            pending.result.cancel()
+            raise
+        except Exception as e:
+            self._close_pending(pending)
+            pending.result.set_exception(e)
+            # исключение уже получат все, кто ждет эту правку
+            pending.result.exception()
+            raise
+        self._close_pending(pending)
+        pending.result.set_result(result)
+        return result
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not isinstance(method, RATE_LIMITED_METHODS):
+            # answer_callback_query, чтение и действия в чате лимитами не ограничиваются
+            return await make_request(bot, method)
+
+        if isinstance(method, COALESCED_METHODS) and method.message_id is not None:
+            return await self._coalesce(make_request, bot, method)
+
+        return await self._send(make_request, bot, method, chat_id)
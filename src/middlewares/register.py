@@ -1,23 +1,37 @@
-from typing import Any, Awaitable, Callable
+from typing import Any, Awaitable, Callable, Optional
 
 from aiogram import BaseMiddleware
-from aiogram.types import Message, TelegramObject
+from aiogram.types import CallbackQuery, Message, TelegramObject, User
 
+from base.player import save_pending_referral
 from config import TELEGRAM_ID, logger
 from database.funcs import database
 from database.models import UserModel
+from helpers.exceptions import NoResult
 from helpers.utils import remove_not_allowed_symbols
 
 
-def register_user(message: Message):
-    user = database.users.check_exists(id=message.from_user.id)
-    if not user:
+async def register_user(tg_user: User, start_param: Optional[str] = None) -> UserModel:
+    try:
+        return await database.users.async_get(id=tg_user.id)
+    except NoResult:
         user = UserModel(
-            id=message.from_user.id,
-            name=remove_not_allowed_symbols(message.from_user.full_name),
+            id=tg_user.id,
+            name=remove_not_allowed_symbols(tg_user.full_name),
         )
-        database.users.add(**user.to_dict())
+        await database.users.async_add(**user.to_dict())
         logger.info(f"Новый пользователь: {user.name} ({user.id})")
+        if start_param:
+            await save_pending_referral(user, start_param)
+        return user
+
+
+def get_start_param(message: Message) -> Optional[str]:
+    """Параметр `/start <param>` из диплинка."""
+    command, _, param = (message.text or "").partition(" ")
+    if command.split("@")[0] != "/start":
+        return None
+    return param.strip() or None
 
 
 class RegisterMiddleware(BaseMiddleware):
@@ -27,11 +41,13 @@ class RegisterMiddleware(BaseMiddleware):
         event: TelegramObject,
         data: dict[str, Any],
     ):
-        if isinstance(event, Message):
+        if isinstance(event, (Message, CallbackQuery)):
             if event.from_user.id == TELEGRAM_ID or event.from_user.is_bot:
                 return
 
-            register_user(event)
-            if event.reply_to_message:
-                register_user(event.reply_to_message)
+            # пользователь грузится один раз на апдейт, дальше его берут из `data`
+            start_param = get_start_param(event) if isinstance(event, Message) else None
+            data["user"] = await register_user(event.from_user, start_param)
+            if isinstance(event, Message) and event.reply_to_message:
+                await register_user(event.reply_to_message.from_user)
         return await handler(event, data)
@@ -4,7 +4,6 @@ from aiogram import BaseMiddleware
 from aiogram.types import CallbackQuery, Message, TelegramObject
 
 from config import TELEGRAM_ID
-from database.funcs import database
 from database.models import UserModel
 from helpers.utils import get_user_tag, quick_markup
 
@@ -35,7 +34,7 @@ class RuleCheckMiddleware(BaseMiddleware):
             if event.from_user.id == TELEGRAM_ID or event.from_user.is_bot:
                 return
 
-            user = await database.users.async_get(id=event.from_user.id)
+            user: UserModel = data["user"]
 
             if user.accepted_rules:
                 return await handler(event, data)
@@ -46,3 +45,4 @@ class RuleCheckMiddleware(BaseMiddleware):
             if isinstance(event, CallbackQuery) and not event.data.startswith("accept_rules"):
                 await send_rules_message(event.message, user)  # pyright: ignore
                 return
+        return await handler(event, data)
@@ -2,12 +2,14 @@ import asyncio
 
 from tasks.check import check
 from tasks.notification import notification
+from tasks.weather import weather
 
 
 async def setup_tasks():
     tasks = [
         check(),
         notification(),
+        weather(),
     ]
 
     await asyncio.gather(*tasks)
@@ -1,37 +1,173 @@
 import asyncio
 import random
-from itertools import filterfalse
+from datetime import datetime
+from typing import Any
+
+from bson import ObjectId
+from pymongo import UpdateOne
 
 from base.player import check_user_stats
 from database.funcs import database
+from database.models import Row
 from helpers.datetime_utils import utcnow
+from helpers.enums import SendPriority
+from helpers.exceptions import AchievementNotFoundError
+from helpers.utils import batched, get_achievement
+from middlewares.outbound import send_priority
 
+BATCH_SIZE = 500
 
-async def _check():
-    users = await database.users.async_get_all()
+USER_FIELDS = (
+    "_id",
+    "health",
+    "mood",
+    "hunger",
+    "fatigue",
+    "coin",
+    "xp",
+    "max_xp",
+    "violations",
+    "achievement_progress",
+)
+
+STATS = ("health", "mood", "hunger", "fatigue")
+
+
+def _clamped(field: str, delta: int = 0) -> dict[str, Any]:
+    return {"$min": [100, {"$max": [0, {"$add": [f"${field}", delta]}]}]}
+
+
+def _active_violations(now: datetime) -> dict[str, Any]:
+    return {
+        "$filter": {
+            "input": "$violations",
+            "as": "v",
+            "cond": {"$not": [{"$and": ["$$v.until_date", {"$lt": ["$$v.until_date", now]}]}]},
+        }
+    }
+
+
+def _sweep_user(user: Row, now: datetime) -> dict[str, Any]:
+    """
+    Считает изменения пользователя за час и возвращает `$set` стадию
+    для update pipeline (пустая, если писать нечего).
+    """
+    drift: dict[str, int] = {}
+    match random.randint(0, 5):
+        case 0:
+            drift["hunger"] = 1
+        case 1:
+            drift["fatigue"] = 1
+        case 2:
+            drift["mood"] = -1
+
+    stage: dict[str, Any] = {}
+    for field in STATS:
+        current = getattr(user, field)
+        delta = drift.get(field, 0)
+        if min(100, max(0, current + delta)) != current:
+            stage[field] = _clamped(field, delta)
+
+    if user.coin < 0:
+        stage["coin"] = {"$max": [0, "$coin"]}
+
+    if any(v.get("until_date") and v["until_date"] < now for v in user.violations):
+        stage["violations"] = _active_violations(now)
+
+    return stage
+
+
+def _pending_achievements(user: Row) -> set[str] | None:
+    """
+    Имена достижений, для которых набран прогресс. `None` - если в прогрессе
+    есть неизвестные ключи, и пользователя надо проверить полностью.
+    """
+    names = set()
+    for key, progress in user.achievement_progress.items():
+        try:
+            ach = get_achievement(key.lower().replace("-", " "))
+        except AchievementNotFoundError:
+            return None
+        if progress >= ach.need:
+            names.add(ach.name)
+    return names
+
+
+async def _users_to_check(candidates: dict[ObjectId, set[str]]) -> set[ObjectId]:
+    if not candidates:
+        return set()
+
+    completed = await database.achievements.async_collection.find(
+        {"owner": {"$in": list(candidates)}}, {"owner": 1, "name": 1}
+    ).to_list()
+    awarded: dict[ObjectId, set[str]] = {}
+    for ach in completed:
+        awarded.setdefault(ach["owner"], set()).add(ach["name"])
+
+    return {owner for owner, names in candidates.items() if names - awarded.get(owner, set())}
+
+
+async def _sweep_batch(users: list[Row], now: datetime) -> set[ObjectId]:
+    requests = []
+    to_check: set[ObjectId] = set()
+    achievement_candidates: dict[ObjectId, set[str]] = {}
 
     for user in users:
-        user = await database.users.async_get(_id=user._id)
-        match random.randint(0, 5):
-            case 0:
-                user.hunger += 1
-            case 1:
-                user.fatigue += 1
-            case 2:
-                user.mood -= 1
-
-        user.violations = list(
-            filterfalse(
-                lambda v: v.until_date and v.until_date < utcnow(),
-                user.violations,
-            )
-        )
-
-        await database.users.async_update(**user.to_dict())
-        await check_user_stats(user)
+        stage = _sweep_user(user, now)
+        if stage:
+            requests.append(UpdateOne({"_id": user._id}, [{"$set": stage}]))
+
+        if user.xp >= user.max_xp:
+            to_check.add(user._id)
+            continue
+
+        pending = _pending_achievements(user)
+        if pending is None:
+            to_check.add(user._id)
+        elif pending:
+            achievement_candidates[user._id] = pending
+
+    if requests:
+        await database.users.async_bulk_write(requests)
+
+    return to_check | await _users_to_check(achievement_candidates)
+
+
+async def _dog_owners_to_check() -> set[ObjectId]:
+    query = {
+        "$or": [
+            {"$expr": {"$gte": ["$xp", "$max_xp"]}},
+            *({field: {"$lt": 0}} for field in ("health", "hunger", "fatigue")),
+            *({field: {"$gt": 100}} for field in ("health", "hunger", "fatigue")),
+        ]
+    }
+    return {dog.owner async for dog in database.dogs.async_iter_rows(query, ("owner",))}
+
+
+async def _check():
+    now = utcnow()
+    to_check: set[ObjectId] = set()
+
+    # обход всех пользователей держит в памяти только нужные поля, без моделей
+    batch: list[Row] = []
+    async for user in database.users.async_iter_rows({}, USER_FIELDS, batch_size=BATCH_SIZE):
+        batch.append(user)
+        if len(batch) >= BATCH_SIZE:
+            to_check |= await _sweep_batch(batch, now)
+            batch = []
+    if batch:
+        to_check |= await _sweep_batch(batch, now)
+
+    to_check |= await _dog_owners_to_check()
+
+    # полная проверка (левел-ап, достижения, собака) только для тех, кто перешел порог
+    for ids in batched(to_check, BATCH_SIZE):
+        async for user in database.users.async_iter({"_id": {"$in": list(ids)}}):
+            await check_user_stats(user)
 
 
 async def check():
+    send_priority.set(SendPriority.NOTIFICATION)
     while True:
         await _check()
         await asyncio.sleep(3600)  # 1h
@@ -1,17 +1,64 @@
+import asyncio
+import heapq
+from datetime import datetime
+
 from aiogram.exceptions import TelegramAPIError
+from bson import ObjectId
 
 from config import bot
 from database.funcs import database
-from database.models import NotificationModel
+from database.models import NotificationModel, UserModel
 from helpers.datetime_utils import utcnow
+from helpers.enums import SendPriority
 from helpers.exceptions import NoResult
-from helpers.utils import antiflood, quick_markup
+from helpers.utils import quick_markup
+from middlewares.outbound import send_priority
+
+ACTION_FLAGS = {
+    "street": ("walk", "Ты закончил прогулку"),
+    "work": ("work", "Ты закончил работу"),
+    "sleep": ("sleep", "Ты проснулся"),
+    "game": ("game", "Ты проснулся"),
+}
+
 
+class ActionNotifier:
+    """
+    Очередь (min-heap) времен окончания действий пользователей.
 
-async def _notification():
-    users = await database.users.async_get_all()
+    Задача спит до ближайшего времени и отправляет уведомления только тем,
+    у кого действие закончилось, вместо постоянного обхода всех пользователей.
+    """
+
+    def __init__(self) -> None:
+        self._queue: list[tuple[datetime, ObjectId]] = []
+        self._wakeup = asyncio.Event()
+
+    def schedule(self, user: UserModel) -> None:
+        if not user.action:
+            return
+        heapq.heappush(self._queue, (user.action.end, user._id))
+        self._wakeup.set()
+
+    async def _load(self) -> None:
+        users = database.users.async_iter_raw({"action": {"$ne": None}}, ("_id", "action.end"))
+        async for user in users:
+            heapq.heappush(self._queue, (user["action"]["end"], user["_id"]))
+
+    async def _notify(self, _id: ObjectId) -> None:
+        try:
+            user = await database.users.async_get(_id=_id)
+        except NoResult:
+            return
+
+        # действие могли закончить или отменить после постановки в очередь
+        if not user.action:
+            return
+        # время окончания могло сдвинуться, а в базу оно пишется в конце апдейта
+        if user.action.end > utcnow():
+            heapq.heappush(self._queue, (user.action.end, user._id))
+            return
 
-    for user in users:
         try:
             user_notification = await database.notifications.async_get(owner=user._id)
         except NoResult:
@@ -19,36 +66,44 @@ async def _notification():
             id = (await database.notifications.async_add(**user_notification.to_dict())).inserted_id
             user_notification._id = id
 
-        user = await database.users.async_get(_id=user._id)
-        if not user.action:
-            continue
-        try:
-            current_time = utcnow()
-            if user.action.end <= current_time:
-                if user.action.type == "street" and not user_notification.walk:
-                    user_notification.walk = True
-                    mess = "Ты закончил прогулку"
-                elif user.action.type == "work" and not user_notification.work:
-                    user_notification.work = True
-                    mess = "Ты закончил работу"
-                elif user.action.type == "sleep" and not user_notification.sleep:
-                    user_notification.sleep = True
-                    mess = "Ты проснулся"
-                elif user.action.type == "game" and not user_notification.game:
-                    user_notification.game = True
-                    mess = "Ты проснулся"
-                else:
-                    continue
-
-                markup = quick_markup({"Дом": {"callback_data": f"open home {user.id}"}})
-                await antiflood(bot.send_message(user.id, mess, reply_markup=markup))
+        flag, mess = ACTION_FLAGS[user.action.type]
+        if getattr(user_notification, flag):
+            return
 
+        setattr(user_notification, flag, True)
+        markup = quick_markup({"Дом": {"callback_data": f"open home {user.id}"}})
+        try:
+            await bot.send_message(user.id, mess, reply_markup=markup)
         except TelegramAPIError:
-            continue
+            pass
+
+        await database.notifications.async_update(user_notification)
+
+    async def run(self) -> None:
+        send_priority.set(SendPriority.NOTIFICATION)
+        await self._load()
+
+        while True:
+            self._wakeup.clear()
+            if not self._queue:
+                await self._wakeup.wait()
+                continue
+
+            end, _id = self._queue[0]
+            delay = (end - utcnow()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._queue)
+            await self._notify(_id)
+
 
-        await database.notifications.async_update(**user_notification.to_dict())
+notifier = ActionNotifier()
 
 
 async def notification():
-    while True:
-        await _notification()
+    await notifier.run()
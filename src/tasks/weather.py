@@ -0,0 +1,5 @@
+from base.weather import weather_service
+
+
+async def weather():
+    await weather_service.run()
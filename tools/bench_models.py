@@ -0,0 +1,133 @@
+"""
+Сравнение сгенерированных кодеков моделей со старым путем (`dacite.from_dict` и `asdict`)
+и памяти, которую занимают пользователи в виде моделей, словарей и `Row`.
+
+Запускается из корня репозитория, рядом с `config.toml`:
+
+    python3 tools/bench_models.py [-n 20000] [--users 100000]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+from dataclasses import asdict
+from datetime import timedelta
+
+import bson
+from bson import CodecOptions, Int64, ObjectId
+from dacite import from_dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from database.models import ItemModel, UserAction, UserModel, Violation  # noqa: E402
+from helpers.datetime_utils import utcnow  # noqa: E402
+from tasks.check import USER_FIELDS  # noqa: E402
+
+# как у клиентов в `database.funcs`
+CODEC_OPTIONS = CodecOptions(tz_aware=True)
+
+
+def old_to_dict(obj) -> dict:
+    result = {}
+    for key, value in asdict(obj).items():
+        if isinstance(value, bool):
+            result[key] = value
+        elif isinstance(value, int):
+            result[key] = Int64(value)
+        else:
+            result[key] = value
+    return result
+
+
+def sample_user() -> UserModel:
+    return UserModel(
+        id=5161392463,
+        name="test",
+        level=12,
+        xp=40.5,
+        coin=1500,
+        violations=[Violation("спам", "warn"), Violation("флуд", "mute", until_date=utcnow())],
+        action=UserAction("street", utcnow() + timedelta(minutes=30)),
+        achievement_progress={"новичок": 3, "богач": 10},
+    )
+
+
+def sample_item() -> ItemModel:
+    return ItemModel(name="буханка", quantity=7, owner=ObjectId())
+
+
+def bench(name: str, obj, number: int):
+    cls = type(obj)
+    data = old_to_dict(obj)
+
+    new_data = obj.to_dict()
+    assert new_data == data, f"{name}: to_dict отличается от asdict"
+    assert all(type(new_data[key]) is type(value) for key, value in data.items()), (
+        f"{name}: типы значений to_dict отличаются от asdict"
+    )
+    assert cls.from_dict(data) == from_dict(cls, data), f"{name}: from_dict отличается от dacite"
+
+    rows = [
+        ("to_dict", lambda: old_to_dict(obj), obj.to_dict),
+        ("from_dict", lambda: from_dict(cls, data), lambda: cls.from_dict(data)),
+    ]
+    for label, old, new in rows:
+        old_time = timeit.timeit(old, number=number) / number * 1e6
+        new_time = timeit.timeit(new, number=number) / number * 1e6
+        print(
+            f"{name:<10} {label:<10} старый: {old_time:7.2f} мкс"
+            f"  кодек: {new_time:7.2f} мкс  x{old_time / new_time:.1f}"
+        )
+
+
+def measure(convert, docs: list[bytes]) -> float:
+    """Байт на пользователя, которые держит список `convert(doc)`."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # каждый документ декодируется заново со своими вложенными объектами, как из курсора
+    rows = [convert(bson.decode(raw, CODEC_OPTIONS)) for raw in docs]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del rows
+    return size / len(docs)
+
+
+def bench_memory(users: int):
+    base = old_to_dict(sample_user())
+    docs = [
+        bson.encode({**base, "_id": ObjectId(), "id": index, "name": f"user{index}"})
+        for index in range(users)
+    ]
+    full_row = UserModel.row_type()
+    check_row = UserModel.row_type(*USER_FIELDS)
+
+    rows = [
+        ("UserModel", UserModel.from_dict),
+        ("UserModel (track=False)", lambda doc: UserModel.from_dict(doc, track=False)),
+        ("dict", lambda doc: doc),
+        ("Row (все поля)", full_row.from_dict),
+        ("Row (поля check)", check_row.from_dict),
+    ]
+    print(f"\nПамять на {users} пользователей")
+    for label, convert in rows:
+        per_user = measure(convert, docs)
+        print(f"{label:<24} {per_user:8.0f} байт/польз.  {per_user * users / 2**20:7.1f} МиБ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк кодеков моделей")
+    parser.add_argument("-n", "--number", type=int, default=20_000, help="Кол-во повторов")
+    parser.add_argument(
+        "--users", type=int, default=100_000, help="Кол-во пользователей для замера памяти"
+    )
+    args = parser.parse_args()
+
+    bench("UserModel", sample_user(), args.number)
+    bench("ItemModel", sample_item(), args.number)
+    bench_memory(args.users)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,10 @@ config = {
     "weather": {
         "region": "",
     },
+    "loading": {
+        "mode": "message",
+        "threshold": 0.5,
+    },
     "event": {
         "start_time": "",
         "end_time": "",